@@ -0,0 +1,113 @@
+"""
+Generation of synthetic content in the test app's models, for benchmarking transfers at scale
+"""
+import math
+import os
+import uuid
+
+from django.core.files.images import ImageFile
+from django.utils import timezone
+from wagtail.images.models import Image
+
+from tests.models import Advert, Category, PageWithStreamField, SimplePage, SponsoredPage
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'fixtures')
+
+
+def create_images(count, prefix):
+    images = []
+    with open(os.path.join(FIXTURES_DIR, 'wagtail.jpg'), 'rb') as f:
+        for i in range(count):
+            f.seek(0)
+            images.append(Image.objects.create(
+                title='%s image %d' % (prefix, i),
+                file=ImageFile(f, name='%s-%d.jpg' % (prefix, i)),
+            ))
+    return images
+
+
+def create_snippets(count, prefix):
+    """
+    Create count Adverts, and a Category for every 10 of them
+    """
+    adverts = [
+        Advert.objects.create(slogan='%s advert %d' % (prefix, i), run_until=timezone.now())
+        for i in range(count)
+    ]
+    categories = [
+        Category.objects.create(name='%s category %d' % (prefix, i), colour='blue')
+        for i in range(max(1, count // 10))
+    ]
+    return adverts, categories
+
+
+def get_stream_data(block_count, page_ids, image_ids, offset=0):
+    """
+    Return raw StreamField data of block_count blocks, cycling through the block types of
+    BaseStreamBlock that contain references to the given pages and images (starting from the
+    image at offset)
+    """
+    blocks = []
+    for i in range(block_count):
+        page_id = page_ids[i % len(page_ids)]
+        block_type = ['rich_text', 'link_block', 'list_of_pages', 'integer', 'list_of_captioned_pages'][i % 5]
+        if block_type == 'rich_text':
+            value = '<p>Paragraph %d with a <a linktype="page" id="%d">page link</a>.</p>' % (i, page_id)
+            if image_ids:
+                value += '<embed embedtype="image" id="%d" format="left" alt="image"/>' % image_ids[(offset + i) % len(image_ids)]
+        elif block_type == 'link_block':
+            value = {'page': page_id, 'text': 'Link %d' % i}
+        elif block_type == 'list_of_pages':
+            value = page_ids[:3]
+        elif block_type == 'integer':
+            value = i
+        else:
+            value = [{'page': page_id, 'text': 'Captioned link %d' % i} for page_id in page_ids[:2]]
+        blocks.append({'type': block_type, 'value': value, 'id': str(uuid.uuid4())})
+    return blocks
+
+
+def generate_content(parent, pages, depth=3, stream_blocks=5, images=0, snippets=0):
+    """
+    Create a tree of the given number of pages (including its root) under parent, at most depth
+    levels deep. Two in every three pages are PageWithStreamFields with stream_blocks blocks
+    referencing other pages and images; the rest are SponsoredPages with an advert and categories.
+    images images and snippets adverts are created for the pages to refer to. Returns the root page
+    of the tree.
+    """
+    prefix = 'benchmark-%s' % uuid.uuid4().hex[:8]
+    image_ids = [image.pk for image in create_images(images, prefix)]
+    adverts, categories = create_snippets(snippets, prefix)
+
+    root = parent.add_child(instance=SimplePage(title='Benchmark', slug=prefix, intro='Benchmark content'))
+    page_ids = [root.pk]
+    branching = max(2, math.ceil(pages ** (1 / max(depth, 1))))
+    queue = [(root, 1)]
+
+    while len(page_ids) < pages:
+        if queue:
+            parent_page, level = queue.pop(0)
+        else:
+            parent_page, level = root, 1
+
+        for _ in range(branching):
+            if len(page_ids) >= pages:
+                break
+            i = len(page_ids)
+            if i % 3 == 0 and adverts:
+                page = SponsoredPage(
+                    title='Page %d' % i, slug='page-%d' % i, intro='Sponsored page %d' % i,
+                    advert=adverts[i % len(adverts)],
+                )
+                page.categories = [categories[i % len(categories)]]
+            else:
+                page = PageWithStreamField(
+                    title='Page %d' % i, slug='page-%d' % i,
+                    body=get_stream_data(stream_blocks, page_ids[-3:], image_ids, offset=i),
+                )
+            parent_page.add_child(instance=page)
+            page_ids.append(page.pk)
+            if level < depth:
+                queue.append((page, level + 1))
+
+    return root
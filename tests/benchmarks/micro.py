@@ -0,0 +1,206 @@
+"""
+Micro-benchmarks of the reference handling in StreamField and rich text, which runs on every
+StreamField and RichTextField during export and import. Each case is timed with timeit, after a
+number of warmup calls, and the best of several repetitions is taken. Results can be compared
+with a saved baseline, to detect regressions.
+"""
+import json
+import os
+import timeit
+import uuid
+
+from wagtail.images.models import Image
+from wagtail.models import Page
+
+from tests.blocks import BaseStreamBlock
+from wagtail_transfer.richtext import get_reference_handler
+from wagtail_transfer.streamfield import get_block_handler, get_object_references, update_object_ids
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'micro_baseline.json')
+
+# sizes of the block trees (in top-level blocks) and rich text (in bytes) benchmarked
+STREAM_SIZES = [100, 1000]
+HTML_SIZES = [1024, 10 * 1024, 100 * 1024, 1024 * 1024]
+
+
+def get_destination_ids(count):
+    return {
+        **{(Page, i): i + 100000 for i in range(count)},
+        **{(Image, i): i + 100000 for i in range(count)},
+    }
+
+
+def get_block(block_type, value):
+    return {'type': block_type, 'value': value, 'id': str(uuid.uuid4())}
+
+
+def get_flat_stream(size):
+    """
+    A stream of page choosers and lists of page choosers
+    """
+    return [
+        get_block('page', i) if i % 2 else get_block('list_of_pages', list(range(i, i + 10)))
+        for i in range(size)
+    ]
+
+
+def get_nested_stream(size):
+    """
+    A stream of nested streams, structs and lists of structs, each containing choosers
+    """
+    blocks = []
+    for i in range(size):
+        if i % 3 == 0:
+            blocks.append(get_block('stream', [get_block('page', i + j) for j in range(5)]))
+        elif i % 3 == 1:
+            blocks.append(get_block('list_of_captioned_pages', [
+                {'page': i + j, 'text': 'Link %d' % j} for j in range(5)
+            ]))
+        else:
+            blocks.append(get_block('link_block', {'page': i, 'text': 'Link %d' % i}))
+    return blocks
+
+
+def get_html(size):
+    """
+    Rich text of approximately size bytes, with page links, image embeds and external links
+    """
+    paragraphs = []
+    length = 0
+    i = 0
+    while length < size:
+        paragraph = (
+            '<p>Paragraph %d links to <a linktype="page" id="%d">a page</a> and '
+            '<a href="https://example.com/%d">an external site</a>.</p>'
+            '<embed embedtype="image" id="%d" format="left" alt="Image %d"/>'
+        ) % (i, i, i, i, i)
+        paragraphs.append(paragraph)
+        length += len(paragraph)
+        i += 1
+    return ''.join(paragraphs)
+
+
+def get_rich_text_stream(size):
+    """
+    A stream of rich text blocks, each with a few links
+    """
+    return [get_block('rich_text', get_html(200)) for i in range(size)]
+
+
+def count_blocks(stream_block, stream):
+    """
+    Return the number of blocks in the stream that hold values, rather than other blocks
+    """
+    count = 0
+
+    def count_block(block, value):
+        nonlocal count
+        count += 1
+        return value
+
+    get_block_handler(stream_block).map_over_json(stream, count_block)
+    return count
+
+
+class StreamCase:
+    unit = 'ns/block'
+
+    def __init__(self, name, stream, operation):
+        self.name = name
+        self.stream_block = BaseStreamBlock()
+        self.stream = stream
+        self.operation = operation
+        self.size = count_blocks(self.stream_block, stream)
+        self.destination_ids = get_destination_ids(len(stream) + 10)
+
+    def __call__(self):
+        if self.operation == 'get_object_references':
+            get_object_references(self.stream_block, self.stream)
+        else:
+            update_object_ids(self.stream_block, self.stream, self.destination_ids)
+
+    def get_rate(self, seconds):
+        return seconds * 1e9 / self.size
+
+
+class RichTextCase:
+    unit = 'MB/s'
+
+    def __init__(self, name, html, operation):
+        self.name = name
+        self.html = html
+        self.operation = operation
+        self.size = len(html.encode('utf-8'))
+        self.destination_ids = get_destination_ids(len(html) // 100)
+
+    def __call__(self):
+        if self.operation == 'get_objects':
+            get_reference_handler().get_objects(self.html)
+        else:
+            get_reference_handler().update_ids(self.html, self.destination_ids)
+
+    def get_rate(self, seconds):
+        return self.size / seconds / (1024 * 1024)
+
+
+def get_cases():
+    cases = []
+    for size in STREAM_SIZES:
+        for shape, get_stream in [
+            ('flat', get_flat_stream), ('nested', get_nested_stream), ('rich_text', get_rich_text_stream)
+        ]:
+            stream = get_stream(size)
+            for operation in ['get_object_references', 'update_object_ids']:
+                cases.append(StreamCase('streamfield.%s.%s.%d' % (operation, shape, size), stream, operation))
+    for size in HTML_SIZES:
+        html = get_html(size)
+        for operation in ['get_objects', 'update_ids']:
+            cases.append(RichTextCase('richtext.%s.%dkb' % (operation, size // 1024), html, operation))
+    return cases
+
+
+def measure(func, warmup=3, repeat=5):
+    """
+    Return the best time, in seconds, of a call to func over repeat repetitions of enough calls to
+    take at least 0.2 seconds, after warmup calls
+    """
+    for i in range(warmup):
+        func()
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run_microbenchmarks(warmup=3, repeat=5, cases=None):
+    """
+    Run the given benchmark cases (all of them by default), returning a dict mapping case names to
+    dicts of the seconds per call, the rate in the case's unit and the unit
+    """
+    results = {}
+    for case in (cases if cases is not None else get_cases()):
+        seconds = measure(case, warmup=warmup, repeat=repeat)
+        results[case.name] = {'seconds': seconds, 'rate': case.get_rate(seconds), 'unit': case.unit}
+    return results
+
+
+def load_baseline(path=BASELINE_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    with open(path, 'w') as f:
+        json.dump({name: result['seconds'] for name, result in sorted(results.items())}, f, indent=2)
+        f.write('\n')
+
+
+def get_regressions(results, baseline, tolerance):
+    """
+    Return a list of (name, seconds, baseline seconds) for the results that are slower than the
+    baseline by more than tolerance (a fraction; 0.5 allows results to be up to 50% slower)
+    """
+    return [
+        (name, result['seconds'], baseline[name])
+        for name, result in results.items()
+        if name in baseline and result['seconds'] > baseline[name] * (1 + tolerance)
+    ]
@@ -0,0 +1,150 @@
+"""
+Running of end-to-end transfer benchmarks: a tree of synthetic content is generated, exported
+through the export API and imported back into the same database as a copy, within a transaction
+that is rolled back afterwards.
+"""
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.db import transaction
+from wagtail.models import Page
+
+from wagtail_transfer.imports import run_import
+from wagtail_transfer.signals import transfer_export_finished, transfer_import_finished
+
+from .content import generate_content
+
+
+# the source configuration for benchmarks, which transfers content from this site to itself
+BENCHMARK_SOURCE = {
+    'BASE_URL': 'http://testserver/wagtail-transfer/',
+    'SECRET_KEY': settings.WAGTAILTRANSFER_SECRET_KEY,
+    'TRANSPORT': 'tests.benchmarks.loopback.BenchmarkTransport',
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def count_objects(summary):
+    return sum(
+        count
+        for counts in summary['objects'].values()
+        for action, count in counts.items()
+        if action in ('create', 'update')
+    )
+
+
+def get_phase_queries(summaries):
+    """
+    Return the total queries run in each phase of the given import or export summaries
+    """
+    queries = {}
+    for summary in summaries:
+        for name, entry in summary['phases'].items():
+            queries[name] = queries.get(name, 0) + entry['queries']
+    return queries
+
+
+def run_benchmark(pages, depth=3, stream_blocks=5, images=0, snippets=0, source='benchmark', trace_memory=True):
+    """
+    Generate a tree of the given number of pages and transfer it from the given source (which must
+    be configured with BenchmarkTransport, as BENCHMARK_SOURCE is), returning a dict of results. Nothing is left in the database afterwards.
+    Peak memory is only measured if trace_memory is true, since tracing slows the transfer down.
+    """
+    import_summaries = []
+    export_summaries = []
+
+    def on_import_finished(sender, summary, **kwargs):
+        import_summaries.append(summary)
+
+    def on_export_finished(sender, summary, **kwargs):
+        export_summaries.append(summary)
+
+    transfer_import_finished.connect(on_import_finished)
+    transfer_export_finished.connect(on_export_finished)
+    try:
+        with transaction.atomic():
+            home = Page.objects.get(depth=2)
+
+            started_at = time.monotonic()
+            root = generate_content(
+                home, pages, depth=depth, stream_blocks=stream_blocks, images=images,
+                snippets=snippets
+            )
+            generation_time = time.monotonic() - started_at
+
+            destination = home.add_child(instance=Page(title='Benchmark destination', slug='%s-copy' % root.slug))
+
+            if trace_memory:
+                tracemalloc.start()
+            started_at = time.monotonic()
+            result_messages = run_import('page', source, {
+                'source_page_ids': [str(root.pk)], 'dest_page_ids': [str(destination.pk)],
+            })
+            wall_time = time.monotonic() - started_at
+            if trace_memory:
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                peak_memory = None
+
+            imported_pages = destination.get_descendants().count()
+            raise Rollback
+    except Rollback:
+        pass
+    finally:
+        transfer_import_finished.disconnect(on_import_finished)
+        transfer_export_finished.disconnect(on_export_finished)
+
+    import_summary = import_summaries[-1]
+    objects = count_objects(import_summary)
+    import_time = import_summary['duration']
+    return {
+        'pages': pages,
+        'depth': depth,
+        'stream_blocks': stream_blocks,
+        'images': images,
+        'snippets': snippets,
+        'generation_time': generation_time,
+        'wall_time': wall_time,
+        'export_time': sum(summary['duration'] for summary in export_summaries),
+        'import_time': import_time,
+        'peak_memory': peak_memory,
+        'requests': import_summary['requests'],
+        'bytes': import_summary['bytes'],
+        'objects': objects,
+        'objects_by_model': import_summary['objects'],
+        'imported_pages': imported_pages,
+        'objects_per_second': objects / import_time if import_time else None,
+        'import_queries': get_phase_queries([import_summary]),
+        'export_queries': get_phase_queries(export_summaries),
+        'messages': [message for level, message in result_messages],
+    }
+
+
+def get_report(results):
+    return {
+        'commit': get_git_commit(),
+        'python': platform.python_version(),
+        'results': results,
+    }
+
+
+def write_report(results, path):
+    with open(path, 'w') as f:
+        json.dump(get_report(results), f, indent=2)
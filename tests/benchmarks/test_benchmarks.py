@@ -0,0 +1,42 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from wagtail.models import Page
+
+from .runner import BENCHMARK_SOURCE, run_benchmark
+
+
+BENCHMARK_SOURCES = {
+    **settings.WAGTAILTRANSFER_SOURCES,
+    'benchmark': BENCHMARK_SOURCE,
+}
+
+
+@override_settings(WAGTAILTRANSFER_SOURCES=BENCHMARK_SOURCES)
+class TestBenchmark(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.media_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_override.enable()
+
+    def tearDown(self):
+        self.media_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_benchmark(self):
+        page_count = Page.objects.count()
+        results = run_benchmark(20, depth=2, stream_blocks=5, images=2, snippets=2)
+
+        # the whole tree is copied, along with the images and adverts it uses
+        self.assertEqual(results['imported_pages'], 20)
+        self.assertGreaterEqual(results['objects'], 24)
+        self.assertGreater(results['import_queries']['operations'], 0)
+        self.assertIn('serializing', results['export_queries'])
+        self.assertIsNotNone(results['peak_memory'])
+
+        # nothing is left in the database afterwards
+        self.assertEqual(Page.objects.count(), page_count)
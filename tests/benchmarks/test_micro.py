@@ -0,0 +1,36 @@
+import os
+import unittest
+
+from django.test import SimpleTestCase
+
+from .micro import (StreamCase, get_cases, get_nested_stream, get_regressions, load_baseline,
+                    run_microbenchmarks)
+
+
+class TestMicroBenchmarks(SimpleTestCase):
+    def test_harness(self):
+        stream = get_nested_stream(3)
+        case = StreamCase('nested', stream, 'get_object_references')
+        # the stream, list and link blocks contain 5 + 5 * 2 + 2 blocks with values
+        self.assertEqual(case.size, 17)
+
+        results = run_microbenchmarks(warmup=0, repeat=1, cases=[case])
+        self.assertEqual(results['nested']['unit'], 'ns/block')
+        self.assertGreater(results['nested']['rate'], 0)
+
+        baseline = {'nested': results['nested']['seconds'] / 2}
+        self.assertEqual(len(get_regressions(results, baseline, 0.5)), 1)
+        self.assertEqual(get_regressions(results, baseline, 1.5), [])
+
+    def test_baseline_covers_all_cases(self):
+        baseline = load_baseline()
+        self.assertEqual(sorted(case.name for case in get_cases()), sorted(baseline))
+
+    @unittest.skipUnless(
+        os.environ.get('WAGTAILTRANSFER_MICROBENCHMARKS'),
+        "Set WAGTAILTRANSFER_MICROBENCHMARKS to run the micro-benchmarks"
+    )
+    def test_no_regressions(self):
+        tolerance = float(os.environ.get('WAGTAILTRANSFER_MICROBENCHMARK_TOLERANCE', 0.5))
+        regressions = get_regressions(run_microbenchmarks(), load_baseline(), tolerance)
+        self.assertEqual(regressions, [])
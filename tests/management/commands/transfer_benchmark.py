@@ -0,0 +1,65 @@
+import json
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import (override_settings, setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+
+from tests.benchmarks.runner import BENCHMARK_SOURCE, get_report, run_benchmark, write_report
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark a full export and import of generated content, in a test database. "
+        "Run with: python -m django transfer_benchmark --settings=tests.settings"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,10000,50000', help="Comma-separated numbers of pages to transfer in each run (default: 100,1000,10000,50000)")
+        parser.add_argument('--depth', type=int, default=3, help="Maximum depth of the generated page tree (default: 3)")
+        parser.add_argument('--stream-blocks', type=int, default=5, help="Number of StreamField blocks on each page (default: 5)")
+        parser.add_argument('--images', type=int, default=10, help="Number of images referenced by the pages (default: 10)")
+        parser.add_argument('--snippets', type=int, default=10, help="Number of snippets referenced by the pages (default: 10)")
+        parser.add_argument('--no-memory', action='store_true', help="Don't measure peak memory, which slows down the transfer")
+        parser.add_argument('--output', help="File to write the results to as JSON (default: standard output)")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        media_root = tempfile.mkdtemp()
+
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        try:
+            with override_settings(
+                MEDIA_ROOT=media_root,
+                DATA_UPLOAD_MAX_MEMORY_SIZE=None,
+                WAGTAILTRANSFER_SOURCES={
+                    **settings.WAGTAILTRANSFER_SOURCES,
+                    'benchmark': BENCHMARK_SOURCE,
+                },
+            ):
+                results = []
+                for size in sizes:
+                    result = run_benchmark(
+                        size, depth=options['depth'], stream_blocks=options['stream_blocks'],
+                        images=options['images'], snippets=options['snippets'],
+                        trace_memory=not options['no_memory'],
+                    )
+                    results.append(result)
+                    self.stderr.write(
+                        "%d pages: %.2fs, %d objects imported (%.1f/s)" % (
+                            size, result['wall_time'], result['objects'],
+                            result['objects_per_second'] or 0,
+                        )
+                    )
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        if options['output']:
+            write_report(results, options['output'])
+        else:
+            self.stdout.write(json.dumps(get_report(results), indent=2))
@@ -0,0 +1,40 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tests.benchmarks.micro import (BASELINE_PATH, get_regressions, load_baseline,
+                                    run_microbenchmarks, save_baseline)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the handling of references in StreamField and rich text, comparing the results "
+        "with a baseline. Run with: python -m django transfer_microbenchmark --settings=tests.settings"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--warmup', type=int, default=3, help="Number of calls to make before timing each case (default: 3)")
+        parser.add_argument('--repeat', type=int, default=5, help="Number of timings to take the best of (default: 5)")
+        parser.add_argument('--tolerance', type=float, default=0.5, help="Fraction by which a case may be slower than the baseline (default: 0.5)")
+        parser.add_argument('--baseline', default=BASELINE_PATH, help="Baseline file to compare with (default: tests/benchmarks/micro_baseline.json)")
+        parser.add_argument('--save-baseline', action='store_true', help="Save the results as the new baseline, rather than comparing with it")
+        parser.add_argument('--output', help="File to write the results to as JSON")
+
+    def handle(self, *args, **options):
+        results = run_microbenchmarks(warmup=options['warmup'], repeat=options['repeat'])
+        for name, result in results.items():
+            self.stdout.write("%-60s %12.1f %s" % (name, result['rate'], result['unit']))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+        if options['save_baseline']:
+            save_baseline(results, options['baseline'])
+            return
+
+        regressions = get_regressions(results, load_baseline(options['baseline']), options['tolerance'])
+        for name, seconds, baseline_seconds in regressions:
+            self.stderr.write("%s: %.1f%% slower than the baseline" % (name, (seconds / baseline_seconds - 1) * 100))
+        if regressions:
+            raise CommandError("%d case(s) regressed beyond the tolerance of %d%%." % (len(regressions), options['tolerance'] * 100))
@@ -73,7 +73,15 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+    },
+    # used for testing WAGTAILTRANSFER_READ_DATABASE
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db-replica.sqlite3'),
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
 }
 
 
@@ -149,3 +157,7 @@ WAGTAILTRANSFER_LOOKUP_FIELDS = {
 }
 
 WAGTAILADMIN_BASE_URL = 'http://example.com'
+
+WAGTAILTRANSFER_LAST_MODIFIED_FIELDS = {
+    'tests.category': 'updated_at'
+}
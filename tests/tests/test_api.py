@@ -1,6 +1,9 @@
+import gzip
 import json
 import os.path
+import pstats
 import shutil
+import tempfile
 import uuid
 from datetime import datetime, timezone
 from unittest import mock
@@ -9,7 +12,9 @@ from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.core.files import File
 from django.core.files.images import ImageFile
-from django.test import TestCase, override_settings
+from django.db import connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from wagtail.documents.models import Document
 from wagtail.images.models import Image
 from wagtail.models import Collection, Page
@@ -17,9 +22,13 @@ from wagtail.models import Collection, Page
 from tests.models import (Advert, Avatar, Category, LongAdvert,
                           ModelWithManyToMany, PageWithParentalManyToMany,
                           PageWithRichText, PageWithStreamField, SectionedPage,
-                          SponsoredPage)
+                          SectionedPageSection, SimplePage, SponsoredPage)
+from wagtail_transfer import metrics
 from wagtail_transfer.auth import digest_for_source
+from wagtail_transfer.bloom import BloomFilter
+from wagtail_transfer.formats import decode_export
 from wagtail_transfer.models import IDMapping
+from wagtail_transfer.signals import transfer_export_finished
 
 # We could use settings.MEDIA_ROOT here, but this way we avoid clobbering a real media folder if we
 # ever run these tests with non-test settings for any reason
@@ -167,11 +176,80 @@ class TestPagesApi(TestCase):
         self.assertTrue(homepage)
         self.assertEqual(homepage['parent_id'], 1)
         self.assertEqual(homepage['fields']['intro'], "This is the homepage")
+        self.assertEqual(len(homepage['fingerprint']), 40)
 
         mappings = data['mappings']
         self.assertIn(['wagtailcore.page', 2, "22222222-2222-2222-2222-222222222222"], mappings)
         self.assertIn(['tests.advert', 1, "adadadad-1111-1111-1111-111111111111"], mappings)
 
+    def test_export_instrumentation(self):
+        summaries = []
+
+        def receiver(sender, instrumentation, summary, **kwargs):
+            summaries.append(summary)
+
+        transfer_export_finished.connect(receiver)
+        try:
+            with self.assertLogs('wagtail_transfer.instrumentation', level='INFO') as logs:
+                response = self.get(2)
+        finally:
+            transfer_export_finished.disconnect(receiver)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Export (view=pages_for_export', logs.output[0])
+
+        summary, = summaries
+        self.assertEqual(summary['kind'], 'export')
+        self.assertEqual(summary['status'], 200)
+        self.assertEqual(summary['bytes'], len(response.content))
+        self.assertGreater(summary['queries'], 0)
+        self.assertEqual(
+            set(summary['phases']), {'fingerprinting', 'serializing', 'mappings', 'encoding'}
+        )
+        self.assertGreater(summary['phases']['serializing']['queries'], 0)
+
+    def test_profiled_export(self):
+        with tempfile.TemporaryDirectory() as profile_dir:
+            with override_settings(WAGTAILTRANSFER_PROFILING={'DIRECTORY': profile_dir, 'MEMORY': True}):
+                # the profile parameter must be signed along with the request
+                digest = digest_for_source('local', '2')
+                response = self.client.get('/wagtail-transfer/api/pages/2/?digest=%s&profile=abc123' % digest)
+                self.assertEqual(response.status_code, 403)
+                self.assertEqual(os.listdir(profile_dir), [])
+
+                digest = digest_for_source('local', 'profile=abc123\n2')
+                response = self.client.get('/wagtail-transfer/api/pages/2/?digest=%s&profile=abc123' % digest)
+                self.assertEqual(response.status_code, 200)
+
+                # run IDs that are unsafe to use in filenames are rejected
+                digest = digest_for_source('local', 'profile=../abc\n2')
+                response = self.client.get('/wagtail-transfer/api/pages/2/?digest=%s&profile=../abc' % digest)
+                self.assertEqual(response.status_code, 200)
+
+            self.assertEqual(
+                sorted(os.listdir(profile_dir)),
+                ['export-abc123.allocations.txt', 'export-abc123.prof']
+            )
+            pstats.Stats(os.path.join(profile_dir, 'export-abc123.prof'))
+
+            # a replayed request does not overwrite the existing profile
+            with open(os.path.join(profile_dir, 'export-abc123.prof'), 'rb') as f:
+                profile_data = f.read()
+            with override_settings(WAGTAILTRANSFER_PROFILING={'DIRECTORY': profile_dir}):
+                digest = digest_for_source('local', 'profile=abc123\n2')
+                with self.assertLogs('wagtail_transfer.profiling', 'WARNING'):
+                    response = self.client.get('/wagtail-transfer/api/pages/2/?digest=%s&profile=abc123' % digest)
+                self.assertEqual(response.status_code, 200)
+            with open(os.path.join(profile_dir, 'export-abc123.prof'), 'rb') as f:
+                self.assertEqual(f.read(), profile_data)
+
+    def test_export_not_profiled_by_default(self):
+        with mock.patch('wagtail_transfer.views.profile') as profile:
+            digest = digest_for_source('local', 'profile=abc123\n2')
+            response = self.client.get('/wagtail-transfer/api/pages/2/?digest=%s&profile=abc123' % digest)
+        self.assertEqual(response.status_code, 200)
+        profile.assert_not_called()
+
     def test_export_root(self):
         response = self.get(1)
         self.assertEqual(response.status_code, 200)
@@ -511,6 +589,376 @@ class TestPagesApi(TestCase):
         # Category objects in the mappings section should be identified by name, not UUID
         self.assertIn(['tests.category', 1, ['Cars']], mappings)
 
+    @override_settings(WAGTAILTRANSFER_READ_ONLY_EXPORT=True)
+    def test_read_only_export(self):
+        page = PageWithRichText(title="Linking to the unmapped", body='<p>A <a id="999" linktype="page">dead link</a></p>')
+
+        parent_page = Page.objects.get(url_path='/home/existing-child-page/')
+        parent_page.add_child(instance=page)
+        mapping_count = IDMapping.objects.count()
+
+        response = self.get(page.id)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+
+        # no IDMapping records should have been written
+        self.assertEqual(IDMapping.objects.count(), mapping_count)
+
+        # existing mappings are still respected
+        self.assertIn(['wagtailcore.page', 3, '33333333-3333-3333-3333-333333333333'], data['mappings'])
+
+        # unmapped objects are given the same UID that preseed_transfer_table would assign them
+        namespace = uuid.UUID('418b5168-5a10-11ea-a84b-7831c1c42e66')
+        self.assertIn(
+            ['wagtailcore.page', page.id, str(uuid.uuid5(namespace, 'wagtailcore.page:%d' % page.id))],
+            data['mappings']
+        )
+        self.assertIn(
+            ['wagtailcore.page', 999, str(uuid.uuid5(namespace, 'wagtailcore.page:999'))],
+            data['mappings']
+        )
+
+
+    @mock.patch('wagtail_transfer.views.UPDATE_RELATED_MODELS', ['tests.category'])
+    def test_conditional_export(self):
+        response = self.get(2)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        digest = digest_for_source('local', '2')
+        url = '/wagtail-transfer/api/pages/2/?digest=%s&recursive=true' % digest
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # ETags made weak by compression are matched too
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='W/' + etag)
+        self.assertEqual(response.status_code, 304)
+
+        # the non-recursive export of the same page is a different response
+        response = self.client.get(
+            '/wagtail-transfer/api/pages/2/?digest=%s&recursive=false' % digest, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+
+        # publishing a new revision of a page in the subtree changes the ETag
+        page = Page.objects.get(url_path='/home/existing-child-page/').specific
+        page.title = "Updated child page"
+        page.save_revision().publish()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # so does a change to a referenced model in UPDATE_RELATED_MODELS, as the destination
+        # updates such objects whenever it imports a page referencing them
+        etag = response['ETag']
+        category = Category.objects.get(name='Cars')
+        category.colour = 'blue'
+        category.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_no_etag_without_related_last_modified_field(self):
+        # changes to images and adverts (in UPDATE_RELATED_MODELS, with no last-modified field)
+        # cannot be detected, so page exports are never conditional
+        response = self.get(2)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+
+    def test_delta_export(self):
+        response = self.get(2)
+        data = json.loads(response.content)
+        since = data['timestamp']
+        self.assertNotIn('manifest', data)
+
+        page = Page.objects.get(url_path='/home/existing-child-page/').specific
+        page.title = "Updated child page"
+        page.save_revision().publish()
+
+        digest = digest_for_source('local', '2')
+        response = self.client.get('/wagtail-transfer/api/pages/2/', {'digest': digest, 'since': since})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+
+        # only the changed page is exported
+        self.assertEqual(data['ids_for_import'], [['wagtailcore.page', page.pk]])
+        self.assertEqual(
+            {obj['pk'] for obj in data['objects'] if obj['model'] == 'tests.simplepage'}, {page.pk}
+        )
+
+        # the manifest lists all pages in the subtree, and each has a mapping
+        self.assertIn(['wagtailcore.page', 2], data['manifest'])
+        self.assertIn(['wagtailcore.page', 5], data['manifest'])
+        self.assertIn(['wagtailcore.page', 5, '00017017-5555-5555-5555-555555555555'], data['mappings'])
+        self.assertGreater(data['timestamp'], since)
+
+    def test_closure_export(self):
+        digest = digest_for_source('local', '2')
+        response = self.client.get('/wagtail-transfer/api/pages/2/', {'digest': digest})
+        data = json.loads(response.content)
+        self.assertFalse([obj for obj in data['objects'] if obj['model'] == 'tests.advert'])
+
+        # with closure=1, the adverts referenced by pages are included in the response
+        response = self.client.get('/wagtail-transfer/api/pages/2/', {'digest': digest, 'closure': 1})
+        data = json.loads(response.content)
+        advert = [obj for obj in data['objects'] if obj['model'] == 'tests.advert' and obj['pk'] == 1][0]
+        self.assertEqual(advert['fields']['slogan'], "put a tiger in your tank")
+        self.assertIn(['tests.advert', 1, 'adadadad-1111-1111-1111-111111111111'], data['mappings'])
+
+        # pages outside the subtree are not followed, as pages are in NO_FOLLOW_MODELS
+        page_ids = {obj['pk'] for obj in data['objects'] if obj['model'] == 'tests.simplepage'}
+        self.assertNotIn(1, page_ids)
+
+        response = self.client.get('/wagtail-transfer/api/pages/2/', {'digest': digest, 'closure': 'all'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_closure_export_with_known_uids(self):
+        def post(body, digest=None):
+            # the digest signs the request body along with the page ID
+            digest = digest or digest_for_source('local', '5\n%s' % body)
+            return self.client.post(
+                '/wagtail-transfer/api/pages/5/?digest=%s&closure=1' % digest, body,
+                content_type='application/json'
+            )
+
+        response = post('{}')
+        data = json.loads(response.content)
+        objects = {(obj['model'], obj['pk']) for obj in data['objects']}
+        self.assertIn(('tests.advert', 1), objects)
+        self.assertIn(('tests.author', 1), objects)
+
+        # objects known to the importer are omitted, unless they are in UPDATE_RELATED_MODELS
+        known_uids = BloomFilter.for_capacity(2)
+        known_uids.add('b00cb00c-1111-1111-1111-111111111111')
+        known_uids.add('adadadad-1111-1111-1111-111111111111')
+        body = json.dumps({'known_uids': known_uids.to_json()})
+
+        # a filter cannot be added to a request signed without it
+        response = post(body, digest=digest_for_source('local', '5'))
+        self.assertEqual(response.status_code, 403)
+
+        response = post(body)
+        data = json.loads(response.content)
+        objects = {(obj['model'], obj['pk']) for obj in data['objects']}
+        self.assertIn(('tests.advert', 1), objects)
+        self.assertNotIn(('tests.author', 1), objects)
+        # the mapping for the omitted author is still included
+        self.assertIn(['tests.author', 1, 'b00cb00c-1111-1111-1111-111111111111'], data['mappings'])
+
+        # filters with an invalid size or an excessive number of hash functions are rejected
+        for size, hash_count in [(0, 7), (-8, 7), (known_uids.size, 0), (known_uids.size, 10 ** 9)]:
+            invalid_uids = dict(known_uids.to_json(), size=size, hash_count=hash_count)
+            response = post(json.dumps({'known_uids': invalid_uids}))
+            self.assertEqual(response.status_code, 400)
+
+    def test_compact_format(self):
+        digest = digest_for_source('local', '2')
+        response = self.client.get('/wagtail-transfer/api/pages/2/', {'digest': digest})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        v1_data = json.loads(response.content)
+
+        response = self.client.get(
+            '/wagtail-transfer/api/pages/2/', {'digest': digest},
+            HTTP_ACCEPT='application/vnd.wagtail-transfer.v2+json, application/json;q=0.9'
+        )
+        self.assertEqual(response['Content-Type'], 'application/vnd.wagtail-transfer.v2+json')
+        self.assertLess(len(response.content), len(json.dumps(v1_data)))
+        data = json.loads(response.content)
+        self.assertEqual(data['format'], 2)
+        self.assertIn('wagtailcore.page', data['models'])
+        self.assertIn([data['models'].index('wagtailcore.page'), 2], data['ids_for_import'])
+
+        decoded_data = decode_export(data)
+        decoded_data['timestamp'] = v1_data['timestamp']
+        self.assertEqual(decoded_data, v1_data)
+
+        # the format can also be selected with a parameter
+        response = self.client.get('/wagtail-transfer/api/pages/2/', {'digest': digest, 'format': '2'})
+        self.assertEqual(json.loads(response.content)['format'], 2)
+
+    def test_delta_export_with_invalid_timestamp(self):
+        digest = digest_for_source('local', '2')
+        response = self.client.get('/wagtail-transfer/api/pages/2/', {'digest': digest, 'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_multiple_roots(self):
+        digest = digest_for_source('local', '3,5')
+        response = self.client.get('/wagtail-transfer/api/pages/', {'digest': digest, 'ids': '3,5'})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+
+        self.assertCountEqual(data['ids_for_import'], [['wagtailcore.page', 3], ['wagtailcore.page', 5]])
+        self.assertCountEqual(
+            [obj['pk'] for obj in data['objects'] if obj['model'].endswith('page')], [3, 5]
+        )
+        self.assertIn(['tests.advert', 1, "adadadad-1111-1111-1111-111111111111"], data['mappings'])
+
+        # the digest covers the list of IDs
+        response = self.client.get('/wagtail-transfer/api/pages/', {'digest': digest, 'ids': '3,4'})
+        self.assertEqual(response.status_code, 403)
+
+        digest = digest_for_source('local', '3,99')
+        response = self.client.get('/wagtail-transfer/api/pages/', {'digest': digest, 'ids': '3,99'})
+        self.assertEqual(response.status_code, 404)
+
+class TestModelsExportApi(TestCase):
+    fixtures = ['test.json']
+
+    def get(self, model_path, headers=None):
+        digest = digest_for_source('local', model_path)
+        return self.client.get(
+            '/wagtail-transfer/api/models/%s/?digest=%s' % (model_path, digest), headers=headers
+        )
+
+    def test_conditional_export(self):
+        response = self.get('tests.category')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.get('tests.category', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        category = Category.objects.get(name='Cars')
+        category.colour = 'blue'
+        category.save()
+        response = self.get('tests.category', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['objects'][0]['fields']['colour'], 'blue')
+
+    def test_delta_export(self):
+        data = json.loads(self.get('tests.category').content)
+        since = data['timestamp']
+
+        category = Category.objects.create(name='Bikes')
+
+        digest = digest_for_source('local', 'tests.category')
+        response = self.client.get('/wagtail-transfer/api/models/tests.category/', {'digest': digest, 'since': since})
+        data = json.loads(response.content)
+        self.assertEqual(data['ids_for_import'], [['tests.category', category.pk]])
+        self.assertIn(['tests.category', 1], data['manifest'])
+        self.assertIn(['tests.category', category.pk], data['manifest'])
+
+    def test_no_etag_without_last_modified_field(self):
+        response = self.get('tests.advert')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_paginated_export(self):
+        for i in range(4):
+            Category.objects.create(name='Category %d' % i, colour='green')
+        pks = list(Category.objects.order_by('pk').values_list('pk', flat=True))
+        digest = digest_for_source('local', 'tests.category')
+
+        response = self.client.get('/wagtail-transfer/api/models/tests.category/', {'digest': digest, 'limit': 2})
+        data = json.loads(response.content)
+        self.assertEqual(data['ids_for_import'], [['tests.category', pk] for pk in pks[:2]])
+        self.assertEqual(data['next'], pks[1])
+
+        response = self.client.get('/wagtail-transfer/api/models/tests.category/', {'digest': digest, 'limit': 2, 'after': pks[3]})
+        data = json.loads(response.content)
+        self.assertEqual(data['ids_for_import'], [['tests.category', pks[4]]])
+        self.assertIsNone(data['next'])
+
+        response = self.client.get('/wagtail-transfer/api/models/tests.category/', {'digest': digest, 'limit': 2, 'after': 'x'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/wagtail-transfer/api/models/tests.category/', {'digest': digest, 'limit': 0})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'wagtail_transfer': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'transfer'},
+    },
+    WAGTAILTRANSFER_SERIALIZATION_CACHE='wagtail_transfer',
+)
+class TestPagesApiWithSerializationCache(TestCase):
+    fixtures = ['test.json']
+
+    def get(self, page_id):
+        digest = digest_for_source('local', str(page_id))
+        response = self.client.get('/wagtail-transfer/api/pages/%d/?digest=%s' % (page_id, digest))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def get_object(self, data, model, pk):
+        for obj in data['objects']:
+            if obj['model'] == model and obj['pk'] == pk:
+                return obj
+
+    def test_cached_page_is_invalidated_on_save(self):
+        data = self.get(2)
+        self.assertEqual(self.get_object(data, 'tests.simplepage', 2)['fields']['intro'], "This is the homepage")
+
+        # a queryset update does not send signals, so the cached version is served
+        SimplePage.objects.filter(pk=2).update(intro="Updated without signals")
+        data = self.get(2)
+        self.assertEqual(self.get_object(data, 'tests.simplepage', 2)['fields']['intro'], "This is the homepage")
+        self.assertIn(['wagtailcore.page', 2, "22222222-2222-2222-2222-222222222222"], data['mappings'])
+
+        page = SimplePage.objects.get(pk=2)
+        page.intro = "Updated and saved"
+        page.save()
+        data = self.get(2)
+        self.assertEqual(self.get_object(data, 'tests.simplepage', 2)['fields']['intro'], "Updated and saved")
+
+    def test_child_objects_invalidate_parent(self):
+        page = SectionedPage(title='How to make a cake', intro="Here is how to make a cake.")
+        page.sections.create(title="Create the universe", body="First, create the universe")
+        parent_page = Page.objects.get(url_path='/home/existing-child-page/')
+        parent_page.add_child(instance=page)
+
+        data = self.get(page.id)
+        self.assertEqual(len(self.get_object(data, 'tests.sectionedpage', page.pk)['fields']['sections']), 1)
+
+        section = SectionedPageSection.objects.create(page=page, title="Find some eggs", body="Next, find some eggs")
+        data = self.get(page.id)
+        self.assertEqual(len(self.get_object(data, 'tests.sectionedpage', page.pk)['fields']['sections']), 2)
+        self.assertEqual(
+            self.get_object(data, 'tests.sectionedpagesection', section.pk)['fields']['title'], "Find some eggs"
+        )
+
+        section.title = "Find some chickens"
+        section.save()
+        data = self.get(page.id)
+        self.assertEqual(
+            self.get_object(data, 'tests.sectionedpagesection', section.pk)['fields']['title'], "Find some chickens"
+        )
+
+
+@override_settings(WAGTAILTRANSFER_READ_DATABASE='replica')
+class TestPagesApiWithReadDatabase(TransactionTestCase):
+    # The replica is configured as a test mirror of the default database, so its connection only
+    # sees committed data
+    databases = {'default', 'replica'}
+    fixtures = ['test.json']
+    serialized_rollback = True
+
+    def test_pages_api(self):
+        digest = digest_for_source('local', '2')
+        with CaptureQueriesContext(connections['default']) as default_queries:
+            with CaptureQueriesContext(connections['replica']) as replica_queries:
+                response = self.client.get('/wagtail-transfer/api/pages/2/?digest=%s' % digest)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+
+        homepage = [obj for obj in data['objects'] if obj['model'] == 'tests.simplepage' and obj['pk'] == 2][0]
+        self.assertEqual(homepage['fields']['intro'], "This is the homepage")
+        self.assertEqual(homepage['parent_id'], 1)
+
+        # pages should be read from the read database
+        self.assertTrue(any('wagtailcore_page' in query['sql'] for query in replica_queries))
+        self.assertFalse(any('wagtailcore_page' in query['sql'] for query in default_queries))
+
+        # ID mappings for previously unmapped pages are written to the default database
+        self.assertTrue(any(
+            query['sql'].startswith('INSERT') and 'wagtail_transfer_idmapping' in query['sql']
+            for query in default_queries
+        ))
+        self.assertFalse(any(query['sql'].startswith('INSERT') for query in replica_queries))
+
 
 class TestObjectsApi(TestCase):
     fixtures = ['test.json']
@@ -538,6 +986,39 @@ class TestObjectsApi(TestCase):
             '/wagtail-transfer/api/objects/?digest=%s' % digest, request_json, content_type='application/json'
         )
 
+    def test_compressed_request_and_response(self):
+        request_json = json.dumps({'tests.advert': [1]})
+        # the digest is calculated over the uncompressed request body
+        digest = digest_for_source('local', request_json)
+        response = self.client.post(
+            '/wagtail-transfer/api/objects/?digest=%s' % digest, gzip.compress(request_json.encode()),
+            content_type='application/json', HTTP_CONTENT_ENCODING='gzip', HTTP_ACCEPT_ENCODING='gzip'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        data = json.loads(gzip.decompress(response.content))
+        self.assertEqual(data['objects'][0]['fields']['slogan'], "put a tiger in your tank")
+
+    def test_invalid_compressed_request(self):
+        request_json = json.dumps({'tests.advert': [1]})
+        digest = digest_for_source('local', request_json)
+        response = self.client.post(
+            '/wagtail-transfer/api/objects/?digest=%s' % digest, request_json,
+            content_type='application/json', HTTP_CONTENT_ENCODING='gzip'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1000)
+    def test_compressed_request_size_limit(self):
+        # a request that is small when compressed, but exceeds the size limit when decompressed
+        request_json = json.dumps({'tests.advert': [1] * 1000})
+        digest = digest_for_source('local', request_json)
+        response = self.client.post(
+            '/wagtail-transfer/api/objects/?digest=%s' % digest, gzip.compress(request_json.encode()),
+            content_type='application/json', HTTP_CONTENT_ENCODING='gzip'
+        )
+        self.assertEqual(response.status_code, 400)
+
     def test_objects_api(self):
         response = self.get({
             'tests.advert': [1]
@@ -755,3 +1236,90 @@ class TestChooserProxyApi(TestCase):
         get.assert_not_called()
 
         self.assertEqual(response.status_code, 404)
+
+
+class TestMetricsApi(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        # clear metrics recorded by earlier tests in this process
+        for values in metrics.registry.values.values():
+            values.clear()
+
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir)
+
+    def get_metrics(self, token='metrics-token'):
+        return self.client.get('/wagtail-transfer/metrics/', HTTP_AUTHORIZATION='Bearer %s' % token)
+
+    def test_metrics_disabled(self):
+        response = self.get_metrics()
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(WAGTAILTRANSFER_METRICS={'TOKEN': 'metrics-token'})
+    def test_incorrect_token(self):
+        response = self.get_metrics(token='wrong-token')
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.get('/wagtail-transfer/metrics/')
+        self.assertEqual(response.status_code, 403)
+
+    def test_export_metrics(self):
+        with override_settings(WAGTAILTRANSFER_METRICS={'TOKEN': 'metrics-token', 'DIRECTORY': self.metrics_dir}):
+            digest = digest_for_source('local', '2')
+            export_response = self.client.get('/wagtail-transfer/api/pages/2/?digest=%s' % digest)
+            response = self.get_metrics()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        content = response.content.decode()
+        self.assertIn('# TYPE wagtail_transfer_export_payload_bytes histogram', content)
+        self.assertIn('wagtail_transfer_export_payload_bytes_count{view="pages_for_export"} 1\n', content)
+        self.assertIn(
+            'wagtail_transfer_export_payload_bytes_sum{view="pages_for_export"} %r\n' % float(len(export_response.content)),
+            content
+        )
+        self.assertIn('wagtail_transfer_export_serialization_seconds_count{view="pages_for_export"} 1\n', content)
+        self.assertIn('wagtail_transfer_export_serialization_seconds_bucket{view="pages_for_export",le="+Inf"} 1\n', content)
+
+    def test_metrics_aggregated_across_processes(self):
+        with override_settings(WAGTAILTRANSFER_METRICS={'TOKEN': 'metrics-token', 'DIRECTORY': self.metrics_dir}):
+            metrics.planner_round_trips.observe(2, source='staging')
+
+            # metrics written by another process
+            buckets = [0] * len(metrics.planner_round_trips.buckets)
+            buckets[1] = 1
+            with open(os.path.join(self.metrics_dir, 'metrics-1-abcdef12.json'), 'w') as f:
+                json.dump({
+                    'wagtail_transfer_planner_round_trips': [[['staging'], [buckets, 1.0, 1]]],
+                }, f)
+
+            response = self.get_metrics()
+
+        content = response.content.decode()
+        self.assertIn('wagtail_transfer_planner_round_trips_bucket{source="staging",le="1.0"} 1\n', content)
+        self.assertIn('wagtail_transfer_planner_round_trips_bucket{source="staging",le="2.0"} 2\n', content)
+        self.assertIn('wagtail_transfer_planner_round_trips_count{source="staging"} 2\n', content)
+        self.assertIn('wagtail_transfer_planner_round_trips_sum{source="staging"} 3.0\n', content)
+
+    def test_metrics_file_writes_throttled(self):
+        with override_settings(WAGTAILTRANSFER_METRICS={'TOKEN': 'metrics-token', 'DIRECTORY': self.metrics_dir}):
+            metrics.planner_round_trips.observe(1, source='staging')
+            metrics.registry.flush()
+            with mock.patch.object(metrics.registry, '_write_file', wraps=metrics.registry._write_file) as write_file:
+                # the file has just been written, so further observations are written later
+                metrics.planner_round_trips.observe(2, source='staging')
+                metrics.planner_round_trips.observe(3, source='staging')
+                write_file.assert_not_called()
+                self.assertIsNotNone(metrics.registry.write_timer)
+
+                # the metrics view writes this process's pending observations before reading
+                response = self.get_metrics()
+                write_file.assert_called_once()
+                self.assertIsNone(metrics.registry.write_timer)
+
+        self.assertIn('wagtail_transfer_planner_round_trips_count{source="staging"} 3\n', response.content.decode())
+
+    def test_metrics_not_recorded_when_disabled(self):
+        metrics.planner_round_trips.observe(2, source='staging')
+        self.assertEqual(metrics.registry.values['wagtail_transfer_planner_round_trips'], {})
@@ -1,4 +1,5 @@
 import importlib
+import json
 import os.path
 import shutil
 from datetime import datetime, timezone
@@ -8,7 +9,10 @@ from unittest import mock
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.core.files.images import ImageFile
-from django.test import TestCase, override_settings
+from django.core.management import call_command
+from django.db import connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from wagtail.images.models import Image
 from wagtail.models import Collection, Page
 
@@ -17,8 +21,8 @@ from tests.models import (Advert, Author, Avatar, Category, LongAdvert,
                           PageWithRelatedPages, PageWithRichText,
                           PageWithStreamField, RedirectPage, SectionedPage,
                           SimplePage, SponsoredPage)
-from wagtail_transfer.models import IDMapping
-from wagtail_transfer.operations import ImportPlanner
+from wagtail_transfer.models import IDMapping, ImportRun
+from wagtail_transfer.operations import CreateTreeModel, ImportPlanner
 
 # We could use settings.MEDIA_ROOT here, but this way we avoid clobbering a real media folder if we
 # ever run these tests with non-test settings for any reason
@@ -131,6 +135,171 @@ class TestImport(TestCase):
         created_page_revision = created_page.get_latest_revision_as_object()
         self.assertEqual(created_page_revision.intro, "This page is imported from the source site")
 
+    def test_import_pages_with_multiple_roots(self):
+        data = """{
+            "ids_for_import": [
+                ["wagtailcore.page", 15],
+                ["wagtailcore.page", 16]
+            ],
+            "mappings": [
+                ["wagtailcore.page", 15, "15151515-1515-1515-1515-151515151515"],
+                ["wagtailcore.page", 16, "16161616-1616-1616-1616-161616161616"],
+                ["tests.advert", 8, "adadadad-8888-8888-8888-888888888888"]
+            ],
+            "objects": [
+                {
+                    "model": "tests.sponsoredpage",
+                    "pk": 15,
+                    "parent_id": 12,
+                    "fields": {
+                        "title": "First sponsored page",
+                        "show_in_menus": false,
+                        "live": true,
+                        "slug": "first-sponsored-page",
+                        "intro": "The first imported root",
+                        "advert": 8,
+                        "author": null,
+                        "categories": [],
+                        "wagtail_admin_comments": []
+                    }
+                },
+                {
+                    "model": "tests.sponsoredpage",
+                    "pk": 16,
+                    "parent_id": 13,
+                    "fields": {
+                        "title": "Second sponsored page",
+                        "show_in_menus": false,
+                        "live": true,
+                        "slug": "second-sponsored-page",
+                        "intro": "The second imported root",
+                        "advert": 8,
+                        "author": null,
+                        "categories": [],
+                        "wagtail_admin_comments": []
+                    }
+                },
+                {
+                    "model": "tests.advert",
+                    "pk": 8,
+                    "fields": {
+                        "slogan": "Shared by both pages",
+                        "tags": "[]",
+                        "run_until": "2020-12-23T21:05:43Z"
+                    }
+                }
+            ]
+        }"""
+
+        importer = ImportPlanner.for_pages([(15, 2), (16, 3)], source_site="staging")
+        importer.add_json(data)
+        importer.run()
+
+        first_page = SponsoredPage.objects.get(slug='first-sponsored-page')
+        self.assertEqual(first_page.get_parent().pk, 2)
+        second_page = SponsoredPage.objects.get(slug='second-sponsored-page')
+        self.assertEqual(second_page.get_parent().pk, 3)
+
+        # the advert referenced from both pages is only created once
+        self.assertEqual(Advert.objects.filter(slogan="Shared by both pages").count(), 1)
+        self.assertEqual(first_page.advert, second_page.advert)
+
+    def test_import_pages_in_compact_format(self):
+        data = """{
+            "format": 2,
+            "models": ["wagtailcore.page", "tests.simplepage"],
+            "ids_for_import": [[0, 15]],
+            "mappings": [
+                [0, 12, "22222222-2222-2222-2222-222222222222"],
+                [0, 15, "55555555-5555-5555-5555-555555555555"]
+            ],
+            "objects": [
+                {
+                    "model": 1,
+                    "pk": 15,
+                    "parent_id": 12,
+                    "fields": {
+                        "title": "Imported child page",
+                        "show_in_menus": false,
+                        "live": true,
+                        "slug": "imported-child-page",
+                        "intro": "This page is imported from the source site",
+                        "wagtail_admin_comments": []
+                    }
+                }
+            ]
+        }"""
+
+        importer = ImportPlanner(root_page_source_pk=12, destination_parent_id=None, source_site="staging")
+        importer.add_json(data)
+        importer.run()
+
+        created_page = SimplePage.objects.get(url_path='/home/imported-child-page/')
+        self.assertEqual(created_page.intro, "This page is imported from the source site")
+
+    def test_import_delta_with_manifest(self):
+        # A delta export lists no changed pages, but its manifest includes page 16, which does not
+        # exist at the destination
+        data = """{
+            "ids_for_import": [],
+            "manifest": [
+                ["wagtailcore.page", 12],
+                ["wagtailcore.page", 13],
+                ["wagtailcore.page", 16]
+            ],
+            "mappings": [
+                ["wagtailcore.page", 12, "22222222-2222-2222-2222-222222222222"],
+                ["wagtailcore.page", 13, "33333333-3333-3333-3333-333333333333"],
+                ["wagtailcore.page", 16, "16161616-1616-1616-1616-161616161616"]
+            ],
+            "objects": [],
+            "timestamp": "2024-01-01T00:00:00Z"
+        }"""
+
+        importer = ImportPlanner(root_page_source_pk=12, destination_parent_id=None, source_site="staging")
+        importer.add_json(data)
+        self.assertEqual(importer.source_timestamp, "2024-01-01T00:00:00Z")
+
+        # page 16 is requested from the source, but the pages that exist at the destination are not
+        self.assertEqual(importer.missing_object_data, {(Page, 16)})
+
+        importer.add_json("""{
+            "ids_for_import": [],
+            "mappings": [
+                ["wagtailcore.page", 12, "22222222-2222-2222-2222-222222222222"],
+                ["wagtailcore.page", 16, "16161616-1616-1616-1616-161616161616"]
+            ],
+            "objects": [
+                {
+                    "model": "tests.simplepage",
+                    "pk": 16,
+                    "parent_id": 12,
+                    "fields": {
+                        "title": "Moved page",
+                        "show_in_menus": false,
+                        "live": true,
+                        "slug": "moved-page",
+                        "intro": "This page was moved into the subtree",
+                        "wagtail_admin_comments": []
+                    }
+                }
+            ]
+        }""")
+        importer.run()
+
+        created_page = SimplePage.objects.get(url_path='/home/moved-page/')
+        self.assertEqual(created_page.intro, "This page was moved into the subtree")
+
+        # page 5 was previously imported (it has an IDMapping) but is not in the manifest, so is
+        # reported as deleted at the source; page 4 has never been imported. This follows the
+        # import's writes, so must not be read from a read replica that may be lagging behind
+        with mock.patch('wagtail_transfer.operations.get_read_database', side_effect=AssertionError), \
+                mock.patch('wagtail_transfer.locators.get_read_database', side_effect=AssertionError):
+            self.assertEqual(
+                list(importer.get_pages_deleted_at_source().values_list('pk', flat=True)), [5]
+            )
+        self.assertTrue(Page.objects.filter(pk=5).exists())
+
     def test_import_pages_with_fk(self):
         data = """{
             "ids_for_import": [
@@ -432,6 +601,167 @@ class TestImport(TestCase):
         self.assertNotEqual(new_sections[1].id, section_1_id)
         self.assertEqual(new_sections[1].title, "Eat the egg")
 
+    def test_skip_unchanged_objects(self):
+        def get_data(section_title, section_fingerprint):
+            return json.dumps({
+                "ids_for_import": [["wagtailcore.page", 100]],
+                "mappings": [
+                    ["wagtailcore.page", 100, "10000000-1000-1000-1000-100000000000"],
+                    ["tests.sectionedpagesection", 101, "10100000-1010-1010-1010-101000000000"],
+                ],
+                "objects": [
+                    {
+                        "model": "tests.sectionedpage",
+                        "pk": 100,
+                        "parent_id": 1,
+                        "fields": {
+                            "title": "How to boil an egg",
+                            "show_in_menus": False,
+                            "live": True,
+                            "slug": "how-to-boil-an-egg",
+                            "intro": "This is how to boil an egg",
+                            "sections": [101],
+                            "wagtail_admin_comments": []
+                        },
+                        "fingerprint": "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa"
+                    },
+                    {
+                        "model": "tests.sectionedpagesection",
+                        "pk": 101,
+                        "fields": {
+                            "sort_order": 0,
+                            "title": section_title,
+                            "body": "...",
+                            "page": 100
+                        },
+                        "fingerprint": section_fingerprint
+                    }
+                ]
+            })
+
+        def run_import(data):
+            importer = ImportPlanner(root_page_source_pk=100, destination_parent_id=2, source_site="staging")
+            importer.add_json(data)
+            importer.run()
+            return importer
+
+        run_import(get_data("Boil the egg", "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb"))
+        page = SectionedPage.objects.get(url_path='/home/how-to-boil-an-egg/')
+        self.assertEqual(
+            IDMapping.objects.get(uid="10000000-1000-1000-1000-100000000000").content_hash,
+            "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa"
+        )
+        revision_count = page.revisions.count()
+
+        # re-importing unchanged data does not update the page or create a new revision
+        importer = run_import(get_data("Boil the egg", "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb"))
+        self.assertEqual(len(importer.unchanged_operations), 2)
+        self.assertEqual(page.revisions.count(), revision_count)
+
+        # a change to a child object causes the page to be updated too
+        importer = run_import(get_data("Boil the whole egg", "cccccccccccccccccccccccccccccccccccccccc"))
+        self.assertEqual(importer.unchanged_operations, set())
+        self.assertEqual(page.revisions.count(), revision_count + 1)
+        self.assertEqual(page.sections.get().title, "Boil the whole egg")
+
+        # with WAGTAILTRANSFER_SKIP_UNCHANGED_OBJECTS disabled, unchanged objects are updated
+        with override_settings(WAGTAILTRANSFER_SKIP_UNCHANGED_OBJECTS=False):
+            run_import(get_data("Boil the whole egg", "cccccccccccccccccccccccccccccccccccccccc"))
+        self.assertEqual(page.revisions.count(), revision_count + 2)
+
+    def test_page_with_unresolved_reference_is_not_skipped(self):
+        data = json.dumps({
+            "ids_for_import": [["wagtailcore.page", 100]],
+            "mappings": [
+                ["wagtailcore.page", 100, "10000000-1000-1000-1000-100000000000"],
+                ["wagtailcore.page", 200, "20000000-2000-2000-2000-200000000000"],
+            ],
+            "objects": [
+                {
+                    "model": "tests.pagewithrichtext",
+                    "pk": 100,
+                    "parent_id": 1,
+                    "fields": {
+                        "title": "Page with a link",
+                        "show_in_menus": False,
+                        "live": True,
+                        "slug": "page-with-a-link",
+                        "body": '<p>See <a id="200" linktype="page">the other page</a></p>',
+                        "wagtail_admin_comments": []
+                    },
+                    "fingerprint": "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa"
+                }
+            ]
+        })
+
+        def run_import():
+            importer = ImportPlanner(root_page_source_pk=100, destination_parent_id=2, source_site="staging")
+            importer.add_json(data)
+            importer.run()
+            return importer
+
+        # the linked page does not exist at the destination, so the link cannot be resolved
+        run_import()
+        page = PageWithRichText.objects.get(slug='page-with-a-link')
+        self.assertNotIn('id="4"', page.body)
+        revision_count = page.revisions.count()
+
+        # while it still does not exist, the page is skipped as unchanged
+        importer = run_import()
+        self.assertEqual(len(importer.unchanged_operations), 1)
+        self.assertEqual(page.revisions.count(), revision_count)
+
+        # once the linked page has been imported by a separate import, the page is updated, even
+        # though its source data is unchanged
+        IDMapping.objects.create(
+            uid="20000000-2000-2000-2000-200000000000",
+            content_type=ContentType.objects.get_for_model(Page), local_id=4
+        )
+        importer = run_import()
+        self.assertEqual(importer.unchanged_operations, set())
+        page.refresh_from_db()
+        self.assertEqual(page.body, '<p>See <a id="4" linktype="page">the other page</a></p>')
+
+        # and is then skipped again
+        importer = run_import()
+        self.assertEqual(len(importer.unchanged_operations), 1)
+
+    def test_edited_page_is_not_skipped(self):
+        data = """{
+            "ids_for_import": [["wagtailcore.page", 12]],
+            "mappings": [["wagtailcore.page", 12, "22222222-2222-2222-2222-222222222222"]],
+            "objects": [
+                {
+                    "model": "tests.simplepage",
+                    "pk": 12,
+                    "parent_id": 1,
+                    "fields": {
+                        "title": "New home",
+                        "show_in_menus": false,
+                        "live": true,
+                        "slug": "home",
+                        "intro": "This is the updated homepage",
+                        "wagtail_admin_comments": []
+                    },
+                    "fingerprint": "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa"
+                }
+            ]
+        }"""
+        importer = ImportPlanner(root_page_source_pk=12, destination_parent_id=None, source_site="staging")
+        importer.add_json(data)
+        importer.run()
+
+        # edit the page at the destination
+        home = SimplePage.objects.get(slug='home')
+        home.intro = "Edited at the destination"
+        home.save_revision().publish()
+
+        importer = ImportPlanner(root_page_source_pk=12, destination_parent_id=None, source_site="staging")
+        importer.add_json(data)
+        importer.run()
+        self.assertEqual(importer.unchanged_operations, set())
+        self.assertEqual(SimplePage.objects.get(slug='home').intro, "This is the updated homepage")
+
     def test_import_page_with_comments(self):
         data = """{
             "ids_for_import": [
@@ -1027,6 +1357,12 @@ class TestImport(TestCase):
         self.assertEqual(image.file_size, 18521)
         self.assertEqual(image.file_hash, "e4eab12cc50b6b9c619c9ddd20b61d8e6a961ada")
 
+        # the file download is counted as a request, but not as a round trip to the source's API
+        summary = importer.context.instrumentation.get_summary()
+        self.assertEqual(summary['requests'], 1)
+        self.assertEqual(summary['round_trips'], 0)
+        self.assertEqual(summary['files'], 1)
+
     @mock.patch('requests.get')
     def test_import_image_with_file_without_root_collection_mapping(self, get):
         get.return_value.status_code = 200
@@ -2259,3 +2595,246 @@ class TestImport(TestCase):
             get.call_args.kwargs['auth'],
             settings.WAGTAILTRANSFER_SOURCES_BASIC_AUTH['staging']['BASIC_AUTH_SECRET']
         )
+
+
+@override_settings(WAGTAILTRANSFER_READ_DATABASE='replica')
+class TestImportWithReadDatabase(TransactionTestCase):
+    # The replica is configured as a test mirror of the default database, so its connection only
+    # sees committed data
+    databases = {'default', 'replica'}
+    fixtures = ['test.json']
+    serialized_rollback = True
+
+    def test_import_pages(self):
+        data = """{
+            "ids_for_import": [
+                ["wagtailcore.page", 12],
+                ["wagtailcore.page", 15]
+            ],
+            "mappings": [
+                ["wagtailcore.page", 12, "22222222-2222-2222-2222-222222222222"],
+                ["wagtailcore.page", 15, "55555555-5555-5555-5555-555555555555"]
+            ],
+            "objects": [
+                {
+                    "model": "tests.simplepage",
+                    "pk": 15,
+                    "parent_id": 12,
+                    "fields": {
+                        "title": "Imported child page",
+                        "show_in_menus": false,
+                        "live": true,
+                        "slug": "imported-child-page",
+                        "intro": "This page is imported from the source site",
+                        "wagtail_admin_comments": []
+                    }
+                },
+                {
+                    "model": "tests.simplepage",
+                    "pk": 12,
+                    "parent_id": 1,
+                    "fields": {
+                        "title": "New home",
+                        "show_in_menus": false,
+                        "live": true,
+                        "slug": "home",
+                        "intro": "This is the updated homepage",
+                        "wagtail_admin_comments": []
+                    }
+                }
+            ]
+        }"""
+
+        importer = ImportPlanner(root_page_source_pk=12, destination_parent_id=None, source_site="staging")
+
+        # lookups of existing objects during planning should go to the read database
+        with CaptureQueriesContext(connections['default']) as default_queries:
+            with CaptureQueriesContext(connections['replica']) as replica_queries:
+                importer.add_json(data)
+        self.assertFalse(any('wagtail_transfer_idmapping' in query['sql'] for query in default_queries))
+        self.assertTrue(any('wagtail_transfer_idmapping' in query['sql'] for query in replica_queries))
+
+        # all writes should go to the write database
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            importer.run()
+        self.assertFalse(any(
+            query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE')) for query in replica_queries
+        ))
+
+        self.assertEqual(SimplePage.objects.get(pk=2).intro, "This is the updated homepage")
+        created_page = SimplePage.objects.get(url_path='/home/imported-child-page/')
+        self.assertTrue(created_page.get_latest_revision())
+
+
+@override_settings(WAGTAILTRANSFER_COMMIT_CHUNK_SIZE=1)
+class TestChunkedImport(TestCase):
+    fixtures = ['test.json']
+
+    data = """{
+        "ids_for_import": [
+            ["wagtailcore.page", 15],
+            ["wagtailcore.page", 16]
+        ],
+        "mappings": [
+            ["wagtailcore.page", 12, "22222222-2222-2222-2222-222222222222"],
+            ["wagtailcore.page", 15, "15151515-1515-1515-1515-151515151515"],
+            ["wagtailcore.page", 16, "16161616-1616-1616-1616-161616161616"]
+        ],
+        "objects": [
+            {
+                "model": "tests.simplepage",
+                "pk": 15,
+                "parent_id": 12,
+                "fields": {
+                    "title": "Imported parent page",
+                    "show_in_menus": false,
+                    "live": true,
+                    "slug": "imported-parent-page",
+                    "intro": "This page is imported first",
+                    "wagtail_admin_comments": []
+                }
+            },
+            {
+                "model": "tests.simplepage",
+                "pk": 16,
+                "parent_id": 15,
+                "fields": {
+                    "title": "Imported child page",
+                    "show_in_menus": false,
+                    "live": true,
+                    "slug": "imported-child-page",
+                    "intro": "This page is imported second",
+                    "wagtail_admin_comments": []
+                }
+            }
+        ]
+    }"""
+
+    def test_chunked_import(self):
+        importer = ImportPlanner(root_page_source_pk=15, destination_parent_id=2, source_site="staging")
+        importer.add_json(self.data)
+        importer.run()
+
+        import_run = importer.import_run
+        self.assertEqual(import_run.status, ImportRun.STATUS_COMPLETED)
+        # two page creations, followed by saving a revision of each page
+        self.assertEqual(import_run.completed_operations, 4)
+        self.assertEqual(
+            [operation['type'] for operation in import_run.operations],
+            ['create_tree', 'create_tree', 'save_revision', 'save_revision']
+        )
+
+        child_page = SimplePage.objects.get(url_path='/home/imported-parent-page/imported-child-page/')
+        self.assertEqual(child_page.get_latest_revision_as_object().intro, "This page is imported second")
+
+    def test_resume_failed_import(self):
+        original_run = CreateTreeModel.run
+
+        def run_or_fail(operation, context):
+            if operation.object_data['pk'] == 16:
+                raise ValueError("Connection lost")
+            original_run(operation, context)
+
+        importer = ImportPlanner(root_page_source_pk=15, destination_parent_id=2, source_site="staging")
+        importer.add_json(self.data)
+        with mock.patch.object(CreateTreeModel, 'run', run_or_fail):
+            with self.assertRaises(ValueError):
+                importer.run()
+
+        # the first chunk has been committed, and the failure recorded
+        import_run = ImportRun.objects.get()
+        self.assertEqual(import_run.status, ImportRun.STATUS_FAILED)
+        self.assertEqual(import_run.completed_operations, 1)
+        self.assertIn("Connection lost", import_run.error)
+        self.assertTrue(SimplePage.objects.filter(slug='imported-parent-page').exists())
+        self.assertFalse(SimplePage.objects.filter(slug='imported-child-page').exists())
+        # only the committed chunk is counted
+        self.assertEqual(importer.context.instrumentation.objects, {'tests.simplepage': {'create': 1}})
+
+        # resuming the import continues from the failed chunk, using the ID mappings established
+        # by the committed chunks
+        call_command('resume_transfer_import', verbosity=0)
+
+        import_run.refresh_from_db()
+        self.assertEqual(import_run.status, ImportRun.STATUS_COMPLETED)
+        self.assertEqual(import_run.completed_operations, 4)
+        self.assertEqual(SimplePage.objects.filter(slug='imported-parent-page').count(), 1)
+        child_page = SimplePage.objects.get(slug='imported-child-page')
+        self.assertEqual(child_page.get_parent().slug, 'imported-parent-page')
+
+
+@override_settings(WAGTAILTRANSFER_QUARANTINE_FAILURES=True)
+class TestQuarantinedImport(TestCase):
+    fixtures = ['test.json']
+
+    def get_data(self, ids_for_import):
+        return json.dumps({
+            "ids_for_import": [["wagtailcore.page", pk] for pk in ids_for_import],
+            "mappings": [
+                ["wagtailcore.page", 15, "15151515-1515-1515-1515-151515151515"],
+                ["wagtailcore.page", 16, "16161616-1616-1616-1616-161616161616"],
+                ["wagtailcore.page", 17, "17171717-1717-1717-1717-171717171717"]
+            ],
+            "objects": [
+                {
+                    "model": "tests.simplepage",
+                    "pk": pk,
+                    "parent_id": parent_id,
+                    "fields": {
+                        "title": "Page %d" % pk,
+                        "show_in_menus": False,
+                        "live": True,
+                        "slug": "page-%d" % pk,
+                        "intro": "Imported page %d" % pk,
+                        "wagtail_admin_comments": []
+                    }
+                }
+                for pk, parent_id in [(15, 12), (16, 15), (17, 12)]
+            ]
+        })
+
+    def test_quarantine_and_retry(self):
+        original_run = CreateTreeModel.run
+
+        def run_or_fail(operation, context):
+            if operation.object_data['pk'] == 15:
+                raise ValueError("Invalid StreamField data")
+            original_run(operation, context)
+
+        importer = ImportPlanner.for_pages([(15, 2), (17, 2)], source_site="staging")
+        importer.add_json(self.get_data([15, 16, 17]))
+        with mock.patch.object(CreateTreeModel, 'run', run_or_fail):
+            with self.assertLogs('wagtail_transfer.operations', level='WARNING'):
+                importer.run()
+
+        # page 15 failed, and page 16 was skipped because it depends on it; page 17 was imported
+        self.assertTrue(SimplePage.objects.filter(slug='page-17').exists())
+        self.assertFalse(SimplePage.objects.filter(slug__in=['page-15', 'page-16']).exists())
+        self.assertEqual(
+            sorted(importer.get_quarantine_report(), key=lambda item: item['source_id']),
+            [
+                {'model': 'wagtailcore.page', 'source_id': 15, 'destination_id': None, 'error': "Invalid StreamField data"},
+                {'model': 'wagtailcore.page', 'source_id': 16, 'destination_id': None, 'error': "Depends on wagtailcore.page 15, which could not be imported"},
+            ]
+        )
+        # only the page that was imported is counted as created
+        self.assertEqual(
+            importer.context.instrumentation.objects,
+            {'tests.simplepage': {'create': 1, 'quarantined': 2}}
+        )
+        # no fingerprint is recorded for failed objects, so that they are not skipped as unchanged
+        self.assertFalse(IDMapping.objects.filter(uid='15151515-1515-1515-1515-151515151515').exists())
+
+        # the failed objects can then be retried on their own
+        retry_importer = importer.get_retry_planner()
+        self.assertEqual(
+            retry_importer.missing_object_data, {(Page, 15), (Page, 16)}
+        )
+        retry_importer.add_json(self.get_data([]))
+        retry_importer.run()
+
+        self.assertEqual(retry_importer.get_quarantine_report(), [])
+        page_15 = SimplePage.objects.get(slug='page-15')
+        self.assertEqual(page_15.get_parent().pk, 2)
+        self.assertEqual(SimplePage.objects.get(slug='page-16').get_parent().pk, page_15.pk)
+        self.assertEqual(SimplePage.objects.filter(slug='page-17').count(), 1)
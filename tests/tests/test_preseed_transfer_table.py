@@ -0,0 +1,126 @@
+import queue
+from io import StringIO
+from unittest import mock
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from wagtail.models import Page
+
+from tests.models import Category
+from wagtail_transfer.locators import get_deterministic_uid
+from wagtail_transfer.management.commands.preseed_transfer_table import get_pk_ranges
+from wagtail_transfer.models import IDMapping
+
+
+class InProcessWorker:
+    """
+    Stands in for a worker process started by preseed_transfer_table --workers, running the
+    worker in the test process so that it uses the test database
+    """
+    def __init__(self, target, args):
+        self.target = target
+        self.args = args
+        self.exitcode = None
+
+    def start(self):
+        self.target(*self.args)
+        self.exitcode = 0
+
+    def join(self):
+        pass
+
+
+class InProcessContext:
+    def Queue(self):
+        return queue.Queue()
+
+    def Process(self, target, args):
+        return InProcessWorker(target, args)
+
+
+class TestPreseedTransferTable(TestCase):
+    fixtures = ['test.json']
+
+    def assertPagesMapped(self, pks):
+        uids = dict(
+            IDMapping.objects.filter(
+                content_type=ContentType.objects.get_for_model(Page), local_id__in=[str(pk) for pk in pks]
+            ).values_list('local_id', 'uid')
+        )
+        for pk in pks:
+            self.assertEqual(uids.get(str(pk)), get_deterministic_uid(Page, pk))
+
+    def test_preseed(self):
+        unmapped_pks = list(
+            Page.objects.exclude(pk__in=[1, 2, 3, 5]).order_by('pk').values_list('pk', flat=True)
+        )
+        stdout = StringIO()
+        call_command('preseed_transfer_table', 'wagtailcore.page', batch_size=2, stdout=stdout)
+
+        self.assertPagesMapped(unmapped_pks)
+        # existing mappings are left alone
+        self.assertEqual(
+            str(IDMapping.objects.get(local_id='2', content_type__model='page').uid),
+            '22222222-2222-2222-2222-222222222222'
+        )
+        self.assertIn("wagtailcore.page: %d/%d objects processed" % (len(unmapped_pks), len(unmapped_pks)), stdout.getvalue())
+        self.assertIn("%d ID mappings created." % len(unmapped_pks), stdout.getvalue())
+
+        # running again creates nothing
+        stdout = StringIO()
+        call_command('preseed_transfer_table', 'wagtailcore.page', stdout=stdout)
+        self.assertIn("0 ID mappings created.", stdout.getvalue())
+
+    def test_preseed_range(self):
+        call_command('preseed_transfer_table', 'wagtailcore.page', range='4-10', batch_size=2, verbosity=0)
+
+        mapped_ids = set(
+            IDMapping.objects.filter(content_type__model='page').values_list('local_id', flat=True)
+        )
+        # page 5 already has a mapping
+        self.assertPagesMapped(Page.objects.filter(pk__gte=4, pk__lte=10).exclude(pk=5).values_list('pk', flat=True))
+        self.assertFalse(any(int(local_id) > 10 for local_id in mapped_ids))
+
+    def test_preseed_app(self):
+        call_command('preseed_transfer_table', 'tests', verbosity=0)
+
+        self.assertEqual(
+            IDMapping.objects.get(content_type__model='category', local_id='1').uid,
+            get_deterministic_uid(Category, 1)
+        )
+        # subclasses using multi-table inheritance are skipped
+        self.assertFalse(IDMapping.objects.filter(content_type__model='simplepage').exists())
+
+    def test_invalid_labels(self):
+        with self.assertRaisesMessage(CommandError, "is not a valid model for ID mappings"):
+            call_command('preseed_transfer_table', 'tests.simplepage', verbosity=0)
+        with self.assertRaisesMessage(CommandError, "is not recognised as an app label"):
+            call_command('preseed_transfer_table', 'nonexistent', verbosity=0)
+
+    def test_get_pk_ranges(self):
+        self.assertEqual(get_pk_ranges(1, 10, 3), [(1, 3), (4, 6), (7, 10)])
+        self.assertEqual(get_pk_ranges(5, 6, 4), [(5, 5), (6, 6)])
+        self.assertEqual(get_pk_ranges(7, 7, 2), [(7, 7)])
+
+    @mock.patch('multiprocessing.get_context', return_value=InProcessContext())
+    def test_workers(self, get_context):
+        unmapped_pks = list(
+            Page.objects.exclude(pk__in=[1, 2, 3, 5]).order_by('pk').values_list('pk', flat=True)
+        )
+        stdout = StringIO()
+        call_command('preseed_transfer_table', 'wagtailcore.page', workers=3, batch_size=2, stdout=stdout)
+
+        get_context.assert_called_with('fork')
+        self.assertPagesMapped(unmapped_pks)
+        self.assertIn("%d ID mappings created." % len(unmapped_pks), stdout.getvalue())
+
+    @mock.patch('multiprocessing.get_context', return_value=InProcessContext())
+    def test_worker_failure(self, get_context):
+        with mock.patch(
+            'wagtail_transfer.management.commands.preseed_transfer_table.preseed_model',
+            side_effect=ValueError("Connection lost")
+        ):
+            with self.assertRaisesMessage(CommandError, "ValueError: Connection lost"):
+                call_command('preseed_transfer_table', 'wagtailcore.page', workers=2, verbosity=0)
@@ -0,0 +1,237 @@
+import json
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from unittest import mock
+
+from django.db import connection, reset_queries
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from wagtail.models import Page
+
+from tests.benchmarks.content import generate_content
+from tests.benchmarks.loopback import remap_export
+from wagtail_transfer.auth import digest_for_source
+from wagtail_transfer.operations import ImportPlanner
+
+# numbers of pages exported and imported by each test
+SMALL_SIZE = 10
+LARGE_SIZE = 100
+
+
+class QueryCountMixin:
+    """
+    Helpers for asserting that the number of queries made by a code path does not grow with the
+    number of objects it handles - so that N+1 queries introduced (for example) by a field adapter,
+    a serializer or a locator are caught by the tests
+    """
+
+    def count_queries(self, func, *args, **kwargs):
+        """
+        Call func with the given arguments, returning a tuple of the queries it made on the default
+        database (as captured by CaptureQueriesContext) and its return value
+        """
+        # the query log has a limited length; start from an empty one, so that the queries are
+        # counted correctly however many were made beforehand
+        reset_queries()
+        with CaptureQueriesContext(connection) as context:
+            result = func(*args, **kwargs)
+        if len(context) >= connection.queries_limit:
+            self.fail("Too many queries to count (%d or more)" % connection.queries_limit)
+        return context.captured_queries, result
+
+    def count_queries_by_phase(self, instrumentation, func, *args, **kwargs):
+        """
+        Call func with the given arguments, returning a tuple of a dict mapping the names of the
+        top-level phases recorded on instrumentation to the queries made within them (with the
+        queries made outside of any phase under None), and func's return value
+        """
+        spans = []
+        depth = 0
+        record_phase = instrumentation.phase
+
+        @contextmanager
+        def phase(name):
+            nonlocal depth
+            start = len(connection.queries)
+            depth += 1
+            try:
+                with record_phase(name):
+                    yield
+            finally:
+                depth -= 1
+                if depth == 0:
+                    spans.append((name, start, len(connection.queries)))
+
+        with mock.patch.object(instrumentation, 'phase', phase):
+            queries, result = self.count_queries(func, *args, **kwargs)
+
+        queries_by_phase = defaultdict(list)
+        for index, query in enumerate(queries):
+            name = next((name for name, start, end in spans if start <= index < end), None)
+            queries_by_phase[name].append(query)
+        return queries_by_phase, result
+
+    def format_queries(self, queries, limit=10):
+        """
+        Return a summary of the most frequently repeated queries in the list, for failure messages
+        """
+        counts = Counter(query['sql'] for query in queries)
+        return '\n'.join(
+            '%d x %s' % (count, sql[:300]) for sql, count in counts.most_common(limit)
+        )
+
+    def assertQueryCountDoesNotGrow(self, small_queries, large_queries, slack=3):
+        """
+        Assert that handling the larger number of objects took no more than slack queries more
+        than handling the smaller number
+        """
+        if len(large_queries) > len(small_queries) + slack:
+            self.fail(
+                "Query count grew from %d to %d. Most frequent queries:\n%s" % (
+                    len(small_queries), len(large_queries), self.format_queries(large_queries)
+                )
+            )
+
+    def assertQueriesPerObject(self, small_queries, large_queries, object_count, budget):
+        """
+        Assert that each of the object_count additional objects handled in large_queries took no
+        more than budget queries on average
+        """
+        per_object = (len(large_queries) - len(small_queries)) / object_count
+        if per_object > budget:
+            self.fail(
+                "%.1f queries per object, over the budget of %d. Most frequent queries:\n%s" % (
+                    per_object, budget, self.format_queries(large_queries)
+                )
+            )
+
+
+class TestQueryCounts(QueryCountMixin, TestCase):
+    fixtures = ['test.json']
+
+    # phases of an import run in which objects are saved, making queries of Wagtail's own (to save
+    # page revisions, log entries, search index and reference index entries, and so on) for each
+    # object. The number of these depends on the version of Wagtail and on the page models, so
+    # these phases are not held to a budget, other than for the queries on wagtail-transfer's own
+    # tables
+    SAVE_PHASES = ('operations', 'revisions')
+
+    # queries on wagtail-transfer's own tables made while saving each created object: the lookup
+    # and insert of its IDMapping
+    TRANSFER_QUERIES_PER_OBJECT = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        home = Page.objects.get(url_path='/home/')
+        cls.small_root = generate_content(home, SMALL_SIZE, depth=2, stream_blocks=5, snippets=3)
+        cls.large_root = generate_content(home, LARGE_SIZE, depth=2, stream_blocks=5, snippets=3)
+
+    def export_pages(self, root):
+        digest = digest_for_source('local', str(root.pk))
+        response = self.client.get('/wagtail-transfer/api/pages/%d/?digest=%s' % (root.pk, digest))
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def export_objects(self, request_data):
+        request_json = json.dumps(request_data)
+        digest = digest_for_source('local', request_json)
+        response = self.client.post(
+            '/wagtail-transfer/api/objects/?digest=%s' % digest, request_json, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def get_planner(self, root):
+        """
+        Return an ImportPlanner for importing a copy of the given tree (with remapped UIDs, so
+        that new objects are created) under a new page, and the new page
+        """
+        home = Page.objects.get(url_path='/home/')
+        destination = home.add_child(instance=Page(title="Copy of %s" % root.title, slug='copy-%s' % root.slug))
+        return ImportPlanner.for_pages([(str(root.pk), str(destination.pk))], 'local'), destination
+
+    def plan_import(self, root):
+        """
+        Return an ImportPlanner for copying the given tree, with all of the object data it needs,
+        and the page it will be copied under
+        """
+        planner, destination = self.get_planner(root)
+        planner.add_json(remap_export(self.export_pages(root)))
+        while planner.missing_object_data:
+            request_data = {}
+            for model, source_id in planner.missing_object_data:
+                request_data.setdefault(model._meta.label_lower, []).append(source_id)
+            planner.add_json(remap_export(self.export_objects(request_data)))
+        return planner, destination
+
+    def test_pages_for_export(self):
+        small_queries, small_export = self.count_queries(self.export_pages, self.small_root)
+        large_queries, large_export = self.count_queries(self.export_pages, self.large_root)
+
+        self.assertEqual(len(json.loads(large_export)['objects']), LARGE_SIZE)
+        self.assertQueryCountDoesNotGrow(small_queries, large_queries)
+
+    def test_objects_for_export(self):
+        def get_request_data(root):
+            return {'wagtailcore.page': list(Page.objects.descendant_of(root, inclusive=True).values_list('pk', flat=True))}
+
+        small_queries, small_export = self.count_queries(self.export_objects, get_request_data(self.small_root))
+        large_queries, large_export = self.count_queries(self.export_objects, get_request_data(self.large_root))
+
+        self.assertEqual(len(json.loads(large_export)['objects']), LARGE_SIZE)
+        self.assertQueryCountDoesNotGrow(small_queries, large_queries)
+
+    def test_add_json(self):
+        small_planner, _ = self.get_planner(self.small_root)
+        small_data = remap_export(self.export_pages(self.small_root))
+        large_planner, _ = self.get_planner(self.large_root)
+        large_data = remap_export(self.export_pages(self.large_root))
+
+        small_queries, _ = self.count_queries(small_planner.add_json, small_data)
+        large_queries, _ = self.count_queries(large_planner.add_json, large_data)
+
+        self.assertQueryCountDoesNotGrow(small_queries, large_queries)
+
+    def test_plan_import(self):
+        small_planner, _ = self.plan_import(self.small_root)
+        large_planner, _ = self.plan_import(self.large_root)
+
+        # looking up the objects at the destination and resolving their references takes a
+        # constant number of queries
+        for phase in ('planning', 'lookups'):
+            with self.subTest(phase=phase):
+                small_count = small_planner.context.instrumentation.phases[phase]['queries']
+                large_count = large_planner.context.instrumentation.phases[phase]['queries']
+                self.assertLessEqual(large_count, small_count + 3)
+
+    def test_run(self):
+        small_planner, _ = self.plan_import(self.small_root)
+        large_planner, large_destination = self.plan_import(self.large_root)
+
+        small_queries, _ = self.count_queries_by_phase(small_planner.context.instrumentation, small_planner.run)
+        large_queries, _ = self.count_queries_by_phase(large_planner.context.instrumentation, large_planner.run)
+
+        self.assertEqual(Page.objects.descendant_of(large_destination).count(), LARGE_SIZE)
+
+        # the planner's own work - ordering the operations, skipping unchanged objects and
+        # recording what was imported - takes a constant number of queries
+        def get_planner_queries(queries_by_phase):
+            return [
+                query for phase, queries in queries_by_phase.items() if phase not in self.SAVE_PHASES
+                for query in queries
+            ]
+
+        self.assertQueryCountDoesNotGrow(get_planner_queries(small_queries), get_planner_queries(large_queries))
+
+        # saving the objects makes a fixed number of queries on wagtail-transfer's own tables for
+        # each of them, however many queries Wagtail itself makes
+        def get_transfer_queries(queries_by_phase):
+            return [
+                query for phase in self.SAVE_PHASES for query in queries_by_phase[phase]
+                if '"wagtail_transfer_' in query['sql']
+            ]
+
+        self.assertQueriesPerObject(
+            get_transfer_queries(small_queries), get_transfer_queries(large_queries),
+            LARGE_SIZE - SMALL_SIZE, self.TRANSFER_QUERIES_PER_OBJECT
+        )
@@ -1,16 +1,30 @@
+import gzip
 import json
-from datetime import date, datetime, timezone
+import os
+import tempfile
+from datetime import date, datetime, timedelta, timezone
 from unittest import mock
 
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser, Group, Permission, User
 from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
 from django.shortcuts import redirect
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone as django_timezone
+from wagtail.models import Page
 
-from tests.models import SponsoredPage
+from tests.models import Category, SponsoredPage
 from wagtail_transfer.auth import digest_for_source
-from wagtail_transfer.models import IDMapping
+from wagtail_transfer.bloom import BloomFilter, get_known_uids_filter
+from wagtail_transfer.imports import run_import
+from wagtail_transfer.jobs import (claim_import_job, claim_next_import_job, create_import_job,
+                                   run_import_job)
+from wagtail_transfer.models import IDMapping, ImportCheckpoint, ImportJob, ImportRecord
+from wagtail_transfer.recording import load_bundle
+from wagtail_transfer.signals import transfer_import_finished, transfer_phase_finished
+from wagtail_transfer.transports import get_transport
 
 
 class TestChooseView(TestCase):
@@ -35,6 +49,7 @@ class TestImportView(TestCase):
 
     def test_run(self, get, post):
         get.return_value.status_code = 200
+        get.return_value.headers = {}
         get.return_value.content = b"""{
             "ids_for_import": [
                 ["wagtailcore.page", 12],
@@ -166,6 +181,7 @@ class TestImportView(TestCase):
         # response that doesn't contain the object. The importer needs to catch this case and not
         # get into an infinite loop of repeating the object-API request.
         get.return_value.status_code = 200
+        get.return_value.headers = {}
         get.return_value.content = b"""{
             "ids_for_import": [
                 ["wagtailcore.page", 12],
@@ -280,6 +296,909 @@ class TestImportView(TestCase):
         self.assertEqual(created_page.intro, "you can make cakes with them")
         self.assertEqual(created_page.advert, None)
 
+    def test_conditional_import(self, get, post):
+        get.return_value.status_code = 200
+        get.return_value.headers = {'ETag': '"abc123"'}
+        get.return_value.content = export_content = b"""{
+            "ids_for_import": [
+                ["wagtailcore.page", 12]
+            ],
+            "mappings": [
+                ["wagtailcore.page", 12, "22222222-2222-2222-2222-222222222222"]
+            ],
+            "objects": [
+                {
+                    "model": "tests.simplepage",
+                    "pk": 12,
+                    "parent_id": 1,
+                    "fields": {
+                        "title": "Imported page",
+                        "show_in_menus": false,
+                        "live": true,
+                        "slug": "imported-page",
+                        "intro": "An imported page",
+                        "wagtail_admin_comments": []
+                    }
+                }
+            ],
+            "timestamp": "2024-01-01T12:00:00Z"
+        }"""
+
+        response = self.client.post('/admin/wagtail-transfer/import/', {
+            'source': 'staging',
+            'source_page_id': '12',
+            'dest_page_id': '2',
+        })
+        self.assertRedirects(response, '/admin/pages/2/')
+
+        # the first request is unconditional
+        args, kwargs = get.call_args
+        self.assertNotIn('If-None-Match', kwargs['headers'])
+        self.assertNotIn('since', kwargs['params'])
+        checkpoint = ImportCheckpoint.objects.get(
+            source_site='staging', source_root='wagtailcore.page:12', destination_root='2'
+        )
+        self.assertEqual(checkpoint.etag, '"abc123"')
+        self.assertEqual(checkpoint.watermark, datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc))
+
+        # a subsequent import of the same page sends the stored ETag, and does nothing on a 304
+        get.return_value.status_code = 304
+        get.return_value.content = b''
+        response = self.client.post('/admin/wagtail-transfer/import/', {
+            'source': 'staging',
+            'source_page_id': '12',
+            'dest_page_id': '2',
+        })
+        self.assertRedirects(response, '/admin/pages/2/')
+        args, kwargs = get.call_args
+        self.assertEqual(kwargs['headers']['If-None-Match'], '"abc123"')
+        self.assertEqual(kwargs['params']['since'], '2024-01-01T12:00:00+00:00')
+        post.assert_not_called()
+
+        # once the imported page (which is mapped to the homepage) has been edited at the
+        # destination, the import is unconditional again, so that the page is restored
+        page = Page.objects.get(pk=2).specific
+        page.title = "Edited at the destination"
+        page.save_revision().publish()
+        get.return_value.status_code = 200
+        get.return_value.content = export_content
+        self.client.post('/admin/wagtail-transfer/import/', {
+            'source': 'staging',
+            'source_page_id': '12',
+            'dest_page_id': '2',
+        })
+        args, kwargs = get.call_args
+        self.assertNotIn('If-None-Match', kwargs['headers'])
+        self.assertNotIn('since', kwargs['params'])
+        self.assertEqual(Page.objects.get(pk=2).title, "Imported page")
+
+        # an import can be forced to be unconditional, from the form or the URL
+        self.client.post('/admin/wagtail-transfer/import/', {
+            'source': 'staging',
+            'source_page_id': '12',
+            'dest_page_id': '2',
+            'force': '1',
+        })
+        args, kwargs = get.call_args
+        self.assertNotIn('If-None-Match', kwargs['headers'])
+        self.assertNotIn('since', kwargs['params'])
+
+        response = self.client.get('/admin/wagtail-transfer/choose/?force=1')
+        self.assertContains(response, 'data-action="/admin/wagtail-transfer/import/?force=1"')
+        self.client.post('/admin/wagtail-transfer/import/?force=1', {
+            'source': 'staging',
+            'source_page_id': '12',
+            'dest_page_id': '2',
+        })
+        args, kwargs = get.call_args
+        self.assertNotIn('If-None-Match', kwargs['headers'])
+
+        # otherwise, the import is conditional as before
+        self.client.post('/admin/wagtail-transfer/import/', {
+            'source': 'staging',
+            'source_page_id': '12',
+            'dest_page_id': '2',
+        })
+        args, kwargs = get.call_args
+        self.assertEqual(kwargs['headers']['If-None-Match'], '"abc123"')
+
+        # importing to a different destination is unconditional
+        self.client.post('/admin/wagtail-transfer/import/', {
+            'source': 'staging',
+            'source_page_id': '12',
+            'dest_page_id': '3',
+        })
+        args, kwargs = get.call_args
+        self.assertNotIn('If-None-Match', kwargs['headers'])
+
+    def test_closure_depth(self, get, post):
+        post.return_value.status_code = 200
+        post.return_value.headers = {}
+        post.return_value.content = b"""{
+            "ids_for_import": [],
+            "mappings": [],
+            "objects": []
+        }"""
+
+        sources = {
+            'staging': {
+                'BASE_URL': 'https://www.example.com/wagtail-transfer/',
+                'SECRET_KEY': 'i-am-the-staging-example-secret-key',
+                'CLOSURE_DEPTH': 2,
+            },
+        }
+        with override_settings(WAGTAILTRANSFER_SOURCES=sources):
+            self.client.post('/admin/wagtail-transfer/import/', {
+                'source': 'staging',
+                'source_page_id': '12',
+                'dest_page_id': '2',
+            })
+
+        # with CLOSURE_DEPTH set, the pages API is requested with a POST request containing the
+        # UIDs that we already know about, excluding pages and UPDATE_RELATED_MODELS
+        get.assert_not_called()
+        args, kwargs = post.call_args
+        self.assertEqual(args[0], 'https://www.example.com/wagtail-transfer/api/pages/12/')
+        self.assertEqual(kwargs['params']['closure'], 2)
+        known_uids = BloomFilter.from_json(json.loads(kwargs['data'])['known_uids'])
+        self.assertIn('b00cb00c-1111-1111-1111-111111111111', known_uids)
+        self.assertNotIn('adadadad-1111-1111-1111-111111111111', known_uids)
+        self.assertNotIn('22222222-2222-2222-2222-222222222222', known_uids)
+
+    def test_closure_depth_model_import(self, get, post):
+        first_page = mock.Mock(status_code=200, headers={}, content=b"""{
+            "ids_for_import": [["tests.category", 101]],
+            "mappings": [["tests.category", 101, "cacacaca-0101-0101-0101-010101010101"]],
+            "objects": [
+                {"model": "tests.category", "pk": 101, "fields": {"name": "Boats", "colour": "blue"}}
+            ],
+            "next": 101
+        }""")
+        second_page = mock.Mock(status_code=200, headers={}, content=b"""{
+            "ids_for_import": [["tests.category", 102]],
+            "mappings": [["tests.category", 102, "cacacaca-0102-0102-0102-010201020102"]],
+            "objects": [
+                {"model": "tests.category", "pk": 102, "fields": {"name": "Planes", "colour": "white"}}
+            ],
+            "next": null
+        }""")
+        post.side_effect = [first_page, second_page]
+
+        sources = {
+            'staging': {
+                'BASE_URL': 'https://www.example.com/wagtail-transfer/',
+                'SECRET_KEY': 'i-am-the-staging-example-secret-key',
+                'CLOSURE_DEPTH': 2,
+                'CHUNK_SIZE': 1,
+            },
+        }
+        with override_settings(WAGTAILTRANSFER_SOURCES=sources), mock.patch(
+            'wagtail_transfer.imports.get_known_uids_filter', wraps=get_known_uids_filter
+        ) as get_filter:
+            self.client.post('/admin/wagtail-transfer/import/', {
+                'type': 'model',
+                'source': 'staging',
+                'source_model': 'tests.category',
+            })
+
+        # the filter is built once, and sent with the request for each page
+        get_filter.assert_called_once()
+        first_call, second_call = post.call_args_list
+        self.assertEqual(first_call.kwargs['data'], second_call.kwargs['data'])
+
+        # categories cannot reference authors, so the filter only covers categories
+        known_uids = BloomFilter.from_json(json.loads(first_call.kwargs['data'])['known_uids'])
+        self.assertNotIn('b00cb00c-1111-1111-1111-111111111111', known_uids)
+        self.assertTrue(Category.objects.filter(name='Planes').exists())
+
+    def test_closure_depth_known_uids_limit(self, get, post):
+        get.return_value.status_code = 200
+        get.return_value.headers = {}
+        get.return_value.content = b"""{
+            "ids_for_import": [],
+            "mappings": [],
+            "objects": []
+        }"""
+
+        sources = {
+            'staging': {
+                'BASE_URL': 'https://www.example.com/wagtail-transfer/',
+                'SECRET_KEY': 'i-am-the-staging-example-secret-key',
+                'CLOSURE_DEPTH': 2,
+                'KNOWN_UIDS_LIMIT': 1,
+            },
+        }
+        with override_settings(WAGTAILTRANSFER_SOURCES=sources):
+            self.client.post('/admin/wagtail-transfer/import/', {
+                'source': 'staging',
+                'source_page_id': '12',
+                'dest_page_id': '2',
+            })
+
+        # we know of more objects than the limit, so no filter is sent, and the pages API is
+        # requested with a GET request as usual
+        post.assert_not_called()
+        args, kwargs = get.call_args
+        self.assertEqual(args[0], 'https://www.example.com/wagtail-transfer/api/pages/12/')
+        self.assertEqual(kwargs['params']['closure'], 2)
+
+    def test_import_multiple_roots(self, get, post):
+        get.return_value.status_code = 200
+        get.return_value.headers = {}
+        get.return_value.content = b"""{
+            "ids_for_import": [
+                ["wagtailcore.page", 15],
+                ["wagtailcore.page", 16]
+            ],
+            "mappings": [
+                ["wagtailcore.page", 15, "15151515-1515-1515-1515-151515151515"],
+                ["wagtailcore.page", 16, "16161616-1616-1616-1616-161616161616"]
+            ],
+            "objects": [
+                {
+                    "model": "tests.simplepage",
+                    "pk": 15,
+                    "parent_id": 12,
+                    "fields": {
+                        "title": "First imported page",
+                        "show_in_menus": false,
+                        "live": true,
+                        "slug": "first-imported-page",
+                        "intro": "The first imported root",
+                        "wagtail_admin_comments": []
+                    }
+                },
+                {
+                    "model": "tests.simplepage",
+                    "pk": 16,
+                    "parent_id": 13,
+                    "fields": {
+                        "title": "Second imported page",
+                        "show_in_menus": false,
+                        "live": true,
+                        "slug": "second-imported-page",
+                        "intro": "The second imported root",
+                        "wagtail_admin_comments": []
+                    }
+                }
+            ]
+        }"""
+
+        response = self.client.post('/admin/wagtail-transfer/import/', {
+            'source': 'staging',
+            'source_page_id': ['15', '16'],
+            'dest_page_id': ['2', '3'],
+        })
+        self.assertRedirects(response, '/admin/pages/2/')
+
+        # both subtrees are requested together
+        get.assert_called_once()
+        args, kwargs = get.call_args
+        self.assertEqual(args[0], 'https://www.example.com/wagtail-transfer/api/pages/')
+        self.assertEqual(kwargs['params']['ids'], '15,16')
+        self.assertEqual(kwargs['params']['digest'], digest_for_source('staging', '15,16'))
+
+        self.assertEqual(Page.objects.get(slug='first-imported-page').get_parent().pk, 2)
+        self.assertEqual(Page.objects.get(slug='second-imported-page').get_parent().pk, 3)
+
+    @mock.patch('wagtail_transfer.imports.MIN_COMPRESSED_REQUEST_SIZE', 0)
+    def test_compressed_requests(self, get, post):
+        get.return_value.status_code = 200
+        get.return_value.headers = {}
+        get.return_value.content = b"""{
+            "ids_for_import": [
+                ["wagtailcore.page", 12]
+            ],
+            "mappings": [
+                ["wagtailcore.page", 12, "12121212-1212-1212-1212-121212121212"],
+                ["tests.advert", 8, "adadadad-8888-8888-8888-888888888888"]
+            ],
+            "objects": [
+                {
+                    "model": "tests.sponsoredpage",
+                    "pk": 12,
+                    "parent_id": 1,
+                    "fields": {
+                        "title": "Oil is still great",
+                        "show_in_menus": false,
+                        "live": true,
+                        "slug": "oil-is-still-great",
+                        "advert": 8,
+                        "intro": "yay fossil fuels and climate change",
+                        "categories": [],
+                        "wagtail_admin_comments": []
+                    }
+                }
+            ]
+        }"""
+        post.return_value.status_code = 200
+        post.return_value.content = b"""{
+            "ids_for_import": [],
+            "mappings": [],
+            "objects": []
+        }"""
+
+        self.client.post('/admin/wagtail-transfer/import/', {
+            'source': 'staging',
+            'source_page_id': '12',
+            'dest_page_id': '2',
+        })
+
+        # the objects API request body is gzipped, and the digest is of the uncompressed body
+        args, kwargs = post.call_args
+        self.assertEqual(kwargs['headers']['Content-Encoding'], 'gzip')
+        request_data = gzip.decompress(kwargs['data'])
+        self.assertEqual(json.loads(request_data), {'tests.advert': [8]})
+        self.assertEqual(kwargs['params']['digest'], digest_for_source('staging', request_data))
+
+        # compression can be disabled for the source
+        sources = {
+            'staging': {
+                'BASE_URL': 'https://www.example.com/wagtail-transfer/',
+                'SECRET_KEY': 'i-am-the-staging-example-secret-key',
+                'COMPRESSION_LEVEL': 0,
+            },
+        }
+        with override_settings(WAGTAILTRANSFER_SOURCES=sources):
+            self.client.post('/admin/wagtail-transfer/import/', {
+                'source': 'staging',
+                'source_page_id': '12',
+                'dest_page_id': '2',
+            })
+        args, kwargs = get.call_args
+        self.assertEqual(kwargs['headers']['Accept-Encoding'], 'identity')
+        args, kwargs = post.call_args
+        self.assertNotIn('Content-Encoding', kwargs['headers'])
+        self.assertEqual(json.loads(kwargs['data']), {'tests.advert': [8]})
+
+    def test_chunked_model_import(self, get, post):
+        first_page = mock.Mock(status_code=200, headers={'ETag': '"abc123"'}, content=b"""{
+            "ids_for_import": [["tests.category", 101]],
+            "mappings": [["tests.category", 101, "cacacaca-0101-0101-0101-010101010101"]],
+            "objects": [
+                {"model": "tests.category", "pk": 101, "fields": {"name": "Boats", "colour": "blue"}}
+            ],
+            "timestamp": "2024-01-01T12:00:00Z",
+            "next": 101
+        }""")
+        second_page = mock.Mock(status_code=200, headers={}, content=b"""{
+            "ids_for_import": [["tests.category", 102]],
+            "mappings": [["tests.category", 102, "cacacaca-0102-0102-0102-010201020102"]],
+            "objects": [
+                {"model": "tests.category", "pk": 102, "fields": {"name": "Planes", "colour": "white"}}
+            ],
+            "timestamp": "2024-01-01T12:00:05Z",
+            "next": null
+        }""")
+        get.side_effect = [first_page, second_page]
+
+        sources = {
+            'staging': {
+                'BASE_URL': 'https://www.example.com/wagtail-transfer/',
+                'SECRET_KEY': 'i-am-the-staging-example-secret-key',
+                'CHUNK_SIZE': 1,
+            },
+        }
+        with override_settings(WAGTAILTRANSFER_SOURCES=sources):
+            self.client.post('/admin/wagtail-transfer/import/', {
+                'type': 'model',
+                'source': 'staging',
+                'source_model': 'tests.category',
+            })
+
+        # each page is requested in turn, following the cursor from the previous one
+        first_call, second_call = get.call_args_list
+        self.assertEqual(first_call.kwargs['params']['limit'], 1)
+        self.assertNotIn('after', first_call.kwargs['params'])
+        self.assertEqual(second_call.kwargs['params']['after'], 101)
+
+        self.assertTrue(Category.objects.filter(name='Boats').exists())
+        self.assertTrue(Category.objects.filter(name='Planes').exists())
+
+        # the checkpoint records the ETag and timestamp of the first page
+        checkpoint = ImportCheckpoint.objects.get(source_site='staging', source_root='tests.category')
+        self.assertEqual(checkpoint.etag, '"abc123"')
+        self.assertEqual(checkpoint.watermark, datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc))
+
+    def test_import_instrumentation(self, get, post):
+        get.return_value.status_code = 200
+        get.return_value.headers = {}
+        get.return_value.content = b"""{
+            "ids_for_import": [["wagtailcore.page", 15]],
+            "mappings": [
+                ["wagtailcore.page", 15, "15151515-1515-1515-1515-151515151515"],
+                ["tests.advert", 11, "adadadad-1111-1111-1111-111111111111"]
+            ],
+            "objects": [
+                {
+                    "model": "tests.sponsoredpage",
+                    "pk": 15,
+                    "parent_id": 12,
+                    "fields": {
+                        "title": "Instrumented page",
+                        "show_in_menus": false,
+                        "live": true,
+                        "slug": "instrumented-page",
+                        "advert": 11,
+                        "intro": "Timed and counted",
+                        "categories": [],
+                        "wagtail_admin_comments": []
+                    }
+                },
+                {
+                    "model": "tests.advert",
+                    "pk": 11,
+                    "fields": {
+                        "slogan": "put a tiger in your tank",
+                        "run_until": "2020-12-23T12:34:56Z",
+                        "run_from": null,
+                        "tags": "[]"
+                    }
+                }
+            ]
+        }"""
+
+        phases = []
+        summaries = []
+
+        def phase_receiver(sender, kind, phase, duration, queries, **kwargs):
+            phases.append((kind, phase))
+
+        def import_receiver(sender, instrumentation, summary, **kwargs):
+            summaries.append(summary)
+
+        transfer_phase_finished.connect(phase_receiver)
+        transfer_import_finished.connect(import_receiver)
+        try:
+            with self.assertLogs('wagtail_transfer.instrumentation', level='INFO') as logs:
+                self.client.post('/admin/wagtail-transfer/import/', {
+                    'source': 'staging',
+                    'source_page_id': '15',
+                    'dest_page_id': '2',
+                })
+        finally:
+            transfer_phase_finished.disconnect(phase_receiver)
+            transfer_import_finished.disconnect(import_receiver)
+
+        self.assertTrue(Page.objects.filter(slug='instrumented-page').exists())
+        self.assertIn('Import (source_site=staging', logs.output[0])
+
+        self.assertIn(('import', 'fetching'), phases)
+        self.assertIn(('import', 'lookups'), phases)
+        self.assertLess(phases.index(('import', 'lookups')), phases.index(('import', 'planning')))
+
+        summary, = summaries
+        self.assertEqual(summary['status'], 'completed')
+        self.assertEqual(summary['import_type'], 'page')
+        self.assertEqual(
+            set(summary['phases']),
+            {'fetching', 'planning', 'lookups', 'ordering', 'operations', 'revisions'}
+        )
+        self.assertEqual(summary['operations']['CreateTreeModel']['count'], 1)
+        self.assertGreater(summary['operations']['CreateTreeModel']['queries'], 0)
+        self.assertEqual(
+            summary['queries'],
+            sum(
+                entry['queries'] for phase, entry in summary['phases'].items()
+                if phase != 'lookups'
+            )
+        )
+
+    def test_import_history(self, get, post):
+        get.return_value.status_code = 200
+        get.return_value.headers = {}
+        get.return_value.content = b"""{
+            "ids_for_import": [["wagtailcore.page", 12]],
+            "mappings": [["wagtailcore.page", 12, "22222222-2222-2222-2222-222222222222"]],
+            "objects": [
+                {
+                    "model": "tests.simplepage",
+                    "pk": 12,
+                    "parent_id": 1,
+                    "fields": {
+                        "title": "Home",
+                        "show_in_menus": false,
+                        "live": true,
+                        "slug": "home",
+                        "intro": "This is the updated homepage",
+                        "wagtail_admin_comments": []
+                    }
+                }
+            ]
+        }"""
+
+        self.client.post('/admin/wagtail-transfer/import/', {
+            'source': 'staging',
+            'source_page_id': '12',
+            'dest_page_id': '',
+        })
+
+        record = ImportRecord.objects.get()
+        self.assertEqual(record.source_site, 'staging')
+        self.assertEqual(record.import_type, 'page')
+        self.assertEqual(record.status, ImportRecord.STATUS_COMPLETED)
+        self.assertEqual(record.round_trips, 1)
+        self.assertEqual(record.bytes_transferred, len(get.return_value.content))
+        self.assertEqual(record.object_counts, {'tests.simplepage': {'update': 1}})
+        self.assertEqual(record.operations['UpdateModel']['count'], 1)
+        self.assertIn('planning', record.phases)
+
+        response = self.client.get('/admin/wagtail-transfer/history/?ordering=-duration')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '/admin/wagtail-transfer/history/%d/' % record.pk)
+
+        # unknown orderings are ignored
+        response = self.client.get('/admin/wagtail-transfer/history/?ordering=parameters')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['ordering'], '-started_at')
+
+        response = self.client.get('/admin/wagtail-transfer/history/%d/' % record.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'UpdateModel')
+        self.assertContains(response, 'tests.simplepage')
+
+    def test_profiled_import(self, get, post):
+        get.return_value.status_code = 200
+        get.return_value.headers = {}
+        get.return_value.content = b"""{
+            "ids_for_import": [],
+            "mappings": [],
+            "objects": []
+        }"""
+
+        with tempfile.TemporaryDirectory() as profile_dir:
+            with override_settings(WAGTAILTRANSFER_PROFILING={'DIRECTORY': profile_dir}):
+                response = self.client.get('/admin/wagtail-transfer/choose/?profile=1')
+                self.assertContains(response, 'data-action="/admin/wagtail-transfer/import/?profile=1"')
+
+                self.client.post('/admin/wagtail-transfer/import/?profile=1', {
+                    'source': 'staging',
+                    'source_page_id': '12',
+                    'dest_page_id': '2',
+                })
+
+            record = ImportRecord.objects.get()
+            self.assertTrue(record.parameters['profile'])
+            self.assertEqual(os.listdir(profile_dir), ['import-%s.prof' % record.run_id])
+
+        # the source site is asked to profile its export, with a run ID based on the import's, which
+        # is signed along with the request
+        args, kwargs = get.call_args
+        self.assertEqual(kwargs['params']['profile'], '%s-1' % record.run_id)
+        self.assertEqual(
+            kwargs['params']['digest'], digest_for_source('staging', 'profile=%s-1\n12' % record.run_id)
+        )
+
+    def test_profiling_requires_superuser(self, get, post):
+        get.return_value.status_code = 200
+        get.return_value.headers = {}
+        get.return_value.content = b"""{
+            "ids_for_import": [],
+            "mappings": [],
+            "objects": []
+        }"""
+
+        user = User.objects.create_user(username='editor', password='password')
+        user.user_permissions.add(
+            Permission.objects.get(content_type__app_label='wagtailadmin', codename='access_admin'),
+            Permission.objects.get(content_type__app_label='wagtail_transfer', codename='wagtailtransfer_can_import'),
+        )
+        self.client.login(username='editor', password='password')
+
+        with tempfile.TemporaryDirectory() as profile_dir:
+            with override_settings(WAGTAILTRANSFER_PROFILING={'DIRECTORY': profile_dir}):
+                self.client.post('/admin/wagtail-transfer/import/?profile=1', {
+                    'source': 'staging',
+                    'source_page_id': '12',
+                    'dest_page_id': '2',
+                })
+            self.assertEqual(os.listdir(profile_dir), [])
+
+        args, kwargs = get.call_args
+        self.assertNotIn('profile', kwargs['params'])
+
+    @override_settings(WAGTAILTRANSFER_IMPORT_RUNNER='wagtail_transfer.jobs.DatabaseImportRunner')
+    def test_queued_import(self, get, post):
+        get.return_value.status_code = 200
+        get.return_value.headers = {}
+        get.return_value.content = b"""{
+            "ids_for_import": [["wagtailcore.page", 15]],
+            "mappings": [["wagtailcore.page", 15, "15151515-1515-1515-1515-151515151515"]],
+            "objects": [
+                {
+                    "model": "tests.simplepage",
+                    "pk": 15,
+                    "parent_id": 12,
+                    "fields": {
+                        "title": "Queued page",
+                        "show_in_menus": false,
+                        "live": true,
+                        "slug": "queued-page",
+                        "intro": "Imported by a worker",
+                        "wagtail_admin_comments": []
+                    }
+                }
+            ]
+        }"""
+
+        response = self.client.post('/admin/wagtail-transfer/import/', {
+            'source': 'staging',
+            'source_page_id': '15',
+            'dest_page_id': '2',
+        })
+
+        # the import is queued rather than run within the request
+        job = ImportJob.objects.get()
+        self.assertRedirects(response, '/admin/wagtail-transfer/jobs/%d/' % job.pk)
+        self.assertEqual(job.status, ImportJob.STATUS_QUEUED)
+        self.assertEqual(job.destination_root, 'wagtailcore.page:2')
+        get.assert_not_called()
+        self.assertFalse(Page.objects.filter(slug='queued-page').exists())
+
+        response = self.client.get('/admin/wagtail-transfer/jobs/%d/' % job.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Queued')
+
+        call_command('run_transfer_worker', once=True, verbosity=0)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.STATUS_COMPLETED)
+        self.assertIsNotNone(job.finished_at)
+        self.assertIn('fetching', job.phase_timings)
+        self.assertIn('operations', job.phase_timings)
+        self.assertEqual(Page.objects.get(slug='queued-page').get_parent().pk, 2)
+
+        response = self.client.get('/admin/wagtail-transfer/jobs/%d/' % job.pk)
+        self.assertContains(response, 'href="/admin/pages/2/"')
+
+    def test_one_running_job_per_destination(self, get, post):
+        parameters = {'source_page_ids': ['15'], 'dest_page_ids': ['2']}
+        first_job = create_import_job('page', 'staging', parameters)
+        second_job = create_import_job('page', 'staging', parameters)
+        other_job = create_import_job('page', 'staging', {'source_page_ids': ['16'], 'dest_page_ids': ['3']})
+
+        self.assertTrue(claim_import_job(first_job))
+        # a job can only be claimed once
+        self.assertFalse(claim_import_job(first_job))
+        # another job cannot run against the same destination while the first is running
+        self.assertFalse(claim_import_job(second_job))
+        self.assertTrue(claim_import_job(other_job))
+
+        second_job.refresh_from_db()
+        self.assertEqual(second_job.status, ImportJob.STATUS_QUEUED)
+
+    def test_expired_job_lease(self, get, post):
+        parameters = {'source_page_ids': ['15'], 'dest_page_ids': ['2']}
+        first_job = create_import_job('page', 'staging', parameters)
+        second_job = create_import_job('page', 'staging', parameters)
+        self.assertEqual(claim_next_import_job('worker-1'), first_job)
+
+        # while the first job's lease holds, the second cannot run
+        self.assertIsNone(claim_next_import_job('worker-2'))
+
+        # once the first job has gone without a heartbeat for longer than the timeout, it is
+        # marked as failed, and the second job can run
+        ImportJob.objects.filter(pk=first_job.pk).update(
+            heartbeat_at=django_timezone.now() - timedelta(seconds=61)
+        )
+        with override_settings(WAGTAILTRANSFER_IMPORT_JOB_TIMEOUT=60):
+            self.assertEqual(claim_next_import_job('worker-2'), second_job)
+
+        # the first job's worker gives up at its next heartbeat, leaving the job as failed
+        run_import_job(first_job)
+        get.assert_not_called()
+        self.assertEqual(first_job.status, ImportJob.STATUS_FAILED)
+        self.assertEqual(first_job.error, "The job's worker stopped responding.")
+        second_job.refresh_from_db()
+        self.assertEqual(second_job.status, ImportJob.STATUS_RUNNING)
+
+    @override_settings(WAGTAILTRANSFER_IMPORT_JOB_TIMEOUT=60)
+    def test_heartbeat_within_phase(self, get, post):
+        job = create_import_job('page', 'staging', {'source_page_ids': ['15'], 'dest_page_ids': ['2']})
+        self.assertTrue(claim_import_job(job))
+        completed_operations = []
+        heartbeats = []
+
+        def run_import(import_type, source, parameters, instrumentation):
+            with instrumentation.phase('operations'):
+                for operation in range(4):
+                    with instrumentation.operation(operation):
+                        heartbeats.append(ImportJob.objects.get(pk=job.pk).heartbeat_at)
+                        if operation == 1:
+                            # the lease was renewed as the operation began, as more than a quarter
+                            # of the timeout had passed since the last heartbeat
+                            self.assertGreater(heartbeats[1], heartbeats[0])
+                            # the job's lease then expires
+                            ImportJob.objects.filter(pk=job.pk).update(
+                                heartbeat_at=django_timezone.now() - timedelta(seconds=61)
+                            )
+                            self.assertEqual(claim_next_import_job('worker-2'), None)
+                        # each operation takes 20 seconds
+                        job.heartbeat_at -= timedelta(seconds=20)
+                        completed_operations.append(operation)
+            return []
+
+        with mock.patch('wagtail_transfer.jobs.run_import', run_import):
+            run_import_job(job)
+
+        # the job's worker gives up at the next heartbeat, part way through the phase
+        self.assertEqual(completed_operations, [0, 1])
+        self.assertEqual(job.status, ImportJob.STATUS_FAILED)
+        self.assertEqual(job.error, "The job's worker stopped responding.")
+
+    @override_settings(WAGTAILTRANSFER_SOURCES={
+        'loopback': {
+            'BASE_URL': 'http://testserver/wagtail-transfer/',
+            'SECRET_KEY': 'i-am-the-local-secret-key',
+            'TRANSPORT': 'wagtail_transfer.transports.LoopbackTransport',
+        },
+    })
+    def test_loopback_transport(self, get, post):
+        response = self.client.post('/admin/wagtail-transfer/import/', {
+            'type': 'model',
+            'source': 'loopback',
+            'source_model': 'tests.category',
+            'source_model_object_id': '1',
+        })
+        self.assertEqual(response.status_code, 302)
+
+        # the export was served by this site, without any HTTP requests
+        get.assert_not_called()
+        post.assert_not_called()
+        record = ImportRecord.objects.get()
+        self.assertEqual(record.status, ImportRecord.STATUS_COMPLETED)
+        self.assertEqual(record.round_trips, 1)
+        self.assertEqual(record.object_counts, {'tests.category': {'update': 1}})
+
+    @override_settings(WAGTAILTRANSFER_SOURCES={
+        'loopback': {
+            'BASE_URL': 'http://testserver/wagtail-transfer/',
+            'SECRET_KEY': 'i-am-the-local-secret-key',
+            'TRANSPORT': 'wagtail_transfer.transports.LoopbackTransport',
+        },
+    })
+    def test_loopback_transport_serves_media(self, get, post):
+        transport = get_transport('loopback')
+        with tempfile.TemporaryDirectory() as media_root:
+            with override_settings(MEDIA_ROOT=media_root):
+                with open(os.path.join(media_root, 'test.txt'), 'wb') as f:
+                    f.write(b'file contents')
+                response = transport.get('http://media.example.com/media/test.txt')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, b'file contents')
+
+                response = transport.get('http://media.example.com/media/missing.txt')
+                self.assertEqual(response.status_code, 404)
+
+        # requests outside wagtail_transfer's URLs are not served
+        response = transport.get('http://testserver/admin/')
+        self.assertEqual(response.status_code, 404)
+        get.assert_not_called()
+
+    @override_settings(WAGTAILTRANSFER_SOURCES={
+        'loopback': {
+            'BASE_URL': 'http://testserver/wagtail-transfer/',
+            'SECRET_KEY': 'i-am-the-local-secret-key',
+            'TRANSPORT': 'wagtail_transfer.transports.LoopbackTransport',
+        },
+    })
+    def test_record_and_replay(self, get, post):
+        with tempfile.TemporaryDirectory() as recording_dir:
+            with override_settings(WAGTAILTRANSFER_RECORDING={'DIRECTORY': recording_dir}):
+                self.client.post('/admin/wagtail-transfer/import/', {
+                    'source': 'loopback',
+                    'source_page_id': '2',
+                    'dest_page_id': '1',
+                })
+            record = ImportRecord.objects.get()
+            bundle_dir = os.path.join(recording_dir, record.run_id)
+
+            with open(os.path.join(bundle_dir, 'manifest.json')) as f:
+                manifest = json.load(f)
+            self.assertEqual(manifest['source'], 'loopback')
+            self.assertEqual(manifest['import_type'], 'page')
+            self.assertEqual(manifest['parameters'], {'source_page_ids': ['2'], 'dest_page_ids': ['1']})
+            # the page export, and the request for the adverts to be updated
+            self.assertEqual(len(manifest['responses']), 2)
+            self.assertEqual(manifest['responses'][1]['url'], 'http://testserver/wagtail-transfer/api/objects/')
+
+            with override_settings(WAGTAILTRANSFER_SOURCES={
+                'loopback': {
+                    'BASE_URL': 'http://testserver/wagtail-transfer/',
+                    'SECRET_KEY': 'i-am-the-local-secret-key',
+                    'TRANSPORT': 'wagtail_transfer.recording.ReplayTransport',
+                    'BUNDLE': bundle_dir,
+                },
+            }):
+                run_import('page', 'loopback', manifest['parameters'])
+
+        replayed_record = ImportRecord.objects.exclude(pk=record.pk).get()
+        self.assertEqual(replayed_record.status, ImportRecord.STATUS_COMPLETED)
+        # the same objects are imported again (and found to be unchanged)
+        self.assertEqual(replayed_record.object_counts.keys(), record.object_counts.keys())
+        get.assert_not_called()
+        post.assert_not_called()
+
+    @override_settings(WAGTAILTRANSFER_SOURCES={
+        'loopback': {
+            'BASE_URL': 'http://testserver/wagtail-transfer/',
+            'SECRET_KEY': 'i-am-the-local-secret-key',
+            'TRANSPORT': 'wagtail_transfer.transports.LoopbackTransport',
+        },
+    })
+    def test_transfer_replay_command(self, get, post):
+        command_module = 'wagtail_transfer.management.commands.transfer_replay'
+        with tempfile.TemporaryDirectory() as recording_dir:
+            with override_settings(WAGTAILTRANSFER_RECORDING={'DIRECTORY': recording_dir}):
+                self.client.post('/admin/wagtail-transfer/import/', {
+                    'source': 'loopback',
+                    'source_page_id': '2',
+                    'dest_page_id': '1',
+                })
+            record = ImportRecord.objects.get()
+            bundle_dir = os.path.join(recording_dir, record.run_id)
+            output_path = os.path.join(recording_dir, 'summaries.json')
+            page_count = Page.objects.count()
+
+            # the command sets up a test database of its own; the test runs against the one the
+            # test runner has already set up. It is run on a site that is only a destination, with
+            # no WAGTAILTRANSFER_SECRET_KEY
+            with override_settings(), \
+                    mock.patch(command_module + '.setup_test_environment') as setup_test_environment, \
+                    mock.patch(command_module + '.teardown_test_environment') as teardown_test_environment, \
+                    mock.patch(command_module + '.setup_databases', return_value=[]) as setup_databases, \
+                    mock.patch(command_module + '.teardown_databases') as teardown_databases, \
+                    mock.patch(command_module + '.run_import', wraps=run_import) as replayed_run_import:
+                del settings.WAGTAILTRANSFER_SECRET_KEY
+                call_command(
+                    'transfer_replay', bundle_dir, repeat=2, dest_page_id=3, output=output_path,
+                    stdout=mock.Mock(), stderr=mock.Mock()
+                )
+
+            setup_test_environment.assert_called_once()
+            setup_databases.assert_called_once()
+            teardown_databases.assert_called_once_with([], verbosity=0)
+            teardown_test_environment.assert_called_once()
+
+            self.assertEqual(replayed_run_import.call_count, 2)
+            for call in replayed_run_import.call_args_list:
+                import_type, source, parameters, instrumentation = call.args
+                self.assertEqual((import_type, source), ('page', 'loopback'))
+                self.assertEqual(parameters, {'source_page_ids': ['2'], 'dest_page_ids': ['3']})
+
+            with open(output_path) as f:
+                summaries = json.load(f)
+            self.assertEqual(len(summaries), 2)
+            for summary in summaries:
+                self.assertEqual(summary['replay'], bundle_dir)
+                self.assertEqual(summary['objects'].keys(), record.object_counts.keys())
+
+        # each run was rolled back
+        self.assertEqual(Page.objects.count(), page_count)
+        self.assertEqual(ImportRecord.objects.count(), 1)
+        get.assert_not_called()
+        post.assert_not_called()
+
+    def test_replay_bundle_reloaded_when_recorded_again(self, get, post):
+        with tempfile.TemporaryDirectory() as bundle_dir:
+            manifest_path = os.path.join(bundle_dir, 'manifest.json')
+            manifest = {
+                'version': 1, 'source': 'staging', 'import_type': 'page', 'source_options': {},
+                'parameters': {'source_page_ids': ['2'], 'dest_page_ids': ['1']},
+                'responses': [], 'files': [],
+            }
+            with open(manifest_path, 'w') as f:
+                json.dump(manifest, f)
+            bundle = load_bundle(bundle_dir)
+            self.assertIs(load_bundle(bundle_dir), bundle)
+
+            manifest['parameters']['source_page_ids'] = ['3']
+            with open(manifest_path, 'w') as f:
+                json.dump(manifest, f)
+            stat = os.stat(manifest_path)
+            os.utime(manifest_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+            self.assertEqual(load_bundle(bundle_dir).parameters['source_page_ids'], ['3'])
+
     def test_list_snippet_models(self, get, post):
         # Test the model chooser view.
         get_params = "models=True"
@@ -11,6 +11,9 @@ app_name = 'wagtail_transfer_admin'
 urlpatterns = [
     path('choose/', views.choose_page, name='choose_page'),
     path('import/', views.do_import, name='import'),
+    path('jobs/<int:job_id>/', views.import_job, name='import_job'),
+    path('history/', views.import_records, name='import_records'),
+    path('history/<int:record_id>/', views.import_record, name='import_record'),
     re_path(r'^api/chooser-local/', (chooser_api.urls[0], 'page_chooser_api', 'page_chooser_api')),
     re_path(r'^api/chooser-proxy/(\w+)/([\w\-/]*)$', views.chooser_api_proxy, name='chooser_api_proxy'),
     path('api/check_uid/', views.check_page_existence_for_uid, name='check_uid'),
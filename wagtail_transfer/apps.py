@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class WagtailTransferAppConfig(AppConfig):
     name = 'wagtail_transfer'
     default_auto_field = 'django.db.models.AutoField'
+
+    def ready(self):
+        from .signal_handlers import register_signal_handlers
+
+        register_signal_handlers()
@@ -0,0 +1,108 @@
+"""
+A compact, probabilistic representation of the set of UIDs known to the destination site, sent
+along with export requests so that the source site can omit object data that the destination
+already has. Membership tests may return false positives (at approximately the configured error
+rate) but never false negatives; an object wrongly omitted from an export will be requested
+separately through the objects API.
+"""
+import base64
+import hashlib
+import math
+
+from django.contrib.contenttypes.models import ContentType
+from wagtail.models import Page
+
+from .models import IDMapping, get_read_database
+from .serializers import get_referenced_models
+
+# minimum size of a filter, in bits
+MIN_SIZE = 1024
+
+# maximum number of hash functions accepted in a filter, as each is computed for every UID tested
+# against it. This allows for error rates down to around 1 in 4 billion
+MAX_HASH_COUNT = 32
+
+
+class BloomFilter:
+    def __init__(self, size, hash_count, data=None):
+        self.size = size
+        self.hash_count = hash_count
+        self.data = bytearray(data) if data is not None else bytearray((size + 7) // 8)
+        if len(self.data) != (size + 7) // 8:
+            raise ValueError("Bloom filter data does not match its size")
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate=0.01):
+        """
+        Return an empty filter sized to hold the given number of items with the given rate of
+        false positives
+        """
+        size = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        hash_count = max(1, round(-math.log2(error_rate)))
+        # very small filters are cheap to send, and would otherwise be prone to false positives
+        return cls(max(size, MIN_SIZE), hash_count)
+
+    def _get_positions(self, item):
+        # derive all bit positions from a single digest, using double hashing
+        digest = hashlib.sha256(str(item).lower().encode('utf-8')).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item):
+        for position in self._get_positions(item):
+            self.data[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, item):
+        return all(
+            self.data[position // 8] & (1 << (position % 8))
+            for position in self._get_positions(item)
+        )
+
+    def to_json(self):
+        return {
+            'size': self.size,
+            'hash_count': self.hash_count,
+            'data': base64.b64encode(bytes(self.data)).decode('ascii'),
+        }
+
+    @classmethod
+    def from_json(cls, json_data):
+        """
+        Return the filter serialized by to_json, raising ValueError if the data is invalid
+        """
+        size, hash_count = json_data['size'], json_data['hash_count']
+        if type(size) is not int or size < 1:
+            raise ValueError("Invalid Bloom filter size: %r" % size)
+        if type(hash_count) is not int or not 1 <= hash_count <= MAX_HASH_COUNT:
+            raise ValueError("Invalid Bloom filter hash count: %r" % hash_count)
+        return cls(size, hash_count, base64.b64decode(json_data['data']))
+
+
+def get_known_uids_filter(models, exclude_models=(), max_count=None):
+    """
+    Return a BloomFilter of the UIDs in the IDMapping table for objects that may be referenced by
+    objects of the given models (the models being imported), excluding pages and any models whose
+    labels are given in exclude_models (typically UPDATE_RELATED_MODELS, as the destination needs
+    up-to-date object data for these regardless). If max_count is given and there are more UIDs
+    than this, return None instead, as the filter would be too large to send.
+    """
+    referenced_models = get_referenced_models(models)
+    content_type_ids = [
+        content_type.pk
+        for content_type in ContentType.objects.db_manager(get_read_database()).filter(
+            pk__in=IDMapping.objects.using(get_read_database()).values('content_type')
+        )
+        if content_type.model_class() in referenced_models
+        and not issubclass(content_type.model_class(), Page)
+        and '%s.%s' % (content_type.app_label, content_type.model) not in exclude_models
+    ]
+
+    uids = IDMapping.objects.using(get_read_database()).filter(content_type_id__in=content_type_ids)
+    count = uids.count()
+    if max_count is not None and count > max_count:
+        return None
+    known_uids = BloomFilter.for_capacity(count)
+    for uid in uids.values_list('uid', flat=True).iterator():
+        known_uids.add(uid)
+    return known_uids
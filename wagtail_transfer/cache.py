@@ -0,0 +1,37 @@
+"""
+Optional cache of serialized object data, used on the source site to avoid re-serializing
+objects that have not changed since they were last exported. Entries are keyed on the base model
+and primary key of the object, and are invalidated through model signals (see signal_handlers.py).
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import get_base_model
+
+
+def get_serialization_cache():
+    """
+    Return the cache backend named by the WAGTAILTRANSFER_SERIALIZATION_CACHE setting, or None
+    if caching of serialized objects is disabled
+    """
+    cache_alias = getattr(settings, 'WAGTAILTRANSFER_SERIALIZATION_CACHE', None)
+    if cache_alias is None:
+        return None
+    return caches[cache_alias]
+
+
+def get_cache_key(model, pk):
+    return 'wagtail-transfer:serialized:%s:%s' % (get_base_model(model)._meta.label_lower, pk)
+
+
+def invalidate_objects(objects):
+    """
+    Remove the cached serializations for the given iterable of (model_class, pk) pairs
+    """
+    cache = get_serialization_cache()
+    if cache is None:
+        return
+
+    keys = [get_cache_key(model, pk) for model, pk in objects if pk is not None]
+    if keys:
+        cache.delete_many(keys)
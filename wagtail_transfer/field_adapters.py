@@ -22,7 +22,8 @@ from .files import File, FileTransferError, get_file_hash, get_file_size
 from .locators import get_locator_for_model
 from .models import get_base_model, get_base_model_for_path, normalize_model_label
 from .richtext import get_reference_handler
-from .streamfield import get_object_references, update_object_ids
+from .streamfield import (get_block_handler, get_object_references,
+                          update_object_ids)
 
 
 logger = logging.getLogger(__name__)
@@ -117,6 +118,22 @@ class FieldAdapter:
         """
         return set()
 
+    def get_prefetch_lookups(self):
+        """
+        Return a list of lookups to pass to prefetch_related_objects on a batch of instances
+        before they are serialized, so that serialize, get_object_references and
+        get_objects_to_serialize can be called on each instance without further queries
+        """
+        return []
+
+    def get_referenced_models(self):
+        """
+        Return a set of the base model classes of objects that get_object_references may return
+        for this field, on any instance. Fields that can reference objects of any model (such as
+        generic foreign keys) return an empty set.
+        """
+        return set()
+
 
 
 class ForeignKeyAdapter(FieldAdapter):
@@ -145,6 +162,9 @@ class ForeignKeyAdapter(FieldAdapter):
     def update_object_references(self, value, destination_ids_by_source):
         return destination_ids_by_source.get((self.related_base_model, value))
 
+    def get_referenced_models(self):
+        return {self.related_base_model}
+
 
 class GenericForeignKeyAdapter(FieldAdapter):
     def serialize(self, instance):
@@ -223,13 +243,14 @@ class ManyToOneRelAdapter(FieldAdapter):
 
     def serialize(self, instance):
         if self.is_parental or self.is_followed:
-            return list(self._get_related_objects(instance).values_list('pk', flat=True))
+            # read the pks from the (possibly prefetched) objects, rather than with a new query
+            return [obj.pk for obj in self._get_related_objects(instance)]
 
     def get_object_references(self, instance):
         refs = set()
         if self.is_parental or self.is_followed:
-            for pk in self._get_related_objects(instance).values_list('pk', flat=True):
-                refs.add((self.related_base_model, pk))
+            for obj in self._get_related_objects(instance):
+                refs.add((self.related_base_model, obj.pk))
         else:
             logger.debug(f"{self.field}, {get_base_model(self.field.model)._meta.label_lower, self.name}"
                          " is not parental or followed, not adding to refs")
@@ -256,6 +277,16 @@ class ManyToOneRelAdapter(FieldAdapter):
             return getattr(instance, self.name).all()
         return set()
 
+    def get_prefetch_lookups(self):
+        if self.is_parental or self.is_followed:
+            return [self.name]
+        return []
+
+    def get_referenced_models(self):
+        if self.is_parental or self.is_followed:
+            return {self.related_base_model}
+        return set()
+
     def populate_field(self, instance, value, context):
         pass
 
@@ -273,6 +304,9 @@ class RichTextAdapter(FieldAdapter):
     def update_object_references(self, value, destination_ids_by_source):
         return get_reference_handler().update_ids(value, destination_ids_by_source)
 
+    def get_referenced_models(self):
+        return get_reference_handler().get_referenced_models()
+
 
 class StreamFieldAdapter(FieldAdapter):
     def __init__(self, field):
@@ -293,6 +327,9 @@ class StreamFieldAdapter(FieldAdapter):
     def update_object_references(self, value, destination_ids_by_source):
         return json.dumps(update_object_ids(self.stream_block, json.loads(value), destination_ids_by_source))
 
+    def get_referenced_models(self):
+        return get_block_handler(self.stream_block).get_referenced_models()
+
 
 class FileAdapter(FieldAdapter):
     def serialize(self, instance):
@@ -334,10 +371,11 @@ class FileAdapter(FieldAdapter):
 
             _file = File(local_filename, value['size'], value['hash'], value['download_url'], context.source_site)
             try:
-                imported_file = _file.transfer()
+                imported_file = _file.transfer(context.instrumentation)
             except FileTransferError:
                 return None
             context.imported_files_by_source_url[_file.source_url] = imported_file
+            context.instrumentation.record_file(imported_file)
 
         value = imported_file.file.name
         getattr(instance, self.field.get_attname()).name = value
@@ -360,10 +398,16 @@ class ManyToManyFieldAdapter(FieldAdapter):
     def get_dependencies(self, value):
         return {(self.related_base_model, id, False) for id in value}
 
+    def get_referenced_models(self):
+        return {self.related_base_model}
+
     def serialize(self, instance):
         pks = list(self._get_pks(instance))
         return pks
 
+    def get_prefetch_lookups(self):
+        return [self.name]
+
     def populate_field(self, instance, value, context):
         # setting forward ManyToMany directly is prohibited
         pass
@@ -1,11 +1,11 @@
 import hashlib
 from contextlib import contextmanager
 
-import requests
 from django.core.files.base import ContentFile
 
-from .models import ImportedFile
-from .auth import requests_auth
+from .models import ImportedFile, get_write_database
+from .metrics import file_transfer_bytes
+from .transports import get_transport
 
 
 @contextmanager
@@ -104,13 +104,15 @@ class File:
         self.source_url = source_url
         self.source_site = source_site
 
-    def transfer(self):
-        response = requests.get(self.source_url, auth=requests_auth(self.source_site))
+    def transfer(self, instrumentation=None):
+        response = get_transport(self.source_site, instrumentation).get(self.source_url)
 
         if response.status_code != 200:
             raise FileTransferError("Non-200 response from image URL")
 
-        return ImportedFile.objects.create(
+        file_transfer_bytes.observe(len(response.content), source=self.source_site)
+
+        return ImportedFile.objects.using(get_write_database()).create(
             file=ContentFile(response.content, name=self.local_filename),
             source_url=self.source_url,
             hash=self.hash,
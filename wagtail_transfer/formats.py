@@ -0,0 +1,119 @@
+"""
+Encoding of export API responses. Version 1 of the format is plain JSON as described in
+ImportPlanner.add_json. Version 2 has the same structure, but replaces the model labels in
+'ids_for_import', 'mappings', 'objects' and 'manifest' with indexes into a 'models' table, and
+omits whitespace. The importer requests version 2 through the Accept header, and falls back on
+version 1 for sources that do not support it.
+"""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+
+V1_CONTENT_TYPE = 'application/json'
+V2_CONTENT_TYPE = 'application/vnd.wagtail-transfer.v2+json'
+
+# the Accept header sent by the importer, in order of preference
+ACCEPT_HEADER = '%s, %s;q=0.9' % (V2_CONTENT_TYPE, V1_CONTENT_TYPE)
+
+
+def get_requested_format(request):
+    """
+    Return the format version requested by an export API request, through either the 'format'
+    parameter or the Accept header
+    """
+    if request.GET.get('format') == '2':
+        return 2
+    if request.GET.get('format') == '1':
+        return 1
+    if V2_CONTENT_TYPE in request.headers.get('Accept', ''):
+        return 2
+    return 1
+
+
+def encode_v2(data):
+    models = []
+    model_indexes = {}
+
+    def get_index(model_path):
+        try:
+            return model_indexes[model_path]
+        except KeyError:
+            model_indexes[model_path] = len(models)
+            models.append(model_path)
+            return model_indexes[model_path]
+
+    encoded = dict(data)
+    encoded['format'] = 2
+    encoded['ids_for_import'] = [
+        [get_index(model_path), pk] for model_path, pk in data['ids_for_import']
+    ]
+    encoded['mappings'] = [
+        [get_index(model_path), pk, uid] for model_path, pk, uid in data['mappings']
+    ]
+    encoded['objects'] = [
+        dict(obj, model=get_index(obj['model'])) for obj in data['objects']
+    ]
+    if 'manifest' in data:
+        encoded['manifest'] = [
+            [get_index(model_path), pk] for model_path, pk in data['manifest']
+        ]
+    encoded['models'] = models
+    return encoded
+
+
+def decode_v2(data):
+    models = data['models']
+    decoded = {
+        key: value for key, value in data.items()
+        if key not in ('format', 'models')
+    }
+    decoded['ids_for_import'] = [
+        [models[index], pk] for index, pk in data['ids_for_import']
+    ]
+    decoded['mappings'] = [
+        [models[index], pk, uid] for index, pk, uid in data['mappings']
+    ]
+    decoded['objects'] = [
+        dict(obj, model=models[obj['model']]) for obj in data['objects']
+    ]
+    if 'manifest' in data:
+        decoded['manifest'] = [
+            [models[index], pk] for index, pk in data['manifest']
+        ]
+    return decoded
+
+
+def decode_export(data):
+    """
+    Given the parsed JSON of an export API response in any supported format, return it in the
+    version 1 format
+    """
+    version = data.get('format', 1)
+    if version == 1:
+        return data
+    elif version == 2:
+        return decode_v2(data)
+    else:
+        raise ValueError("Unsupported export format: %r" % version)
+
+
+def export_response(request, data):
+    """
+    Return an HttpResponse for the given export data (in version 1 format), encoded in the format
+    requested by the request
+    """
+    if get_requested_format(request) == 2:
+        response = HttpResponse(
+            json.dumps(encode_v2(data), cls=DjangoJSONEncoder, separators=(',', ':')),
+            content_type=V2_CONTENT_TYPE
+        )
+    else:
+        response = HttpResponse(
+            json.dumps(data, cls=DjangoJSONEncoder, indent=2),
+            content_type=V1_CONTENT_TYPE
+        )
+    patch_vary_headers(response, ['Accept'])
+    return response
@@ -0,0 +1,455 @@
+"""
+Importing content from a source site: requesting the pages or objects to import from the source's
+export API, planning the import with ImportPlanner, and running it. run_import is the entry point,
+used both by the import view and by import jobs (see jobs.py).
+"""
+import gzip
+import hashlib
+import json
+from collections import defaultdict
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from wagtail.models import Page
+
+from .auth import digest_for_source
+from .bloom import get_known_uids_filter
+from .formats import ACCEPT_HEADER
+from .instrumentation import Instrumentation
+from .metrics import planner_round_trips
+from .models import (ImportCheckpoint, get_last_modified_field, get_model_for_path,
+                     get_queryset_fingerprint, get_write_database)
+from .operations import UPDATE_RELATED_MODELS, ImportContext, ImportPlanner
+from .profiling import is_profiling_enabled, profile
+from .recording import Recorder, is_recording_enabled
+from .transports import get_transport
+
+
+# gzip compression level used for requests to source sites, unless overridden by the source's
+# COMPRESSION_LEVEL setting
+DEFAULT_COMPRESSION_LEVEL = 6
+
+# request bodies smaller than this (in bytes) are not worth compressing
+MIN_COMPRESSED_REQUEST_SIZE = 1024
+
+# number of objects requested per page of a model export, unless overridden by the source's
+# CHUNK_SIZE setting
+DEFAULT_CHUNK_SIZE = 1000
+
+# maximum number of UIDs sent to a source site in a known UIDs filter, unless overridden by the
+# source's KNOWN_UIDS_LIMIT setting. The filter takes around 1.2 bytes per UID (1.6 once base64
+# encoded), so this keeps it well within the source's default DATA_UPLOAD_MAX_MEMORY_SIZE of 2.5MB
+DEFAULT_KNOWN_UIDS_LIMIT = 1000000
+
+
+def import_missing_object_data(source, importer: ImportPlanner, known_uids_data=None):
+    base_url = settings.WAGTAILTRANSFER_SOURCES[source]['BASE_URL']
+    round_trips = 0
+    while importer.missing_object_data:
+        # convert missing_object_data from a set of (model_class, id) tuples
+        # into a dict of {model_class_label: [list_of_ids]}
+        missing_object_data_by_type = defaultdict(list)
+        for model_class, source_id in importer.missing_object_data:
+            missing_object_data_by_type[model_class].append(source_id)
+
+        request_data = json.dumps({
+            **{
+                model_class._meta.label_lower: ids
+                for model_class, ids in missing_object_data_by_type.items()
+            },
+            **(known_uids_data or {}),
+        })
+        params = sign_export_params(
+            source, request_data, get_export_params(source), importer.context.instrumentation
+        )
+
+        # request the missing object data and add to the import plan
+        headers = get_export_headers(source)
+        with importer.context.instrumentation.phase('fetching'):
+            response = get_transport(source, importer.context.instrumentation).post(
+                f"{base_url}api/objects/",
+                params=params,
+                data=compress_request_body(source, request_data, headers),
+                headers=headers
+            )
+            importer.context.instrumentation.record_response(response)
+        round_trips += 1
+        importer.add_json(response.content)
+    planner_round_trips.observe(round_trips, source=source)
+    importer.run()
+    return importer
+
+
+def get_import_checkpoint(source, source_root, destination_root):
+    """
+    Return the ImportCheckpoint for the given source content and destination, or an unsaved one
+    if this content has not been imported here before
+    """
+    try:
+        return ImportCheckpoint.objects.get(
+            source_site=source, source_root=source_root, destination_root=destination_root
+        )
+    except ImportCheckpoint.DoesNotExist:
+        return ImportCheckpoint(
+            source_site=source, source_root=source_root, destination_root=destination_root
+        )
+
+
+def get_destination_fingerprint(queryset, last_modified_fields):
+    """
+    Return a fingerprint (as stored in ImportCheckpoint.destination_fingerprint) of the destination
+    content that an import writes to. This is read from the write database, as it follows the
+    import's own writes.
+    """
+    fingerprint = get_queryset_fingerprint(queryset.using(get_write_database()), last_modified_fields)
+    return hashlib.sha1(json.dumps(fingerprint, cls=DjangoJSONEncoder).encode('utf-8')).hexdigest()
+
+
+def get_page_destination_fingerprint(dest_page_ids):
+    """
+    Return the destination fingerprint for a page import: that of the subtrees under the
+    destination parent pages, or of the whole page tree when importing at the top level
+    """
+    pages = Page.objects.using(get_write_database())
+    if all(dest_page_ids):
+        subtrees = Q()
+        for path in pages.filter(pk__in=dest_page_ids).values_list('path', flat=True):
+            subtrees |= Q(path__startswith=path)
+        pages = pages.filter(subtrees)
+    return get_destination_fingerprint(pages, ['latest_revision_created_at', 'last_published_at'])
+
+
+def get_model_destination_fingerprint(model):
+    """
+    Return the destination fingerprint for a model import: that of all objects of the model
+    """
+    model = get_model_for_path(model)
+    last_modified_field = get_last_modified_field(model)
+    return get_destination_fingerprint(
+        model._default_manager.all(), [last_modified_field] if last_modified_field else []
+    )
+
+
+def get_conditional_checkpoint(checkpoint, destination_fingerprint, force=False):
+    """
+    Return the checkpoint that an import's requests should be made conditional on, or None if the
+    content is to be imported in full - either because this was requested with 'force', or because
+    the content at the destination has been edited or deleted since the last import, and the
+    source's unchanged content needs to be imported again to restore it
+    """
+    if force or checkpoint.destination_fingerprint != destination_fingerprint:
+        return None
+    return checkpoint
+
+
+def get_compression_level(source):
+    return settings.WAGTAILTRANSFER_SOURCES[source].get('COMPRESSION_LEVEL', DEFAULT_COMPRESSION_LEVEL)
+
+
+def get_export_headers(source, checkpoint=None):
+    """
+    Return the HTTP headers for an export API request, making it conditional on the content having
+    changed since the last import if there is one
+    """
+    headers = {'Accept': ACCEPT_HEADER}
+    if not get_compression_level(source):
+        headers['Accept-Encoding'] = 'identity'
+    if checkpoint is not None and checkpoint.etag:
+        headers['If-None-Match'] = checkpoint.etag
+    return headers
+
+
+def compress_request_body(source, body, headers):
+    """
+    Gzip the body of a request to the source's export API, if compression is enabled for the
+    source and the body is large enough to benefit. Returns the new body, and updates headers
+    accordingly.
+    """
+    compression_level = get_compression_level(source)
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    if not compression_level or len(body) < MIN_COMPRESSED_REQUEST_SIZE:
+        return body
+
+    headers['Content-Encoding'] = 'gzip'
+    return gzip.compress(body, compresslevel=compression_level)
+
+
+def get_export_params(source, checkpoint=None):
+    """
+    Return the query parameters for an export API request, requesting only the changes since
+    the last import if there is one, and referenced objects up to the source's CLOSURE_DEPTH.
+    The digest is added by sign_export_params.
+    """
+    params = {}
+    closure_depth = settings.WAGTAILTRANSFER_SOURCES[source].get('CLOSURE_DEPTH', 0)
+    if closure_depth:
+        params['closure'] = closure_depth
+    if checkpoint is not None and checkpoint.watermark:
+        params['since'] = checkpoint.watermark.isoformat()
+    return params
+
+
+def get_known_uids_data(source, models):
+    """
+    Return the data to be posted to the source's export endpoints to tell it which of the objects
+    that the given models can reference we already have. This is built once per import, and reused
+    for all of its requests. It is only useful if the source is including referenced objects in
+    its exports (as configured by CLOSURE_DEPTH), and is otherwise empty - as it is if we have more
+    of these objects than the source's KNOWN_UIDS_LIMIT, in which case the source sends them all.
+    """
+    source_settings = settings.WAGTAILTRANSFER_SOURCES[source]
+    if not source_settings.get('CLOSURE_DEPTH'):
+        return {}
+    known_uids = get_known_uids_filter(
+        models, exclude_models=UPDATE_RELATED_MODELS,
+        max_count=source_settings.get('KNOWN_UIDS_LIMIT', DEFAULT_KNOWN_UIDS_LIMIT)
+    )
+    if known_uids is None:
+        return {}
+    return {'known_uids': known_uids.to_json()}
+
+
+def sign_export_params(source, message, params, instrumentation=None):
+    """
+    Return the query parameters for an export API request with the digest added, signing the given
+    message. If the import is being profiled, the source is asked to profile the export too, under
+    a run ID made from the import's run ID and the number of the request; this 'profile' parameter
+    is signed along with the message, so that requests cannot be altered to have the source
+    profile them.
+    """
+    params = dict(params)
+    if instrumentation is not None and instrumentation.profiling:
+        instrumentation.profiled_exports += 1
+        params['profile'] = '%s-%d' % (instrumentation.run_id, instrumentation.profiled_exports)
+        message = 'profile=%s\n%s' % (params['profile'], message)
+    params['digest'] = digest_for_source(source, message)
+    return params
+
+
+def fetch_export(source, url, message, params, headers, request_data, instrumentation=None):
+    """
+    Make a request to the pages or models export endpoint of the source site - a POST request if
+    there is any request data to send, or a GET request otherwise. The request's digest signs the
+    given message identifying the content to export, followed by the body of a POST request.
+    """
+    transport = get_transport(source, instrumentation)
+    if request_data:
+        headers = dict(headers)
+        request_body = json.dumps(request_data)
+        params = sign_export_params(source, '%s\n%s' % (message, request_body), params, instrumentation)
+        body = compress_request_body(source, request_body, headers)
+        return transport.post(url, params=params, data=body, headers=headers)
+    params = sign_export_params(source, message, params, instrumentation)
+    return transport.get(url, params=params, headers=headers)
+
+
+def update_import_checkpoint(checkpoint, response, source_timestamp, destination_fingerprint):
+    checkpoint.etag = response.headers.get('ETag', '')
+    checkpoint.destination_fingerprint = destination_fingerprint
+    if source_timestamp:
+        checkpoint.watermark = parse_datetime(source_timestamp)
+    checkpoint.save()
+
+
+def get_quarantine_message(quarantine_report):
+    """
+    Return a (level, message) pair reporting the objects that were quarantined by an import (see
+    WAGTAILTRANSFER_QUARANTINE_FAILURES)
+    """
+    descriptions = ', '.join(
+        '%s %s (%s)' % (item['model'], item['source_id'] or item['destination_id'], item['error'])
+        for item in quarantine_report[:10]
+    )
+    if len(quarantine_report) > 10:
+        descriptions += ', ...'
+    return (
+        messages.WARNING,
+        '%d object(s) could not be imported: %s' % (len(quarantine_report), descriptions)
+    )
+
+
+def run_page_import(source, source_page_ids, dest_page_ids, instrumentation, force=False):
+    """
+    Import the page subtrees under source_page_ids to the corresponding destination parent pages
+    in dest_page_ids (None to import at the top level). Returns a list of (level, message) pairs
+    describing the outcome, with levels as defined by django.contrib.messages. Timings and query
+    counts are recorded on the given Instrumentation object. If force is true, the pages are
+    imported in full even if they are unchanged since the last import.
+    """
+    base_url = settings.WAGTAILTRANSFER_SOURCES[source]['BASE_URL']
+    result_messages = []
+
+    if len(source_page_ids) == 1:
+        message = str(source_page_ids[0])
+        url = f"{base_url}api/pages/{source_page_ids[0]}/"
+        params = {}
+    else:
+        message = ','.join(source_page_ids)
+        url = f"{base_url}api/pages/"
+        params = {'ids': message}
+
+    checkpoint = get_import_checkpoint(
+        source, 'wagtailcore.page:%s' % message,
+        ','.join(dest_page_id or '' for dest_page_id in dest_page_ids)
+    )
+    conditional_checkpoint = get_conditional_checkpoint(
+        checkpoint, get_page_destination_fingerprint(dest_page_ids), force
+    )
+
+    with instrumentation.phase('fetching'):
+        known_uids_data = get_known_uids_data(source, [Page])
+        response = fetch_export(
+            source, url, message,
+            params={**params, **get_export_params(source, checkpoint=conditional_checkpoint)},
+            headers=get_export_headers(source, conditional_checkpoint),
+            request_data=known_uids_data, instrumentation=instrumentation
+        )
+        instrumentation.record_response(response)
+
+    if response.status_code == 304:
+        result_messages.append((messages.INFO, 'Pages are unchanged since the last import'))
+    else:
+        importer = ImportPlanner.for_pages(
+            list(zip(source_page_ids, dest_page_ids)), source_site=source,
+            context=ImportContext(source, instrumentation)
+        )
+        importer.add_json(response.content)
+        importer = import_missing_object_data(source, importer, known_uids_data)
+        # if any objects were quarantined, leave the checkpoint as it was, so that the next import
+        # does not skip them as unchanged
+        quarantine_report = importer.get_quarantine_report()
+        if quarantine_report:
+            result_messages.append(get_quarantine_message(quarantine_report))
+        else:
+            update_import_checkpoint(
+                checkpoint, response, importer.source_timestamp,
+                get_page_destination_fingerprint(dest_page_ids)
+            )
+
+        deleted_pages = list(importer.get_pages_deleted_at_source()[:11])
+        if deleted_pages:
+            titles = ', '.join(page.title for page in deleted_pages[:10])
+            if len(deleted_pages) > 10:
+                titles += ', ...'
+            result_messages.append((
+                messages.WARNING,
+                'Some previously imported pages no longer exist at the source, and have not been deleted: %s' % titles
+            ))
+
+    return result_messages
+
+
+def run_model_import(source, model, object_id, instrumentation, force=False):
+    """
+    Import all objects of a model, or a single object if object_id is given. A whole model is
+    requested from the source in pages of the source's CHUNK_SIZE, each of which is planned and
+    committed in turn. Returns a list of (level, message) pairs as for run_page_import, and
+    force is as for run_page_import.
+    """
+    base_url = settings.WAGTAILTRANSFER_SOURCES[source]['BASE_URL']
+    result_messages = []
+
+    url = f"{base_url}api/models/{model}/"
+    source_root = model
+    if object_id:
+        url = f"{url}{object_id}/"
+        source_root = f"{model}:{object_id}"
+        chunk_size = None
+    else:
+        chunk_size = settings.WAGTAILTRANSFER_SOURCES[source].get('CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+    checkpoint = get_import_checkpoint(source, source_root, '')
+    conditional_checkpoint = get_conditional_checkpoint(
+        checkpoint, get_model_destination_fingerprint(model), force
+    )
+    params = get_export_params(source, checkpoint=conditional_checkpoint)
+    if chunk_size:
+        params['limit'] = chunk_size
+
+    with instrumentation.phase('fetching'):
+        known_uids_data = get_known_uids_data(source, [get_model_for_path(model)])
+        response = fetch_export(
+            source, url, model, params=params,
+            headers=get_export_headers(source, conditional_checkpoint), request_data=known_uids_data,
+            instrumentation=instrumentation
+        )
+        instrumentation.record_response(response)
+    if response.status_code == 304:
+        result_messages.append((messages.INFO, 'Snippet(s) are unchanged since the last import'))
+    else:
+        # The ETag and timestamp of the first page apply to the import as a whole. Subsequent pages
+        # are planned and run separately, but share an ImportContext so that objects created by
+        # earlier pages are recognised
+        first_response = response
+        source_timestamp = None
+        quarantine_report = []
+        context = ImportContext(source, instrumentation)
+        while True:
+            importer = ImportPlanner.for_model(model=model, source_site=source, context=context)
+            importer.add_json(response.content)
+            importer = import_missing_object_data(source, importer, known_uids_data)
+            source_timestamp = source_timestamp or importer.source_timestamp
+            quarantine_report.extend(importer.get_quarantine_report())
+
+            if importer.next_cursor is None:
+                break
+            with instrumentation.phase('fetching'):
+                response = fetch_export(
+                    source, url, model, params={**params, 'after': importer.next_cursor},
+                    headers=get_export_headers(source), request_data=known_uids_data,
+                    instrumentation=instrumentation
+                )
+                instrumentation.record_response(response)
+
+        if quarantine_report:
+            result_messages.append(get_quarantine_message(quarantine_report))
+        else:
+            update_import_checkpoint(
+                checkpoint, first_response, source_timestamp, get_model_destination_fingerprint(model)
+            )
+            result_messages.append((messages.SUCCESS, 'Snippet(s) successfully imported'))
+
+    return result_messages
+
+
+def run_import(import_type, source, parameters, instrumentation=None):
+    """
+    Run an import as returned by views.get_import_parameters, returning a list of (level, message)
+    pairs. Timings and query counts are recorded on instrumentation (a new Instrumentation object if
+    not given), which is finished when the import completes or fails. If the parameters include
+    'profile', the import is profiled (see WAGTAILTRANSFER_PROFILING), and if
+    WAGTAILTRANSFER_RECORDING is set, the responses it receives are recorded. If they include
+    'force', the content is imported in full even if it is unchanged since the last import.
+    """
+    if instrumentation is None:
+        instrumentation = Instrumentation('import', source_site=source)
+    instrumentation.info.update(import_type=import_type, parameters=parameters)
+    instrumentation.profiling = bool(parameters.get('profile')) and is_profiling_enabled()
+    if is_recording_enabled():
+        instrumentation.recorder = Recorder.for_import(
+            instrumentation.run_id, source, import_type, parameters
+        )
+
+    try:
+        with profile('import', instrumentation.run_id) if instrumentation.profiling else nullcontext():
+            if import_type == 'page':
+                result_messages = run_page_import(
+                    source, parameters['source_page_ids'], parameters['dest_page_ids'], instrumentation,
+                    force=bool(parameters.get('force'))
+                )
+            else:
+                result_messages = run_model_import(
+                    source, parameters['model'], parameters['object_id'], instrumentation,
+                    force=bool(parameters.get('force'))
+                )
+    except Exception:
+        instrumentation.finish(status='failed')
+        raise
+
+    instrumentation.finish(status='completed')
+    return result_messages
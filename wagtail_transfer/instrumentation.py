@@ -0,0 +1,216 @@
+"""
+Timing and query counting for imports and exports. An Instrumentation object accumulates the
+time spent and the number of database queries run in each phase of an import or export, and in
+each type of import operation; when the import or export finishes, a summary of these is logged
+at INFO level and sent with the transfer_import_finished / transfer_export_finished signals.
+"""
+import logging
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+from django.utils import timezone
+
+from .signals import transfer_export_finished, transfer_import_finished, transfer_phase_finished
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCounter:
+    """
+    A database execute wrapper (see connection.execute_wrapper) that counts the queries run
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries():
+    """
+    Count the queries run on all database connections within the block, returning a QueryCounter
+    """
+    counter = QueryCounter()
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(counter))
+        yield counter
+
+
+class Instrumentation:
+    """
+    Collects timings and query counts for an import ('import' kind) or export ('export' kind).
+    Phases may be nested - for example, the 'lookups' phase of an import happens within its
+    'planning' phase - in which case the outer phase's figures include those of the inner one.
+
+    Any keyword arguments (such as source_site) are included in the summary. on_phase_started, if
+    given, is called with the name of each top-level phase as it begins, and on_operation_started
+    with each import operation as it begins, so that progress can be reported within long phases.
+    run_id identifies the import or export in logs and profiles (see profiling.py); a random one is
+    generated if not given.
+    """
+    def __init__(self, kind, on_phase_started=None, run_id=None, on_operation_started=None, **info):
+        self.kind = kind
+        self.run_id = run_id or uuid.uuid4().hex
+        self.info = info
+        self.on_phase_started = on_phase_started
+        self.on_operation_started = on_operation_started
+
+        # whether the run is being profiled; for an import, this is passed on to the source site
+        # so that the corresponding exports are profiled too
+        self.profiling = False
+
+        # number of export requests made by a profiled import, used to give each of the
+        # corresponding export profiles its own run ID
+        self.profiled_exports = 0
+
+        # the Recorder saving the responses received by an import, if it is being recorded (see
+        # recording.py)
+        self.recorder = None
+
+        # timings of phases and operation types, as dicts mapping names to dicts of
+        # 'count', 'duration' (in seconds) and 'queries'
+        self.phases = {}
+        self.operations = {}
+
+        # number of queries run within top-level phases
+        self.queries = 0
+
+        # numbers of objects handled by an import, as a dict mapping model labels to dicts of
+        # action ('create', 'update', 'delete', 'unchanged', 'failed' or 'quarantined') to count
+        self.objects = {}
+
+        # number of HTTP requests made (or, for an export, served) and the bytes transferred by
+        # them, including any files imported; round_trips counts the requests to the source's
+        # export API alone, excluding file downloads
+        self.requests = 0
+        self.round_trips = 0
+        self.bytes = 0
+        self.files = 0
+
+        self.started_at = timezone.now()
+        self._started = time.monotonic()
+        self.finished = False
+        self.summary = None
+        self._depth = 0
+
+    def _record(self, stats, name, duration, queries):
+        entry = stats.setdefault(name, {'count': 0, 'duration': 0.0, 'queries': 0})
+        entry['count'] += 1
+        entry['duration'] += duration
+        entry['queries'] += queries
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time the enclosed block as part of the given phase
+        """
+        if self._depth == 0 and self.on_phase_started:
+            self.on_phase_started(name)
+
+        self._depth += 1
+        started_at = time.monotonic()
+        try:
+            with count_queries() as counter:
+                yield
+        finally:
+            duration = time.monotonic() - started_at
+            self._depth -= 1
+            if self._depth == 0:
+                self.queries += counter.count
+            self._record(self.phases, name, duration, counter.count)
+            transfer_phase_finished.send(
+                sender=self.__class__, instrumentation=self, kind=self.kind, phase=name,
+                duration=duration, queries=counter.count
+            )
+
+    @contextmanager
+    def operation(self, operation):
+        """
+        Time the enclosed block as the running of the given import operation
+        """
+        if self.on_operation_started:
+            self.on_operation_started(operation)
+
+        started_at = time.monotonic()
+        try:
+            with count_queries() as counter:
+                yield
+        finally:
+            self._record(
+                self.operations, type(operation).__name__, time.monotonic() - started_at,
+                counter.count
+            )
+
+    def record_objects(self, model_label, action, count=1):
+        counts = self.objects.setdefault(model_label, {})
+        counts[action] = counts.get(action, 0) + count
+
+    def record_response(self, response):
+        self.requests += 1
+        self.round_trips += 1
+        self.bytes += len(response.content)
+
+    def record_file(self, imported_file):
+        self.requests += 1
+        self.files += 1
+        self.bytes += imported_file.size
+
+    def get_phase_durations(self):
+        return {name: entry['duration'] for name, entry in self.phases.items()}
+
+    def get_summary(self):
+        return {
+            'kind': self.kind,
+            'run_id': self.run_id,
+            **self.info,
+            'started_at': self.started_at,
+            'duration': time.monotonic() - self._started,
+            'queries': self.queries,
+            'phases': {name: dict(entry) for name, entry in self.phases.items()},
+            'operations': {name: dict(entry) for name, entry in self.operations.items()},
+            'objects': {label: dict(counts) for label, counts in self.objects.items()},
+            'requests': self.requests,
+            'round_trips': self.round_trips,
+            'bytes': self.bytes,
+            'files': self.files,
+        }
+
+    def finish(self, **info):
+        """
+        Mark the import or export as finished, adding any keyword arguments to its summary. The
+        summary is logged and sent with the transfer_import_finished or transfer_export_finished
+        signal, and returned; if it has already finished, the same summary is returned.
+        """
+        if self.finished:
+            return self.summary
+        self.info.update(info)
+        self.summary = summary = self.get_summary()
+        self.finished = True
+
+        logger.info(
+            "%s (%s) finished in %.3fs with %d queries, %d requests and %d bytes transferred. "
+            "Phases: %s. Operations: %s",
+            self.kind.capitalize(),
+            ', '.join('%s=%s' % (key, value) for key, value in self.info.items()),
+            summary['duration'], summary['queries'], summary['requests'], summary['bytes'],
+            format_timings(summary['phases']) or 'none',
+            format_timings(summary['operations']) or 'none',
+            extra={'transfer_summary': summary},
+        )
+
+        signal = transfer_import_finished if self.kind == 'import' else transfer_export_finished
+        signal.send(sender=self.__class__, instrumentation=self, summary=summary)
+        return summary
+
+
+def format_timings(timings):
+    return ', '.join(
+        '%s %.3fs/%d queries (x%d)' % (name, entry['duration'], entry['queries'], entry['count'])
+        for name, entry in timings.items()
+    )
@@ -0,0 +1,219 @@
+"""
+Background execution of imports. When WAGTAILTRANSFER_IMPORT_RUNNER is set, imports requested
+through the admin are recorded as ImportJob rows and handed to the runner, rather than being run
+within the request. DatabaseImportRunner leaves the jobs to be picked up by the
+run_transfer_worker management command; other runners (for example, using Celery or RQ) can be
+implemented by subclassing BaseImportRunner and calling process_import_job from a task.
+
+A running job holds a lease on its destination, renewed by a heartbeat as each phase of the import
+begins, and within a phase as its operations run, once a quarter of the timeout has passed since the
+last heartbeat. If a job's worker dies, the lease expires after WAGTAILTRANSFER_IMPORT_JOB_TIMEOUT
+seconds, and the job is marked as failed the next time a job is claimed, so that it no longer blocks
+other jobs for the same destination.
+"""
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .imports import run_import
+from .instrumentation import Instrumentation
+from .models import ImportJob
+
+
+# number of seconds that a running job may go without a heartbeat before it is assumed to have
+# been abandoned, unless overridden by the WAGTAILTRANSFER_IMPORT_JOB_TIMEOUT setting
+DEFAULT_JOB_TIMEOUT = 3600
+
+
+class LeaseExpired(Exception):
+    """
+    Raised within a job that has been marked as failed for missing its heartbeat, to stop it
+    """
+    pass
+
+
+class BaseImportRunner:
+    def enqueue(self, job):
+        """
+        Arrange for the given ImportJob to be processed, by calling process_import_job with its ID
+        """
+        raise NotImplementedError
+
+
+class DatabaseImportRunner(BaseImportRunner):
+    """
+    Leave jobs in the database, to be processed by the run_transfer_worker management command
+    """
+    def enqueue(self, job):
+        pass
+
+
+def get_import_runner():
+    """
+    Return an instance of the runner class named by the WAGTAILTRANSFER_IMPORT_RUNNER setting, or
+    None if imports are to be run within the request
+    """
+    runner_path = getattr(settings, 'WAGTAILTRANSFER_IMPORT_RUNNER', None)
+    if runner_path is None:
+        return None
+    return import_string(runner_path)()
+
+
+def get_destination_root(import_type, parameters):
+    if import_type == 'page':
+        return 'wagtailcore.page:%s' % ','.join(
+            dest_page_id or '' for dest_page_id in parameters['dest_page_ids']
+        )
+    elif parameters.get('object_id'):
+        return '%s:%s' % (parameters['model'], parameters['object_id'])
+    else:
+        return parameters['model']
+
+
+def create_import_job(import_type, source, parameters, user=None):
+    return ImportJob.objects.create(
+        import_type=import_type,
+        source_site=source,
+        parameters=parameters,
+        destination_root=get_destination_root(import_type, parameters),
+        requested_by=user if user is not None and user.is_authenticated else None,
+    )
+
+
+def get_job_timeout():
+    return getattr(settings, 'WAGTAILTRANSFER_IMPORT_JOB_TIMEOUT', DEFAULT_JOB_TIMEOUT)
+
+
+def fail_expired_import_jobs():
+    """
+    Mark running jobs whose lease has expired (because they have not had a heartbeat for
+    WAGTAILTRANSFER_IMPORT_JOB_TIMEOUT seconds) as failed, returning the number of jobs marked
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # a job's row stays locked from its first heartbeat within a transaction of the import
+        # until that transaction ends, with the heartbeat only becoming visible then; the worker
+        # of a locked job is still alive, so it is skipped rather than waited for
+        expired_job_ids = list(ImportJob.objects.select_for_update(
+            skip_locked=connection.features.has_select_for_update_skip_locked
+        ).filter(
+            status=ImportJob.STATUS_RUNNING, heartbeat_at__lt=now - timedelta(seconds=get_job_timeout())
+        ).values_list('pk', flat=True))
+        return ImportJob.objects.filter(pk__in=expired_job_ids).update(
+            status=ImportJob.STATUS_FAILED, phase='', finished_at=now,
+            error="The job's worker stopped responding."
+        )
+
+
+def claim_import_job(job, worker=''):
+    """
+    Mark the given queued job as running, returning False if it has already been claimed by
+    another worker or if another job for the same destination is running
+    """
+    started_at = timezone.now()
+    try:
+        with transaction.atomic():
+            # lock the destination's queued and running jobs, so that workers claiming jobs for the
+            # same destination at once do so one at a time. The database constraint allowing only
+            # one running job per destination root backs this up, on databases that support
+            # partial unique constraints (MySQL does not)
+            destination_jobs = dict(ImportJob.objects.select_for_update().filter(
+                destination_root=job.destination_root,
+                status__in=[ImportJob.STATUS_QUEUED, ImportJob.STATUS_RUNNING]
+            ).order_by('pk').values_list('pk', 'status'))
+            if destination_jobs.get(job.pk) != ImportJob.STATUS_QUEUED:
+                return False
+            if ImportJob.STATUS_RUNNING in destination_jobs.values():
+                return False
+
+            ImportJob.objects.filter(pk=job.pk).update(
+                status=ImportJob.STATUS_RUNNING, started_at=started_at, heartbeat_at=started_at,
+                worker=worker
+            )
+    except IntegrityError:
+        return False
+
+    job.status = ImportJob.STATUS_RUNNING
+    job.started_at = job.heartbeat_at = started_at
+    job.worker = worker
+    return True
+
+
+def claim_next_import_job(worker=''):
+    """
+    Claim the oldest queued job that can be run now, returning None if there is none. Jobs whose
+    lease has expired are marked as failed first, releasing their destinations.
+    """
+    fail_expired_import_jobs()
+    for job in ImportJob.objects.filter(status=ImportJob.STATUS_QUEUED).order_by('created_at', 'pk'):
+        if claim_import_job(job, worker):
+            return job
+
+
+def run_import_job(job):
+    """
+    Run a job that has been claimed by claim_import_job, recording its progress and outcome
+    """
+    heartbeat_interval = timedelta(seconds=get_job_timeout() / 4)
+
+    def renew_lease(**fields):
+        # renew the job's lease, unless it has already expired
+        job.heartbeat_at = timezone.now()
+        renewed = ImportJob.objects.filter(pk=job.pk, status=ImportJob.STATUS_RUNNING).update(
+            heartbeat_at=job.heartbeat_at, **fields
+        )
+        if not renewed:
+            raise LeaseExpired("Import job %d is no longer running" % job.pk)
+
+    def on_phase_started(phase):
+        job.phase = phase
+        job.phase_timings = instrumentation.get_phase_durations()
+        renew_lease(phase=job.phase, phase_timings=job.phase_timings)
+
+    def on_operation_started(operation):
+        # a single phase may run for longer than the timeout, so the lease is also renewed
+        # periodically as its operations run
+        if timezone.now() - job.heartbeat_at >= heartbeat_interval:
+            renew_lease()
+
+    instrumentation = Instrumentation(
+        'import', on_phase_started=on_phase_started, on_operation_started=on_operation_started,
+        source_site=job.source_site, job=job.pk
+    )
+
+    try:
+        job.messages = run_import(job.import_type, job.source_site, job.parameters, instrumentation)
+    except Exception:
+        job.status = ImportJob.STATUS_FAILED
+        job.error = traceback.format_exc()
+    else:
+        job.status = ImportJob.STATUS_COMPLETED
+
+    job.phase = ''
+    job.phase_timings = instrumentation.get_phase_durations()
+    job.finished_at = timezone.now()
+    finished = ImportJob.objects.filter(pk=job.pk, status=ImportJob.STATUS_RUNNING).update(
+        status=job.status, phase=job.phase, phase_timings=job.phase_timings, messages=job.messages,
+        error=job.error, finished_at=job.finished_at
+    )
+    if not finished:
+        # the lease expired, and the job has been marked as failed in the meantime
+        job.refresh_from_db()
+    return job
+
+
+def process_import_job(job_id, worker=''):
+    """
+    Claim and run the ImportJob with the given ID. Returns False if the job could not be claimed,
+    in which case it should be retried later unless it has already finished.
+    """
+    fail_expired_import_jobs()
+    job = ImportJob.objects.get(pk=job_id)
+    if not claim_import_job(job, worker):
+        return False
+    run_import_job(job)
+    return True
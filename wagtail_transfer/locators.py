@@ -12,13 +12,21 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ImproperlyConfigured
 from django.db import IntegrityError
 
-from .models import IDMapping, get_base_model, normalize_model_label
+from .models import (IDMapping, get_base_model, get_read_database,
+                     get_write_database, normalize_model_label)
 
 
 logger = logging.getLogger(__name__)
 
 UUID_SEQUENCE = 0
 
+# Maximum number of IDs to look up in a single IDMapping query
+LOOKUP_BATCH_SIZE = 500
+
+# Namespace UUID common to all wagtail-transfer installances, used with uuid5 to generate
+# a predictable UUID for any given model-name / PK combination
+NAMESPACE = uuid.UUID('418b5168-5a10-11ea-a84b-7831c1c42e66')
+
 # dict of models that should be located by field values using FieldLocator,
 # rather than by UUID mapping
 LOOKUP_FIELDS = {
@@ -30,6 +38,14 @@ for model_label, fields in getattr(settings, 'WAGTAILTRANSFER_LOOKUP_FIELDS', {}
     LOOKUP_FIELDS[normalize_model_label(model_label)] = fields
 
 
+def get_deterministic_uid(model, id):
+    """
+    Return the predictable UID for the given model and ID, as assigned by the
+    preseed_transfer_table command
+    """
+    return uuid.uuid5(NAMESPACE, "%s:%s" % (model._meta.label_lower, id))
+
+
 class IDMappingLocator:
     def __init__(self, model):
         if model._meta.parents:
@@ -43,7 +59,7 @@ class IDMappingLocator:
         """Find object by UID; return None if not found"""
 
         try:
-            mapping = IDMapping.objects.get(uid=uid)
+            mapping = IDMapping.objects.using(get_read_database()).get(uid=uid)
         except IDMapping.DoesNotExist:
             logger.debug(f"IDMapping not found for {uid}")
             return None
@@ -55,30 +71,93 @@ class IDMappingLocator:
 
         return mapping.content_object
 
+    def find_local_ids(self, uids):
+        """
+        Return a dict mapping each of the given UIDs to the ID of the corresponding local object,
+        omitting any UIDs that do not correspond to an existing object
+        """
+        uids = [str(uid) for uid in uids]
+        local_ids_by_uid = {}
+        for i in range(0, len(uids), LOOKUP_BATCH_SIZE):
+            mappings = {}
+            for local_id, uid, content_type_id in IDMapping.objects.using(get_read_database()).filter(
+                uid__in=uids[i:i + LOOKUP_BATCH_SIZE]
+            ).values_list('local_id', 'uid', 'content_type'):
+                if content_type_id != self.content_type.pk:
+                    # as in find
+                    raise IntegrityError(
+                        "Content type mismatch! Expected %r, got %r"
+                        % (self.content_type, ContentType.objects.get_for_id(content_type_id))
+                    )
+                mappings[local_id] = uid
+            # skip mappings left over from objects that have since been deleted
+            existing_ids = self.model.objects.using(get_read_database()).filter(
+                pk__in=list(mappings)
+            ).values_list('pk', flat=True)
+            for pk in existing_ids:
+                local_ids_by_uid[str(mappings[str(pk)])] = pk
+
+        return local_ids_by_uid
+
     def get_uid_for_local_id(self, id, create=True):
+        return self.get_uids_for_local_ids([id], create=create)[id]
+
+    def get_uids_for_local_ids(self, ids, create=True, using=None):
+        """
+        Return a dict mapping each of the given IDs to its UID. Existing mappings are read from the
+        database alias given by using, or the read database by default.
+
+        If create is true, IDs that do not have a UID yet will be assigned one - or, if the
+        WAGTAILTRANSFER_READ_ONLY_EXPORT setting is enabled, given the deterministic UID that
+        preseed_transfer_table would assign them, without writing anything to the database.
+        If create is false, these IDs are mapped to None.
+        """
         global UUID_SEQUENCE
 
-        if create:
-            """Get UID for the instance with the given ID (assigning one if one doesn't exist already)"""
-            id_mapping, created = IDMapping.objects.get_or_create(
-                content_type=self.content_type,
-                local_id=id,
-                defaults={'uid': uuid.uuid1(clock_seq=UUID_SEQUENCE)}
+        # look up existing mappings in batches, to stay within database limits on query parameters
+        local_ids = list({str(id) for id in ids})
+        uids_by_local_id = {}
+        for i in range(0, len(local_ids), LOOKUP_BATCH_SIZE):
+            uids_by_local_id.update(
+                IDMapping.objects.using(using or get_read_database()).filter(
+                    content_type=self.content_type, local_id__in=local_ids[i:i + LOOKUP_BATCH_SIZE]
+                ).values_list('local_id', 'uid')
             )
-            UUID_SEQUENCE += 1
-
-            return id_mapping.uid
-        else:
-            """Get UID for the instance with the given ID (returning None if one doesn't exist)"""
-            try:
-                id_mapping = IDMapping.objects.get(
-                    content_type=self.content_type,
-                    local_id=id
+
+        if create and not getattr(settings, 'WAGTAILTRANSFER_READ_ONLY_EXPORT', False):
+            # create mappings for all unmapped IDs in bulk, rather than one query per ID. Conflicts
+            # are ignored, in case another process has mapped the same IDs in the meantime - so
+            # the mappings are then read back from the write database to find the winning UIDs
+            unmapped_ids = [id for id in local_ids if id not in uids_by_local_id]
+            for i in range(0, len(unmapped_ids), LOOKUP_BATCH_SIZE):
+                batch = unmapped_ids[i:i + LOOKUP_BATCH_SIZE]
+                new_mappings = []
+                for id in batch:
+                    new_mappings.append(IDMapping(
+                        content_type=self.content_type, local_id=id,
+                        uid=uuid.uuid1(clock_seq=UUID_SEQUENCE)
+                    ))
+                    UUID_SEQUENCE += 1
+                IDMapping.objects.using(get_write_database()).bulk_create(new_mappings, ignore_conflicts=True)
+                uids_by_local_id.update(
+                    IDMapping.objects.using(get_write_database()).filter(
+                        content_type=self.content_type, local_id__in=batch
+                    ).values_list('local_id', 'uid')
                 )
-                return id_mapping.uid
-            except IDMapping.DoesNotExist:
+
+        uids = {}
+        for id in ids:
+            uid = uids_by_local_id.get(str(id))
+            if uid is not None:
+                uids[id] = uid
+            elif not create:
                 logger.debug(f"IDMapping for local_id not found for {id}")
-                return None
+                uids[id] = None
+            else:
+                # WAGTAILTRANSFER_READ_ONLY_EXPORT is enabled
+                uids[id] = get_deterministic_uid(self.model, id)
+
+        return uids
 
     def attach_uid(self, instance, uid):
         """
@@ -92,7 +171,7 @@ class IDMappingLocator:
 
         # use update_or_create to account for the possibility of an existing IDMapping for the same
         # UID, left over from the object being previously imported and then deleted
-        IDMapping.objects.update_or_create(
+        IDMapping.objects.using(get_write_database()).update_or_create(
             uid=uid, defaults={'content_type': self.content_type, 'local_id': instance.pk}
         )
 
@@ -116,7 +195,19 @@ class FieldLocator:
 
     def get_uid_for_local_id(self, id, **kwargs):
         # For field-based lookups, the UID is a tuple of field values
-        return self.model.objects.values_list(*self.fields).get(pk=id)
+        return self.model.objects.using(get_read_database()).values_list(*self.fields).get(pk=id)
+
+    def get_uids_for_local_ids(self, ids, **kwargs):
+        uids_by_local_id = {
+            str(pk): tuple(values)
+            for pk, *values in self.model.objects.using(get_read_database()).filter(pk__in=ids).values_list('pk', *self.fields)
+        }
+        try:
+            return {id: uids_by_local_id[str(id)] for id in ids}
+        except KeyError:
+            raise self.model.DoesNotExist(
+                "%s matching query does not exist." % self.model._meta.object_name
+            )
 
     def attach_uid(self, instance, uid):
         # UID is derived directly from the object data, so nothing needs to be done to associate
@@ -135,11 +226,19 @@ class FieldLocator:
         filters = dict(zip(self.fields, uid))
 
         try:
-            return self.model.objects.get(**filters)
+            return self.model.objects.using(get_read_database()).get(**filters)
         except self.model.DoesNotExist:
             logger.debug(f"Couldn't find {self.model} using {filters}, returning None")
             return None
 
+    def find_local_ids(self, uids):
+        local_ids_by_uid = {}
+        for uid in uids:
+            instance = self.find(uid)
+            if instance is not None:
+                local_ids_by_uid[uid] = instance.pk
+        return local_ids_by_uid
+
 
 @lru_cache(maxsize=None)
 def get_locator_for_model(model):
@@ -1,16 +1,106 @@
-import uuid
+import multiprocessing
+import queue
+import time
 
 from django.apps import apps
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import CharField, Exists, IntegerField, Max, Min, OuterRef
+from django.db.models.functions import Cast
 
+from wagtail_transfer.locators import get_deterministic_uid
 from wagtail_transfer.models import (IDMapping, get_base_model,
-                                     get_model_for_path)
+                                     get_model_for_path, get_write_database)
 
-# Namespace UUID common to all wagtail-transfer installances, used with uuid5 to generate
-# a predictable UUID for any given model-name / PK combination
-NAMESPACE = uuid.UUID('418b5168-5a10-11ea-a84b-7831c1c42e66')
+
+DEFAULT_BATCH_SIZE = 1000
+
+# minimum number of seconds between progress reports
+PROGRESS_INTERVAL = 1
+
+
+def get_unmapped_queryset(model, content_type, min_pk=None, max_pk=None):
+    """
+    Return a queryset of the instances of model (with PKs between min_pk and max_pk inclusive, if
+    given) that have no IDMapping, ordered by PK
+    """
+    db = get_write_database()
+    # an anti-join against IDMapping, rather than excluding a list of all mapped IDs. local_id
+    # is a string, so the PK is cast to match; if the cast representation differs from the one
+    # stored (as for UUIDs on SQLite), mapped objects are merely visited again, and skipped when
+    # their mappings are created
+    mappings = IDMapping.objects.using(db).filter(
+        content_type=content_type, local_id=Cast(OuterRef('pk'), output_field=CharField())
+    )
+    queryset = model._default_manager.using(db).filter(~Exists(mappings)).order_by('pk')
+    if min_pk is not None:
+        queryset = queryset.filter(pk__gte=min_pk)
+    if max_pk is not None:
+        queryset = queryset.filter(pk__lte=max_pk)
+    return queryset
+
+
+def preseed_model(model, content_type, min_pk=None, max_pk=None, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Create IDMappings, with the UIDs given by get_deterministic_uid, for all unmapped instances of
+    model with PKs between min_pk and max_pk inclusive. The PKs are read in batches of batch_size,
+    each starting after the last PK of the previous batch, and the mappings for each batch are
+    created with a single query. If progress is given, it is called with the size of each batch
+    once its mappings are created. Returns the number of instances processed.
+    """
+    queryset = get_unmapped_queryset(model, content_type, min_pk=min_pk, max_pk=max_pk)
+    db = get_write_database()
+    count = 0
+    last_pk = None
+    while True:
+        batch_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        pks = list(batch_queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+
+        IDMapping.objects.using(db).bulk_create([
+            IDMapping(content_type=content_type, local_id=pk, uid=get_deterministic_uid(model, pk))
+            for pk in pks
+        ], ignore_conflicts=True)
+
+        count += len(pks)
+        last_pk = pks[-1]
+        if progress:
+            progress(len(pks))
+    return count
+
+
+def get_pk_ranges(min_pk, max_pk, count):
+    """
+    Split the range of integers from min_pk to max_pk inclusive into up to count contiguous
+    ranges of (almost) equal size, returned as a list of (min, max) tuples
+    """
+    size = max_pk - min_pk + 1
+    count = max(1, min(count, size))
+    bounds = [min_pk + size * i // count for i in range(count + 1)]
+    return [(bounds[i], bounds[i + 1] - 1) for i in range(count)]
+
+
+def run_worker(index, model_label, min_pk, max_pk, batch_size, messages):
+    """
+    Entry point of a worker process started by the command with --workers, preseeding one range
+    of PKs and reporting progress to the parent process through the messages queue
+    """
+    try:
+        model = apps.get_model(model_label)
+        content_type = ContentType.objects.db_manager(get_write_database()).get_for_model(model)
+        preseed_model(
+            model, content_type, min_pk=min_pk, max_pk=max_pk, batch_size=batch_size,
+            progress=lambda count: messages.put(('progress', index, count))
+        )
+    except Exception as e:
+        messages.put(('error', index, "%s: %s" % (type(e).__name__, e)))
+    else:
+        messages.put(('done', index, None))
+    finally:
+        connections.close_all()
 
 
 class Command(BaseCommand):
@@ -19,10 +109,12 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('labels', metavar='model_or_app', nargs='+', help="Model (as app_label.model_name) or app name to populate table entries for, e.g. wagtailcore.Page or wagtailcore")
         parser.add_argument('--range', help="Range of IDs to create mappings for (e.g. 1-1000)")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Number of mappings to create per query (default %d)" % DEFAULT_BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=1, help="Number of processes to split each model's range of IDs between (default 1). Only models with integer IDs are split")
 
-    def handle(self, *args, **options):
+    def get_models(self, labels):
         models = []
-        for label in options['labels']:
+        for label in labels:
             label = label.lower()
             if '.' in label:
                 # interpret as a model
@@ -47,35 +139,120 @@ class Command(BaseCommand):
                 for model in app.get_models():
                     if model == get_base_model(model):
                         models.append(model)
+        return models
 
-        created_count = 0
+    def report_progress(self, model, done, total, force=False):
+        if self.verbosity < 1:
+            return
+        now = time.monotonic()
+        if force or now - self.last_progress_time >= PROGRESS_INTERVAL:
+            self.stdout.write("%s: %d/%d objects processed" % (model._meta.label_lower, done, total))
+            self.last_progress_time = now
+
+    def preseed_in_workers(self, model, min_pk, max_pk, progress):
+        """
+        Preseed the given model, splitting its range of PKs between the number of processes given
+        by --workers
+        """
+        queryset = model._default_manager.using(get_write_database())
+        if min_pk is not None:
+            queryset = queryset.filter(pk__gte=min_pk)
+        if max_pk is not None:
+            queryset = queryset.filter(pk__lte=max_pk)
+        bounds = queryset.aggregate(min_pk=Min('pk'), max_pk=Max('pk'))
+        if bounds['min_pk'] is None:
+            return
 
-        for model in models:
-            model_name = "%s.%s" % (model._meta.app_label, model._meta.model_name)
+        # the worker processes are forked, so that they inherit the project's configuration, and
+        # must open database connections of their own
+        context = multiprocessing.get_context('fork')
+        messages = context.Queue()
+        connections.close_all()
+        processes = [
+            context.Process(
+                target=run_worker,
+                args=(i, model._meta.label_lower, range_min, range_max, self.batch_size, messages)
+            )
+            for i, (range_min, range_max) in enumerate(
+                get_pk_ranges(bounds['min_pk'], bounds['max_pk'], self.workers)
+            )
+        ]
+        for process in processes:
+            process.start()
 
-            content_type = ContentType.objects.get_for_model(model)
-            # find IDs of instances of this model that already exist in the IDMapping table
-            mapped_ids = IDMapping.objects.filter(content_type=content_type).values_list('local_id', flat=True)
+        errors = []
+        running = set(range(len(processes)))
+        while running:
+            try:
+                message, index, value = messages.get(timeout=PROGRESS_INTERVAL)
+            except queue.Empty:
+                # check for workers that were killed before they could report back
+                for index in list(running):
+                    exitcode = processes[index].exitcode
+                    if exitcode is not None and exitcode != 0:
+                        running.discard(index)
+                        errors.append("worker exited with code %d" % exitcode)
+                continue
 
-            # these will be returned as strings, so convert to the pk field's native type
-            mapped_ids = [model._meta.pk.to_python(id) for id in mapped_ids]
+            if message == 'progress':
+                progress(value)
+            else:
+                running.discard(index)
+                if message == 'error':
+                    errors.append(value)
+        for process in processes:
+            process.join()
 
-            # find IDs of instances not in this set
-            unmapped_ids = model.objects.exclude(pk__in=mapped_ids).values_list('pk', flat=True)
+        if errors:
+            raise CommandError("Preseeding %s failed: %s" % (model._meta.label_lower, '; '.join(errors)))
 
-            # apply ID range filter if passed
-            if options['range']:
-                min_id, max_id = options['range'].split('-')
-                unmapped_ids = unmapped_ids.filter(pk__gte=min_id, pk__lte=max_id)
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        self.batch_size = options['batch_size']
+        self.workers = options['workers']
+        if self.batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        if self.workers < 1:
+            raise CommandError("--workers must be at least 1.")
+        if self.workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            raise CommandError("--workers is not supported on this platform.")
+
+        min_pk = max_pk = None
+        if options['range']:
+            min_pk, max_pk = options['range'].split('-')
+
+        db = get_write_database()
+        created_count = 0
 
-            # create ID mapping for each of these
-            for pk in unmapped_ids:
-                _, created = IDMapping.objects.get_or_create(
-                    content_type=content_type, local_id=pk,
-                    defaults={'uid': uuid.uuid5(NAMESPACE, "%s:%s" % (model_name, pk))}
+        for model in self.get_models(options['labels']):
+            content_type = ContentType.objects.db_manager(db).get_for_model(model)
+            mappings = IDMapping.objects.using(db).filter(content_type=content_type)
+            initial_count = mappings.count()
+
+            total = get_unmapped_queryset(model, content_type, min_pk=min_pk, max_pk=max_pk).count()
+            done = 0
+
+            def progress(count):
+                nonlocal done
+                done += count
+                self.report_progress(model, done, total)
+
+            self.last_progress_time = time.monotonic()
+            if self.workers > 1 and isinstance(model._meta.pk, IntegerField):
+                self.preseed_in_workers(
+                    model,
+                    None if min_pk is None else int(min_pk), None if max_pk is None else int(max_pk),
+                    progress
                 )
-                if created:
-                    created_count += 1
+            else:
+                preseed_model(
+                    model, content_type, min_pk=min_pk, max_pk=max_pk, batch_size=self.batch_size,
+                    progress=progress
+                )
+            if total:
+                self.report_progress(model, done, total, force=True)
+
+            created_count += mappings.count() - initial_count
 
-        if options['verbosity'] >= 1:
+        if self.verbosity >= 1:
             self.stdout.write("%d ID mappings created." % created_count)
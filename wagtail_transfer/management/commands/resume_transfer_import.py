@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from wagtail_transfer.models import ImportRun, get_write_database
+from wagtail_transfer.operations import resume_import_run
+
+
+class Command(BaseCommand):
+    help = "Resume imports that were committed in chunks and did not complete"
+
+    def add_arguments(self, parser):
+        parser.add_argument('run_ids', metavar='run_id', type=int, nargs='*', help="ID of the import run to resume. If omitted, all failed import runs are resumed")
+
+    def handle(self, *args, **options):
+        import_runs = ImportRun.objects.using(get_write_database()).exclude(
+            status=ImportRun.STATUS_COMPLETED
+        ).order_by('pk')
+        if options['run_ids']:
+            import_runs = import_runs.filter(pk__in=options['run_ids'])
+        else:
+            # runs with a status of 'running' may still be in progress in another process, so only
+            # resume these if asked to explicitly
+            import_runs = import_runs.filter(status=ImportRun.STATUS_FAILED)
+
+        failed_runs = []
+        for import_run in import_runs:
+            try:
+                resume_import_run(import_run)
+            except Exception as e:
+                failed_runs.append(import_run.pk)
+                self.stderr.write("Import run %d failed: %s" % (import_run.pk, e))
+            else:
+                if options['verbosity'] >= 1:
+                    self.stdout.write("Import run %d completed." % import_run.pk)
+
+        if failed_runs:
+            raise CommandError("%d import run(s) failed." % len(failed_runs))
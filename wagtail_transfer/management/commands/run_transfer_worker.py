@@ -0,0 +1,36 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+
+from wagtail_transfer.jobs import claim_next_import_job, run_import_job
+from wagtail_transfer.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = "Process queued imports (see WAGTAILTRANSFER_IMPORT_RUNNER)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit once there are no more jobs that can be run, rather than waiting for new ones")
+        parser.add_argument('--poll-interval', type=float, default=5, help="Number of seconds to wait between checks for new jobs (default 5)")
+
+    def handle(self, *args, **options):
+        worker = '%s:%d' % (socket.gethostname(), os.getpid())
+
+        while True:
+            job = claim_next_import_job(worker)
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            if options['verbosity'] >= 1:
+                self.stdout.write("Running import job %d..." % job.pk)
+            run_import_job(job)
+            if options['verbosity'] >= 1:
+                if job.status == ImportJob.STATUS_FAILED:
+                    self.stdout.write("Import job %d failed." % job.pk)
+                else:
+                    self.stdout.write("Import job %d completed." % job.pk)
@@ -0,0 +1,107 @@
+import json
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import (override_settings, setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+from wagtail.models import Page, Site
+
+from wagtail_transfer.imports import run_import
+from wagtail_transfer.instrumentation import Instrumentation, format_timings
+from wagtail_transfer.recording import ReplayError, load_bundle
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay an import recorded with WAGTAILTRANSFER_RECORDING against a fresh test database, "
+        "reporting its timings"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('bundle', help="Directory of the recorded import")
+        parser.add_argument('--dest-page-id', type=int, help="ID of the page to import pages under. Defaults to the root page of the default site")
+        parser.add_argument('--repeat', type=int, default=1, help="Number of times to run the import (default: 1)")
+        parser.add_argument('--output', help="File to write the import summaries to as JSON")
+
+    def get_parameters(self, bundle, dest_page_id):
+        parameters = dict(bundle.parameters)
+        if bundle.import_type == 'page':
+            if dest_page_id is None:
+                site = Site.objects.filter(is_default_site=True).first()
+                dest_page_id = site.root_page_id if site else Page.objects.get(depth=1).pk
+            parameters['dest_page_ids'] = [
+                str(dest_page_id) if original_id else None
+                for original_id in parameters['dest_page_ids']
+            ]
+        return parameters
+
+    def replay(self, bundle, dest_page_id):
+        instrumentation = Instrumentation('import', source_site=bundle.source, replay=bundle.directory)
+        try:
+            # leave the database as it was, so that each run starts from the same state
+            with transaction.atomic():
+                result_messages = run_import(
+                    bundle.import_type, bundle.source, self.get_parameters(bundle, dest_page_id),
+                    instrumentation
+                )
+                raise Rollback
+        except Rollback:
+            pass
+        for level, message in result_messages:
+            self.stderr.write(message)
+        return instrumentation.finish()
+
+    def handle(self, *args, **options):
+        try:
+            bundle = load_bundle(options['bundle'])
+        except ReplayError as e:
+            raise CommandError(e)
+
+        source_config = {
+            **bundle.manifest['source_options'],
+            # the recorded responses are replayed without checking the digests of requests, so the
+            # key only needs to be one that requests can be signed with; a site that is only ever
+            # the destination of imports has no WAGTAILTRANSFER_SECRET_KEY of its own
+            'SECRET_KEY': getattr(settings, 'WAGTAILTRANSFER_SECRET_KEY', ''),
+            'TRANSPORT': 'wagtail_transfer.recording.ReplayTransport',
+            'BUNDLE': bundle.directory,
+        }
+        media_root = tempfile.mkdtemp()
+
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            with override_settings(
+                MEDIA_ROOT=media_root,
+                WAGTAILTRANSFER_RECORDING=None,
+                WAGTAILTRANSFER_SOURCES={**settings.WAGTAILTRANSFER_SOURCES, bundle.source: source_config},
+            ):
+                summaries = []
+                for i in range(options['repeat']):
+                    summary = self.replay(bundle, options['dest_page_id'])
+                    summaries.append(summary)
+                    self.stdout.write(
+                        "Run %d: %.3fs, %d queries, %d objects. Phases: %s. Operations: %s" % (
+                            i + 1, summary['duration'], summary['queries'],
+                            sum(sum(counts.values()) for counts in summary['objects'].values()),
+                            format_timings(summary['phases']) or 'none',
+                            format_timings(summary['operations']) or 'none',
+                        )
+                    )
+        except ReplayError as e:
+            raise CommandError(e)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(summaries, f, indent=2, default=str)
@@ -0,0 +1,257 @@
+"""
+An optional registry of metrics on transfer throughput and latency, enabled by the
+WAGTAILTRANSFER_METRICS setting and exposed in the Prometheus text exposition format by the
+views.metrics view.
+
+Metrics are held in memory and are safe to update from multiple threads. If a DIRECTORY is
+configured, each process also writes its metrics to a file in that directory as they change (at
+most once every WRITE_INTERVAL seconds, so that frequent observations do not each rewrite the file),
+and the metrics view aggregates the files of all processes - so that the metrics of every worker
+of a multi-process server are reported, whichever one serves the request. Files left by processes
+that have exited continue to count towards the totals, as is usual for Prometheus counters.
+"""
+import atexit
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+
+# minimum number of seconds between writes of a process's metrics file
+WRITE_INTERVAL = 1
+
+
+def get_metrics_config():
+    return getattr(settings, 'WAGTAILTRANSFER_METRICS', None)
+
+
+def is_metrics_enabled():
+    return get_metrics_config() is not None
+
+
+class Histogram:
+    """
+    A histogram of observed values, optionally partitioned by a set of labels
+    """
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = list(buckets)
+        self.labelnames = tuple(labelnames)
+
+    def observe(self, value, **labels):
+        if not is_metrics_enabled():
+            return
+        registry.observe(self, value, tuple(str(labels.get(name, '')) for name in self.labelnames))
+
+    def get_empty_state(self):
+        # the number of observations in each bucket (not cumulative), the sum of observations and
+        # the number of observations
+        return [[0] * len(self.buckets), 0.0, 0]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        # the state of each metric in this process, as a dict mapping metric names to dicts
+        # mapping label value tuples to states as returned by Histogram.get_empty_state
+        self.values = {}
+        self.lock = threading.Lock()
+        # distinguishes this process's metrics file from those of earlier processes that had the
+        # same process ID
+        self.process_token = uuid.uuid4().hex[:8]
+
+        # whether there are observations not yet written to the metrics file, when it was last
+        # written (as returned by time.monotonic), and the timer for the next write, if one is
+        # scheduled. write_lock is held while writing, so that writes happen in order without
+        # holding up observations
+        self.dirty = False
+        self.last_write = -WRITE_INTERVAL
+        self.write_timer = None
+        self.write_lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        self.values[metric.name] = {}
+        return metric
+
+    def observe(self, metric, value, label_values):
+        with self.lock:
+            counts, total, count = self.values[metric.name].setdefault(
+                label_values, metric.get_empty_state()
+            )
+            for i, upper_bound in enumerate(metric.buckets):
+                if value <= upper_bound:
+                    counts[i] += 1
+                    break
+            self.values[metric.name][label_values] = [counts, total + value, count + 1]
+            self.dirty = True
+
+            if not get_metrics_config().get('DIRECTORY'):
+                return
+            # write the file now if it has not been written within WRITE_INTERVAL, or otherwise
+            # once that interval has passed (unless a write is already scheduled)
+            delay = self.last_write + WRITE_INTERVAL - time.monotonic()
+            if delay > 0:
+                if self.write_timer is None:
+                    self.write_timer = threading.Timer(delay, self.flush)
+                    self.write_timer.daemon = True
+                    self.write_timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        """
+        Write any observations not yet written to this process's metrics file, if a DIRECTORY is
+        configured
+        """
+        with self.write_lock:
+            with self.lock:
+                if self.write_timer is not None:
+                    self.write_timer.cancel()
+                    self.write_timer = None
+                if not self.dirty:
+                    return
+                directory = (get_metrics_config() or {}).get('DIRECTORY')
+                if not directory:
+                    return
+                data = json.dumps(self._get_json_state())
+                self.dirty = False
+                self.last_write = time.monotonic()
+            self._write_file(directory, data)
+
+    def _get_json_state(self):
+        return {
+            name: [[list(label_values), state] for label_values, state in values.items()]
+            for name, values in self.values.items()
+        }
+
+    def _write_file(self, directory, data):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, 'metrics-%d-%s.json' % (os.getpid(), self.process_token))
+        # write to a temporary file and move it into place, so that readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def _read_states(self):
+        directory = (get_metrics_config() or {}).get('DIRECTORY')
+        if not directory:
+            with self.lock:
+                return [self._get_json_state()]
+
+        # include this process's latest observations, which may not have been written yet
+        self.flush()
+        states = []
+        if os.path.isdir(directory):
+            for filename in sorted(os.listdir(directory)):
+                if filename.startswith('metrics-') and filename.endswith('.json'):
+                    try:
+                        with open(os.path.join(directory, filename)) as f:
+                            states.append(json.load(f))
+                    except (OSError, ValueError):
+                        # the file was removed while being read
+                        continue
+        return states
+
+    def collect(self):
+        """
+        Return the aggregated state of all metrics, across all processes if a DIRECTORY is
+        configured, as a dict mapping metric names to dicts of label value tuples to states
+        """
+        aggregated = {name: {} for name in self.metrics}
+        for state in self._read_states():
+            for name, entries in state.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                for label_values, (counts, total, count) in entries:
+                    if len(counts) != len(metric.buckets):
+                        # written with a different set of buckets; cannot be aggregated
+                        continue
+                    agg_counts, agg_total, agg_count = aggregated[name].setdefault(
+                        tuple(label_values), metric.get_empty_state()
+                    )
+                    aggregated[name][tuple(label_values)] = [
+                        [a + b for a, b in zip(agg_counts, counts)], agg_total + total, agg_count + count
+                    ]
+        return aggregated
+
+    def render(self):
+        """
+        Return the metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for name, values in self.collect().items():
+            metric = self.metrics[name]
+            lines.append('# HELP %s %s' % (name, metric.documentation))
+            lines.append('# TYPE %s histogram' % name)
+            for label_values, (counts, total, count) in sorted(values.items()):
+                labels = list(zip(metric.labelnames, label_values))
+                cumulative = 0
+                for upper_bound, bucket_count in zip(metric.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append('%s_bucket%s %d' % (
+                        name, format_labels(labels + [('le', format_value(upper_bound))]), cumulative
+                    ))
+                lines.append('%s_bucket%s %d' % (name, format_labels(labels + [('le', '+Inf')]), count))
+                lines.append('%s_sum%s %s' % (name, format_labels(labels), format_value(total)))
+                lines.append('%s_count%s %d' % (name, format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for name, value in labels
+    )
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+registry = MetricsRegistry()
+# write any observations still pending when the process exits
+atexit.register(registry.flush)
+
+export_serialization_seconds = registry.register(Histogram(
+    'wagtail_transfer_export_serialization_seconds',
+    "Time spent serializing objects for an export",
+    [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60],
+    labelnames=['view'],
+))
+export_payload_bytes = registry.register(Histogram(
+    'wagtail_transfer_export_payload_bytes',
+    "Size of export responses, as sent",
+    [1024, 10240, 102400, 1048576, 10485760, 104857600],
+    labelnames=['view'],
+))
+import_objects_per_second = registry.register(Histogram(
+    'wagtail_transfer_import_objects_per_second',
+    "Rate at which objects were imported by each run of an import plan",
+    [1, 5, 10, 25, 50, 100, 250, 500, 1000],
+    labelnames=['source'],
+))
+file_transfer_bytes = registry.register(Histogram(
+    'wagtail_transfer_file_transfer_bytes',
+    "Size of files transferred from source sites",
+    [10240, 102400, 1048576, 10485760, 104857600],
+    labelnames=['source'],
+))
+planner_round_trips = registry.register(Histogram(
+    'wagtail_transfer_planner_round_trips',
+    "Number of requests for missing object data needed to complete an import plan",
+    [0, 1, 2, 3, 5, 10, 20, 50],
+    labelnames=['source'],
+))
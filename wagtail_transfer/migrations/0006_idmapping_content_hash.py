@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtail_transfer', '0005_importcheckpoint_watermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idmapping',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='idmapping',
+            name='imported_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
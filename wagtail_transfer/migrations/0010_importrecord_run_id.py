@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtail_transfer', '0009_importrecord'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importrecord',
+            name='run_id',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:21
+
+from django.db import migrations, models
+
+
+def set_heartbeat_of_running_jobs(apps, schema_editor):
+    # give jobs that are already running a heartbeat, so that they expire if abandoned
+    ImportJob = apps.get_model('wagtail_transfer', 'ImportJob')
+    ImportJob.objects.filter(status='running').update(heartbeat_at=models.F('started_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtail_transfer', '0010_importrecord_run_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(set_heartbeat_of_running_jobs, migrations.RunPython.noop),
+    ]
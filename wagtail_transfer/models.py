@@ -1,6 +1,9 @@
+from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, models
+from django.db.models import Count, Max
 
 
 class IDMapping(models.Model):
@@ -8,6 +11,9 @@ class IDMapping(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     local_id = models.CharField(max_length=255)
     content_object = GenericForeignKey('content_type', 'local_id')
+    # fingerprint of the source data for the object as of its last import, and the time of that import
+    content_hash = models.CharField(max_length=40, blank=True)
+    imported_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         unique_together = ['content_type', 'local_id']
@@ -21,6 +27,158 @@ class ImportedFile(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
 
+class ImportCheckpoint(models.Model):
+    """
+    Records the state of a source page tree or model as of the last successful import, so that
+    subsequent imports of the same content can be skipped if nothing has changed
+    """
+    source_site = models.CharField(max_length=255)
+    # identifies the content being imported, e.g. 'wagtailcore.page:12' or 'blog.author'
+    source_root = models.CharField(max_length=255)
+    # identifies where the content was imported to, e.g. the destination parent page ID
+    destination_root = models.CharField(max_length=255, blank=True)
+    etag = models.CharField(max_length=255, blank=True)
+    # the source site's timestamp for the last import, used to request only subsequent changes
+    watermark = models.DateTimeField(null=True, blank=True)
+    # fingerprint of the destination content as left by the last import; if it no longer matches,
+    # the content has been edited or deleted here since, and is imported in full
+    destination_fingerprint = models.CharField(max_length=40, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['source_site', 'source_root', 'destination_root']
+
+
+class ImportRun(models.Model):
+    """
+    An import whose operations are committed in chunks (see WAGTAILTRANSFER_COMMIT_CHUNK_SIZE).
+    The planned operations and the import context are recorded along with the progress through
+    them, so that an import that fails or is interrupted can be resumed from the last committed
+    chunk.
+    """
+    STATUS_RUNNING = 'running'
+    STATUS_FAILED = 'failed'
+    STATUS_COMPLETED = 'completed'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_COMPLETED, 'Completed'),
+    ]
+
+    source_site = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    # the operations to be run, in order, as produced by Operation.to_json
+    operations = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    # the state of the ImportContext as of the last committed chunk
+    context = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    chunk_size = models.PositiveIntegerField()
+    # the number of operations committed so far
+    completed_operations = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ImportJob(models.Model):
+    """
+    An import requested through the admin, to be run in the background by the runner given in
+    WAGTAILTRANSFER_IMPORT_RUNNER (see jobs.py)
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    # 'page' or 'model'
+    import_type = models.CharField(max_length=20)
+    source_site = models.CharField(max_length=255)
+    # the parameters of the import, as returned by views.get_import_parameters
+    parameters = models.JSONField(default=dict)
+    # identifies where the content is being imported to, e.g. 'wagtailcore.page:3' or
+    # 'blog.author'; only one job may be running for each destination at a time
+    destination_root = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    # the phase of the import currently in progress, and the time in seconds spent in each phase
+    phase = models.CharField(max_length=50, blank=True)
+    phase_timings = models.JSONField(default=dict)
+    # the outcome of the import, as a list of [level, message] pairs (see django.contrib.messages)
+    messages = models.JSONField(default=list)
+    error = models.TextField(blank=True)
+    requested_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name='+'
+    )
+    # identifies the worker process running the job
+    worker = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # updated by the worker as the job progresses; a running job whose heartbeat is older than
+    # WAGTAILTRANSFER_IMPORT_JOB_TIMEOUT is assumed to have been abandoned (see jobs.py)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['destination_root'], condition=models.Q(status='running'),
+                name='wagtail_transfer_one_running_job_per_destination'
+            ),
+        ]
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_COMPLETED, self.STATUS_FAILED)
+
+
+class ImportRecord(models.Model):
+    """
+    A record of a completed or failed import, with the metrics collected by its instrumentation
+    (see instrumentation.py), for reporting on imports over time
+    """
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    # identifies the import in logs and profiles
+    run_id = models.CharField(max_length=64, blank=True, db_index=True)
+    source_site = models.CharField(max_length=255)
+    # 'page' or 'model', or blank for a resumed import run
+    import_type = models.CharField(max_length=20, blank=True)
+    # the parameters of the import, as returned by views.get_import_parameters
+    parameters = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES)
+    started_at = models.DateTimeField()
+    # total time taken, in seconds
+    duration = models.FloatField()
+    queries = models.PositiveIntegerField(default=0)
+    # number of requests made to the source site's API (not counting file downloads), and bytes
+    # received, including files
+    round_trips = models.PositiveIntegerField(default=0)
+    bytes_transferred = models.PositiveBigIntegerField(default=0)
+    file_count = models.PositiveIntegerField(default=0)
+    # the number of objects of each model by action, e.g. {'tests.advert': {'create': 2}}
+    object_counts = models.JSONField(default=dict)
+    # the count, duration and queries of each phase and of each type of operation, e.g.
+    # {'planning': {'count': 1, 'duration': 0.5, 'queries': 12}}
+    phases = models.JSONField(default=dict)
+    operations = models.JSONField(default=dict)
+
+    class Meta:
+        ordering = ['-started_at']
+
+    @property
+    def object_count(self):
+        return sum(sum(counts.values()) for counts in self.object_counts.values())
+
+
 def get_base_model(model):
     """
     For the given model, return the highest concrete model in the inheritance tree -
@@ -50,4 +208,45 @@ def get_base_model_for_path(model_path):
 def normalize_model_label(label):
     app_label, model_name = label.rsplit('.', 1)
     return "{}.{}".format(app_label, model_name.lower())
-    
\ No newline at end of file
+
+
+def get_read_database():
+    """
+    Return the alias of the database used for queries that only read data, such as serializing
+    objects for export and looking up existing objects when planning an import
+    """
+    return getattr(settings, 'WAGTAILTRANSFER_READ_DATABASE', DEFAULT_DB_ALIAS)
+
+
+def get_write_database():
+    """
+    Return the alias of the database that imported objects are written to
+    """
+    return getattr(settings, 'WAGTAILTRANSFER_WRITE_DATABASE', DEFAULT_DB_ALIAS)
+
+
+def get_last_modified_field(model):
+    """
+    Return the name of the field recording the last modification time of instances of the given
+    model, as specified in WAGTAILTRANSFER_LAST_MODIFIED_FIELDS, or None if no such field is configured
+    """
+    last_modified_fields = {
+        normalize_model_label(label): field_name
+        for label, field_name in getattr(settings, 'WAGTAILTRANSFER_LAST_MODIFIED_FIELDS', {}).items()
+    }
+    return last_modified_fields.get(model._meta.label_lower)
+
+
+def get_queryset_fingerprint(queryset, last_modified_fields):
+    """
+    Return a fingerprint of the given queryset that changes whenever an object is added, removed or
+    modified, using a single aggregate query over the given last-modified field(s)
+    """
+    return queryset.order_by().aggregate(
+        count=Count('pk'),
+        max_pk=Max('pk'),
+        **{
+            'max_%s' % field_name: Max(field_name)
+            for field_name in last_modified_fields
+        }
+    )
@@ -1,10 +1,15 @@
+import hashlib
 import logging
 import json
+import time
+import traceback
+from collections import defaultdict
 from copy import copy
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.db import models, transaction
+from django.utils import timezone
 from django.utils.functional import cached_property
 from modelcluster.models import ClusterableModel, get_all_child_relations
 from treebeard.mp_tree import MP_Node
@@ -12,8 +17,13 @@ from wagtail.images import get_image_model
 from wagtail.models import Page
 
 from .field_adapters import adapter_registry
-from .locators import get_locator_for_model
-from .models import get_base_model, get_base_model_for_path, get_model_for_path, normalize_model_label
+from .formats import decode_export
+from .instrumentation import Instrumentation
+from .metrics import import_objects_per_second
+from .locators import LOOKUP_BATCH_SIZE, IDMappingLocator, get_locator_for_model
+from .models import (IDMapping, ImportedFile, ImportRun, get_base_model, get_base_model_for_path,
+                     get_model_for_path, get_read_database, get_write_database,
+                     normalize_model_label)
 
 
 logger = logging.getLogger(__name__)
@@ -70,12 +80,18 @@ class Objective:
         except KeyError:
             pass
 
+        # see if the object is already known not to exist (as found by ImportPlanner's bulk lookups)
+        if (self.model, self.source_id) in self.context.missing_at_destination:
+            self._exists_at_destination = False
+            return
+
         # look up uid for this item;
         # the export API is expected to supply the id->uid mapping for all referenced objects,
         # so this lookup should always succeed (and if it doesn't, we leave the KeyError uncaught)
         uid = self.context.uids_by_source[(self.model, self.source_id)]
 
-        destination_object = get_locator_for_model(self.model).find(uid)
+        with self.context.instrumentation.phase('lookups'):
+            destination_object = get_locator_for_model(self.model).find(uid)
         if destination_object is None:
             self._exists_at_destination = False
         else:
@@ -107,7 +123,7 @@ class ImportContext:
     (for example, once a page is created at the destination, we add its ID mapping so that we
     can handle references to it that appear in other imported pages).
     """
-    def __init__(self, source_site):
+    def __init__(self, source_site, instrumentation=None):
         # A mapping of objects on the source site to their IDs on the destination site.
         # Keys are tuples of (model_class, source_id); values are destination IDs.
         # model_class must be the highest concrete model in the inheritance tree - i.e.
@@ -118,30 +134,83 @@ class ImportContext:
         # Keys are tuples of (model_class, source_id); values are UIDs.
         self.uids_by_source = {}
 
+        # Set of (model_class, source_id) tuples for objects that were found not to exist on the
+        # destination site, when looked up in bulk. Objects subsequently created by the import are
+        # recorded in destination_ids_by_source, which takes precedence.
+        self.missing_at_destination = set()
+
         # Mapping of source_urls to instances of ImportedFile
         self.imported_files_by_source_url = {}
 
         # Source name
         self.source_site = source_site
 
+        # Instrumentation object recording timings and query counts for the import
+        self.instrumentation = instrumentation or Instrumentation('import', source_site=source_site)
+
+    def to_json(self):
+        """
+        Return a JSON-serialisable representation of the context, for persisting alongside an
+        ImportRun
+        """
+        return {
+            'source_site': self.source_site,
+            'destination_ids_by_source': [
+                [model._meta.label_lower, source_id, destination_id]
+                for (model, source_id), destination_id in self.destination_ids_by_source.items()
+            ],
+            'uids_by_source': [
+                [model._meta.label_lower, source_id, uid]
+                for (model, source_id), uid in self.uids_by_source.items()
+            ],
+            'imported_files_by_source_url': {
+                source_url: imported_file.pk
+                for source_url, imported_file in self.imported_files_by_source_url.items()
+            },
+        }
+
+    @classmethod
+    def from_json(cls, json_data, instrumentation=None):
+        context = cls(json_data['source_site'], instrumentation)
+        for model_path, source_id, destination_id in json_data['destination_ids_by_source']:
+            context.destination_ids_by_source[(get_model_for_path(model_path), source_id)] = destination_id
+        for model_path, source_id, uid in json_data['uids_by_source']:
+            model = get_model_for_path(model_path)
+            context.uids_by_source[(model, source_id)] = get_locator_for_model(model).uid_from_json(uid)
+        imported_files = ImportedFile.objects.using(get_write_database()).in_bulk(
+            json_data['imported_files_by_source_url'].values()
+        )
+        for source_url, imported_file_id in json_data['imported_files_by_source_url'].items():
+            if imported_file_id in imported_files:
+                context.imported_files_by_source_url[source_url] = imported_files[imported_file_id]
+        return context
+
 
 class ImportPlanner:
-    def __init__(self, root_page_source_pk=None, destination_parent_id=None, model=None, source_site=None):
+    def __init__(self, root_page_source_pk=None, destination_parent_id=None, model=None, source_site=None, roots=None, context=None):
 
         if root_page_source_pk or destination_parent_id:
+            roots = [(root_page_source_pk, destination_parent_id)]
+
+        if roots:
             self.import_type = 'page'
-            self.root_page_source_pk = int(root_page_source_pk)
-            if destination_parent_id is None:
-                self.destination_parent_id = None
-            else:
-                self.destination_parent_id = int(destination_parent_id)
+            # Mapping of source IDs of the root pages of the import to the destination IDs of the
+            # pages to import them under (or None to import them at the top level)
+            self.root_page_destinations = {
+                int(source_pk): (None if destination_id is None else int(destination_id))
+                for source_pk, destination_id in roots
+            }
+            # the first root page, as used by single-root imports
+            self.root_page_source_pk, self.destination_parent_id = next(iter(self.root_page_destinations.items()))
         elif model:
             self.import_type = 'model'
             self.model = model
         else:
             raise NotImplementedError("Missing page kwargs or specified model kwarg")
 
-        self.context = ImportContext(source_site)
+        # The context may be shared with previous ImportPlanners, so that an import can be planned
+        # and run in several chunks while retaining the ID mappings established by earlier chunks
+        self.context = context or ImportContext(source_site)
 
         self.objectives = set()
 
@@ -191,13 +260,69 @@ class ImportPlanner:
         # NO_FOLLOW_MODELS told us not to, or because they did not exist on the source site.
         self.failed_creations = set()
 
+        # Set of (model, source_id) tuples for all items within the exported content on the source
+        # site. For a delta export this is given by the 'manifest' section of the API response, and
+        # may include items not listed in 'ids_for_import'; otherwise it matches base_import_ids.
+        self.manifest = set()
+
+        # Set of operations that will delete child objects of the object being created / updated
+        self.operations_with_deletions = set()
+
+        # Set of UpdateModel operations that were skipped by the last call to run(), because the
+        # object's source data was unchanged since it was last imported
+        self.unchanged_operations = set()
+
+        # When WAGTAILTRANSFER_QUARANTINE_FAILURES is enabled, a mapping of (model, source_id) for
+        # objects that could not be created or updated by the last call to run() to a description
+        # of the error; and a mapping of (model, destination_id) to errors for objects that could
+        # not be deleted
+        self.quarantined_objects = {}
+        self.quarantined_deletions = {}
+
+        # The time at which the source site began the export, according to its own clock; this can
+        # be passed as the 'since' parameter of a subsequent export to retrieve only the changes
+        self.source_timestamp = None
+
+        # For a paginated export, the cursor to request the next page of objects with, or None if
+        # there are no further pages
+        self.next_cursor = None
+
+        # The ImportRun recording the progress of the import, if it was committed in chunks
+        self.import_run = None
+
     @classmethod
     def for_page(cls, source, destination, source_site):
         return cls(root_page_source_pk=source, destination_parent_id=destination, source_site=source_site)
 
     @classmethod
-    def for_model(cls, model, source_site):
-        return cls(model=model, source_site=source_site)
+    def for_pages(cls, roots, source_site, context=None):
+        """
+        Return an ImportPlanner for importing several page subtrees at once, where roots is a list
+        of (source_page_id, destination_parent_id) pairs. Objects referenced from more than one
+        subtree are fetched and imported only once.
+        """
+        return cls(roots=roots, source_site=source_site, context=context)
+
+    @classmethod
+    def for_model(cls, model, source_site, context=None):
+        return cls(model=model, source_site=source_site, context=context)
+
+    def get_retry_planner(self):
+        """
+        Return a new ImportPlanner for retrying the import of the objects quarantined by the last
+        call to run(), with the same destinations for root pages as this one. The quarantined
+        objects are listed in its missing_object_data, to be requested from the source site's
+        objects API.
+        """
+        if self.import_type == 'page':
+            planner = ImportPlanner.for_pages(
+                list(self.root_page_destinations.items()), self.context.source_site
+            )
+        else:
+            planner = ImportPlanner.for_model(self.model, self.context.source_site)
+        planner.base_import_ids.update(self.quarantined_objects)
+        planner.missing_object_data.update(self.quarantined_objects)
+        return planner
 
     def add_json(self, json_data):
         """
@@ -215,8 +340,24 @@ class ImportPlanner:
         'objects': a list of dicts containing full object data used for creating or updating object
             records. This may include additional objects beyond the ones listed in ids_for_import,
             to assist in resolving related objects.
+        'manifest' (optional): for a delta export, a list of [model_classname, source_id] pairs for
+            all objects within the exported content, whether or not they are listed in
+            ids_for_import. Each of these must have an entry in the mappings table.
+        'timestamp' (optional): the time at which the export began on the source site.
+        'next' (optional): for a paginated export, the cursor for the next page of objects.
+
+        The data may also be in any of the formats handled by formats.decode_export.
         """
-        data = json.loads(json_data)
+        with self.context.instrumentation.phase('planning'):
+            self._add_json(json_data)
+
+    def _add_json(self, json_data):
+        data = decode_export(json.loads(json_data))
+
+        if self.source_timestamp is None:
+            self.source_timestamp = data.get('timestamp')
+        if 'next' in data:
+            self.next_cursor = data['next']
 
         # for each ID in the import list, add to base_import_ids as an object explicitly selected
         # for import
@@ -226,6 +367,7 @@ class ImportPlanner:
 
         # add source id -> uid mappings to the uids_by_source dict, and add objectives 
         # for importing referenced models
+        keys_to_find = []
         for model_path, source_id, jsonish_uid in data['mappings']:
             model = get_base_model_for_path(model_path)
             uid = get_locator_for_model(model).uid_from_json(jsonish_uid)
@@ -241,6 +383,17 @@ class ImportPlanner:
 
                 # add to the set of objectives that need handling
                 self._add_objective(objective)
+                keys_to_find.append((model, source_id))
+
+        self._find_at_destination(keys_to_find)
+
+        if 'manifest' in data:
+            self._add_manifest(data['manifest'])
+        else:
+            self.manifest.update(
+                (get_base_model_for_path(model_path), source_id)
+                for model_path, source_id in data['ids_for_import']
+            )
 
         # add object data to the object_data_by_source dict
         for obj_data in data['objects']:
@@ -256,6 +409,83 @@ class ImportPlanner:
             objective = self.unhandled_objectives.pop()
             self._handle_objective(objective)
 
+    def _find_at_destination(self, keys):
+        """
+        Look up whether each of the given (model_class, source_id) objects exists at the
+        destination, in one batch of queries per model, so that handling their objectives does not
+        need a query per object
+        """
+        uids_by_model = defaultdict(dict)
+        for key in keys:
+            if key not in self.context.destination_ids_by_source and key not in self.context.missing_at_destination:
+                uids_by_model[key[0]][key] = self.context.uids_by_source[key]
+
+        with self.context.instrumentation.phase('lookups'):
+            for model, uids in uids_by_model.items():
+                local_ids_by_uid = get_locator_for_model(model).find_local_ids(uids.values())
+                for key, uid in uids.items():
+                    try:
+                        self.context.destination_ids_by_source[key] = local_ids_by_uid[uid]
+                    except KeyError:
+                        self.context.missing_at_destination.add(key)
+
+    def _add_manifest(self, manifest):
+        """
+        Add the manifest of a delta export to the import plan. Any objects in the manifest that are
+        not present at the destination - for example, pages that were moved into the subtree at the
+        source without a new revision, or were deleted at the destination - are added to the
+        import, even though the delta did not include them.
+        """
+        uids_by_key = defaultdict(dict)
+        for model_path, source_id in manifest:
+            model = get_base_model_for_path(model_path)
+            self.manifest.add((model, source_id))
+            if (model, source_id) not in self.base_import_ids:
+                uids_by_key[model][(model, source_id)] = self.context.uids_by_source[(model, source_id)]
+
+        for model, uids in uids_by_key.items():
+            local_ids_by_uid = get_locator_for_model(model).find_local_ids(uids.values())
+            for key, uid in uids.items():
+                try:
+                    self.context.destination_ids_by_source[key] = local_ids_by_uid[uid]
+                except KeyError:
+                    self.base_import_ids.add(key)
+                    self._add_objective(Objective(model, key[1], self.context, must_update=True))
+
+    def get_pages_deleted_at_source(self):
+        """
+        For a page import, return a queryset of the pages at the destination which were previously
+        imported as descendants of a root page, but are no longer present in the source subtrees.
+        These are not deleted by the import. As this follows the import's own writes, it reads from
+        the write database, which a lagging read replica may not have caught up with.
+        """
+        if self.import_type != 'page':
+            return Page.objects.none()
+
+        db = get_write_database()
+        pages = Page.objects.using(db)
+        descendant_ids = set()
+        for root_page_source_pk in self.root_page_destinations:
+            try:
+                destination_root_id = self.context.destination_ids_by_source[(Page, root_page_source_pk)]
+            except KeyError:
+                continue
+            destination_root = pages.get(pk=destination_root_id)
+            descendant_ids.update(pages.descendant_of(destination_root).values_list('pk', flat=True))
+
+        if not descendant_ids:
+            return Page.objects.none()
+
+        source_uids = {
+            str(self.context.uids_by_source[key]) for key in self.manifest
+            if key in self.context.uids_by_source
+        }
+        uids = get_locator_for_model(Page).get_uids_for_local_ids(descendant_ids, create=False, using=db)
+        return pages.filter(pk__in=[
+            pk for pk, uid in uids.items()
+            if uid is not None and str(uid) not in source_uids
+        ])
+
     def _add_object_data_to_lookup(self, obj_data):
         model = get_base_model_for_path(obj_data['model'])
         source_id = obj_data['pk']
@@ -370,15 +600,15 @@ class ImportPlanner:
                 # No operation to be performed for this task
                 operation = None
             elif action == 'create':
-                if issubclass(specific_model, Page) and source_id == self.root_page_source_pk:
-                    # this is the root page of the import; ignore the parent ID in the source
+                if self.import_type == 'page' and issubclass(specific_model, Page) and source_id in self.root_page_destinations:
+                    # this is a root page of the import; ignore the parent ID in the source
                     # record and import at the requested destination instead
-                    operation = CreateTreeModel(specific_model, object_data, self.destination_parent_id)
+                    operation = CreateTreeModel(specific_model, object_data, self.root_page_destinations[source_id])
                 else:
                     operation = CreateTreeModel(specific_model, object_data)
             else:  # action == 'update'
                 destination_id = self.context.destination_ids_by_source[(model, source_id)]
-                obj = specific_model.objects.get(pk=destination_id)
+                obj = specific_model.objects.using(get_read_database()).get(pk=destination_id)
                 operation = UpdateModel(obj, object_data)
         else:
             # non-tree model
@@ -386,7 +616,7 @@ class ImportPlanner:
                 operation = CreateModel(specific_model, object_data)
             else:  # action == 'update'
                 destination_id = self.context.destination_ids_by_source[(model, source_id)]
-                obj = specific_model.objects.get(pk=destination_id)
+                obj = specific_model.objects.using(get_read_database()).get(pk=destination_id)
                 if specific_model is get_image_model():
                     operation = UpdateImage(obj, object_data)
                 else:
@@ -437,6 +667,7 @@ class ImportPlanner:
 
             for instance in operation.deletions(self.context):
                 self.operations.add(DeleteModel(instance))
+                self.operations_with_deletions.add(operation)
 
     def _retry_tasks(self):
         """
@@ -461,29 +692,232 @@ class ImportPlanner:
         if self.unhandled_objectives or self.postponed_tasks:
             raise ImproperlyConfigured("Cannot run import until all dependencies are resoved")
 
-        # filter out unsatisfiable operations
-        statuses = {}
-        satisfiable_operations = [
-            op for op in self.operations
-            if self._check_satisfiable(op, statuses)
-        ]
+        started_at = time.monotonic()
+        instrumentation = self.context.instrumentation
+        with instrumentation.phase('ordering'):
+            # filter out unsatisfiable operations
+            statuses = {}
+            satisfiable_operations = [
+                op for op in self.operations
+                if self._check_satisfiable(op, statuses)
+            ]
+
+            # skip updates of objects whose source data is unchanged since they were last imported
+            if getattr(settings, 'WAGTAILTRANSFER_SKIP_UNCHANGED_OBJECTS', True):
+                self.unchanged_operations = self._get_unchanged_operations(satisfiable_operations)
+                satisfiable_operations = [
+                    op for op in satisfiable_operations if op not in self.unchanged_operations
+                ]
+
+            # arrange operations into an order that satisfies dependencies
+            operation_order = []
+            for operation in satisfiable_operations:
+                self._add_to_operation_order(operation, operation_order, [operation])
+
+        for operation in self.unchanged_operations:
+            instrumentation.record_objects(operation.model._meta.label_lower, 'unchanged')
+        for model, source_id in self.failed_creations:
+            instrumentation.record_objects(model._meta.label_lower, 'failed')
+
+        # Optionally, commit the operations in chunks, recording progress in an ImportRun so that
+        # the import can be resumed if it fails part-way through
+        chunk_size = getattr(settings, 'WAGTAILTRANSFER_COMMIT_CHUNK_SIZE', None)
+        quarantine_failures = getattr(settings, 'WAGTAILTRANSFER_QUARANTINE_FAILURES', False)
+        if chunk_size and quarantine_failures:
+            raise ImproperlyConfigured(
+                "WAGTAILTRANSFER_COMMIT_CHUNK_SIZE and WAGTAILTRANSFER_QUARANTINE_FAILURES cannot be used together"
+            )
+        if chunk_size:
+            self.import_run = create_import_run(operation_order, self.context, chunk_size)
+            resume_import_run(self.import_run, self.context)
+            imported_count = len(operation_order)
+
+        elif quarantine_failures:
+            with transaction.atomic(using=get_write_database()):
+                completed_operations = self._run_with_quarantine(operation_order)
+                record_fingerprints(completed_operations, self.context)
+            record_object_counts(completed_operations, instrumentation)
+            imported_count = len(completed_operations)
 
-        # arrange operations into an order that satisfies dependencies
-        operation_order = []
-        for operation in satisfiable_operations:
-            self._add_to_operation_order(operation, operation_order, [operation])
+        else:
+            # run operations in order
+            with transaction.atomic(using=get_write_database()):
+                with instrumentation.phase('operations'):
+                    for operation in operation_order:
+                        with instrumentation.operation(operation):
+                            operation.run(self.context)
+
+                # pages must only have revisions saved after all child objects have been updated, imported, or deleted, otherwise
+                # they will capture outdated versions of child objects in the revision
+                with instrumentation.phase('revisions'):
+                    for operation in operation_order:
+                        if isinstance(operation.instance, Page):
+                            operation.instance.save_revision()
+
+                record_fingerprints(operation_order, self.context)
+            record_object_counts(operation_order, instrumentation)
+            imported_count = len(operation_order)
+
+        elapsed = time.monotonic() - started_at
+        if imported_count and elapsed > 0:
+            import_objects_per_second.observe(
+                imported_count / elapsed, source=self.context.source_site or ''
+            )
 
-        # run operations in order
-        with transaction.atomic():
-            for operation in operation_order:
-                operation.run(self.context)
-            
-            # pages must only have revisions saved after all child objects have been updated, imported, or deleted, otherwise
-            # they will capture outdated versions of child objects in the revision
+    def _run_with_quarantine(self, operation_order):
+        """
+        Run the given operations, each within its own savepoint. An operation that fails is rolled
+        back and its object quarantined, along with any objects whose operations have a hard
+        dependency on it; all other operations go ahead. Returns the list of operations that
+        completed successfully.
+        """
+        self.quarantined_objects = {}
+        self.quarantined_deletions = {}
+        completed_operations = []
+        instrumentation = self.context.instrumentation
+
+        with instrumentation.phase('operations'):
             for operation in operation_order:
-                if isinstance(operation.instance, Page):
-                    operation.instance.save_revision()
+                failed_dependency = next((
+                    (model, source_id) for model, source_id, is_hard_dep in operation.dependencies
+                    if is_hard_dep and (model, source_id) in self.quarantined_objects
+                ), None)
+                if failed_dependency is not None:
+                    model, source_id = failed_dependency
+                    self._quarantine(operation, "Depends on %s %s, which could not be imported" % (model._meta.label_lower, source_id))
+                    continue
+
+                # files imported by a failed operation are rolled back along with it, so must not be
+                # reused by later operations
+                imported_files_by_source_url = dict(self.context.imported_files_by_source_url)
+                # errors raised by instrumentation (such as an import job's lease having expired)
+                # stop the import, rather than quarantining the operation
+                with instrumentation.operation(operation):
+                    try:
+                        with transaction.atomic(using=get_write_database()):
+                            operation.run(self.context)
+                    except Exception as e:
+                        self.context.imported_files_by_source_url = imported_files_by_source_url
+                        self._quarantine(operation, e)
+                    else:
+                        completed_operations.append(operation)
+
+        # pages must only have revisions saved after all child objects have been updated, imported,
+        # or deleted, as in run()
+        with instrumentation.phase('revisions'):
+            for operation in list(completed_operations):
+                if isinstance(operation, SaveOperationMixin) and isinstance(operation.instance, Page):
+                    try:
+                        with transaction.atomic(using=get_write_database()):
+                            operation.instance.save_revision()
+                    except Exception as e:
+                        self._quarantine(operation, e)
+                        completed_operations.remove(operation)
+
+        if self.quarantined_objects or self.quarantined_deletions:
+            logger.warning(
+                "%d object(s) could not be imported and were quarantined: %s",
+                len(self.quarantined_objects) + len(self.quarantined_deletions),
+                "; ".join(
+                    "%s %s: %s" % (item['model'], item['source_id'] or item['destination_id'], item['error'])
+                    for item in self.get_quarantine_report()
+                )
+            )
 
+        return completed_operations
+
+    def _quarantine(self, operation, error):
+        if isinstance(operation, SaveOperationMixin):
+            self.quarantined_objects[(operation.base_model, operation.object_data['pk'])] = str(error)
+            model = operation.model
+        elif isinstance(operation, DeleteModel):
+            model = type(operation.instance)
+            self.quarantined_deletions[(get_base_model(model), operation.instance.pk)] = str(error)
+        else:
+            return
+        self.context.instrumentation.record_objects(model._meta.label_lower, 'quarantined')
+
+    def get_quarantine_report(self):
+        """
+        Return a list of the objects quarantined by the last call to run(), as dicts of 'model',
+        'source_id' (for objects that could not be created or updated), 'destination_id' (for
+        objects that could not be deleted) and 'error'
+        """
+        report = [
+            {'model': model._meta.label_lower, 'source_id': source_id, 'destination_id': None, 'error': error}
+            for (model, source_id), error in self.quarantined_objects.items()
+        ]
+        report.extend(
+            {'model': model._meta.label_lower, 'source_id': None, 'destination_id': destination_id, 'error': error}
+            for (model, destination_id), error in self.quarantined_deletions.items()
+        )
+        return report
+
+    def _get_unchanged_operations(self, operations):
+        """
+        Return the set of UpdateModel operations from the given list that can be skipped, because
+        the object's source data has the same fingerprint as when it was last imported
+        """
+        candidates = {}
+        for operation in operations:
+            if (
+                isinstance(operation, UpdateModel)
+                and operation.object_data.get('fingerprint')
+                and operation not in self.operations_with_deletions
+                and isinstance(get_locator_for_model(operation.base_model), IDMappingLocator)
+            ):
+                uid = self.context.uids_by_source[(operation.base_model, operation.object_data['pk'])]
+                candidates[str(uid)] = operation
+
+        uids = list(candidates)
+        imported_states = {}
+        for i in range(0, len(uids), LOOKUP_BATCH_SIZE):
+            for uid, content_hash, imported_at in IDMapping.objects.using(get_read_database()).filter(
+                uid__in=uids[i:i + LOOKUP_BATCH_SIZE]
+            ).values_list('uid', 'content_hash', 'imported_at'):
+                imported_states[str(uid)] = (content_hash, imported_at)
+
+        unchanged_operations = set()
+        for uid, operation in candidates.items():
+            content_hash, imported_at = imported_states.get(uid, ('', None))
+            # the recorded hash also covers the references that could not be resolved when the
+            # object was last imported, so it no longer matches once any of them can be
+            if content_hash != get_content_hash(operation, self.context):
+                continue
+
+            # a page that has been edited at the destination since it was imported is overwritten,
+            # as it would be without this check
+            latest_revision_created_at = getattr(operation.instance, 'latest_revision_created_at', None)
+            if latest_revision_created_at and (imported_at is None or latest_revision_created_at > imported_at):
+                continue
+
+            # an object may reference objects that did not exist at the destination when it was
+            # last imported, and so need to be filled in now
+            if any(
+                self.resolutions.get((model, source_id)) is not None
+                for model, source_id, is_hard_dep in operation.dependencies
+            ):
+                continue
+
+            unchanged_operations.add(operation)
+
+        # an object with child objects (such as the InlinePanel items of a page) that are being
+        # created or updated must also be updated, so that any new page revision reflects them
+        while unchanged_operations:
+            changed_objects = {
+                (operation.base_model, operation.object_data['pk'])
+                for operation in operations
+                if isinstance(operation, SaveOperationMixin) and operation not in unchanged_operations
+            }
+            changed_parents = {
+                operation for operation in unchanged_operations
+                if not changed_objects.isdisjoint(operation.child_objects)
+            }
+            if not changed_parents:
+                break
+            unchanged_operations -= changed_parents
+
+        return unchanged_operations
 
     def _check_satisfiable(self, operation, statuses):
         # Check whether the given operation's dependencies are satisfiable. statuses is a dict of
@@ -596,6 +1030,150 @@ class ImportPlanner:
         operation_order.append(operation)
 
 
+def get_content_hash(operation, context):
+    """
+    Return the content hash recorded against the IDMapping of the object saved by the given
+    operation: the fingerprint of its source data, combined with any of its references to objects
+    that do not exist at the destination. Such references are left broken or empty, so the object
+    must not be skipped as unchanged once they can be filled in.
+    """
+    unresolved_references = sorted(
+        '%s:%s' % (model._meta.label_lower, source_id)
+        for model, source_id, is_hard_dep in operation.dependencies
+        if (model, source_id) not in context.destination_ids_by_source
+    )
+    if not unresolved_references:
+        return operation.object_data['fingerprint']
+    data = json.dumps([operation.object_data['fingerprint'], unresolved_references])
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def record_fingerprints(operations, context):
+    """
+    Store the content hashes (see get_content_hash) of the objects created or updated by the given
+    operations against their IDMapping records
+    """
+    fingerprints = {}
+    for operation in operations:
+        if (
+            isinstance(operation, SaveOperationMixin)
+            and operation.object_data.get('fingerprint')
+            and isinstance(get_locator_for_model(operation.base_model), IDMappingLocator)
+        ):
+            uid = context.uids_by_source[(operation.base_model, operation.object_data['pk'])]
+            fingerprints[str(uid)] = get_content_hash(operation, context)
+
+    imported_at = timezone.now()
+    uids = list(fingerprints)
+    for i in range(0, len(uids), LOOKUP_BATCH_SIZE):
+        mappings = list(IDMapping.objects.using(get_write_database()).filter(
+            uid__in=uids[i:i + LOOKUP_BATCH_SIZE]
+        ))
+        for mapping in mappings:
+            mapping.content_hash = fingerprints[str(mapping.uid)]
+            mapping.imported_at = imported_at
+        IDMapping.objects.using(get_write_database()).bulk_update(
+            mappings, ['content_hash', 'imported_at']
+        )
+
+
+def record_object_counts(operations, instrumentation):
+    """
+    Record the numbers of objects of each model created, updated and deleted by the given
+    operations on the import's instrumentation. This is called once the operations have been
+    committed, so that operations that were rolled back or quarantined are not counted.
+    """
+    for operation in operations:
+        if isinstance(operation, CreateModel):
+            instrumentation.record_objects(operation.model._meta.label_lower, 'create')
+        elif isinstance(operation, UpdateModel):
+            instrumentation.record_objects(operation.model._meta.label_lower, 'update')
+        elif isinstance(operation, DeleteModel):
+            instrumentation.record_objects(type(operation.instance)._meta.label_lower, 'delete')
+
+
+def create_import_run(operations, context, chunk_size):
+    """
+    Create an ImportRun for the given ordered list of operations, to be committed in chunks of
+    chunk_size operations. Saving page revisions is recorded as a final set of operations, as
+    these must happen after all child objects of the pages have been imported.
+    """
+    revision_operations = [
+        SavePageRevision(operation.object_data['pk'])
+        for operation in operations
+        if isinstance(operation, SaveOperationMixin) and isinstance(operation.instance, Page)
+    ]
+    return ImportRun.objects.using(get_write_database()).create(
+        source_site=context.source_site or '',
+        operations=[operation.to_json() for operation in operations + revision_operations],
+        context=context.to_json(),
+        chunk_size=chunk_size,
+    )
+
+
+def resume_import_run(import_run, context=None):
+    """
+    Run the remaining operations of an ImportRun, committing them in chunks and recording progress
+    after each one. If context is not given, the context is restored from the ImportRun, and the
+    resumed import is treated as finished (for the purposes of instrumentation) when this returns.
+    """
+    resuming = context is None
+    if resuming:
+        context = ImportContext.from_json(
+            import_run.context,
+            Instrumentation('import', source_site=import_run.source_site, import_run=import_run.pk)
+        )
+    instrumentation = context.instrumentation
+
+    import_run.status = ImportRun.STATUS_RUNNING
+    import_run.error = ''
+    import_run.save(using=get_write_database(), update_fields=['status', 'error', 'updated_at'])
+
+    try:
+        while import_run.completed_operations < len(import_run.operations):
+            start = import_run.completed_operations
+            chunk = import_run.operations[start:start + import_run.chunk_size]
+            with transaction.atomic(using=get_write_database()):
+                with instrumentation.phase('operations'):
+                    operations = [
+                        operation for operation in map(operation_from_json, chunk)
+                        if operation is not None
+                    ]
+                    for operation in operations:
+                        with instrumentation.operation(operation):
+                            operation.run(context)
+                    record_fingerprints(operations, context)
+
+                import_run.completed_operations = start + len(chunk)
+                import_run.context = context.to_json()
+                import_run.save(
+                    using=get_write_database(),
+                    update_fields=['completed_operations', 'context', 'updated_at']
+                )
+            record_object_counts(operations, instrumentation)
+    except Exception:
+        import_run.status = ImportRun.STATUS_FAILED
+        import_run.error = traceback.format_exc()
+        import_run.save(using=get_write_database(), update_fields=['status', 'error', 'updated_at'])
+        if resuming:
+            instrumentation.finish(status='failed')
+        raise
+
+    import_run.status = ImportRun.STATUS_COMPLETED
+    import_run.save(using=get_write_database(), update_fields=['status', 'updated_at'])
+    if resuming:
+        instrumentation.finish(status='completed')
+    return import_run
+
+
+def operation_from_json(json_data):
+    """
+    Reconstruct an operation from the output of its to_json method. Returns None if the operation
+    no longer needs to be run (i.e. it deletes an object that has already been deleted).
+    """
+    return OPERATION_CLASSES[json_data['type']].from_json(json_data)
+
+
 class Operation:
     """
     Represents a single database operation to be performed during the data import. This operation
@@ -623,6 +1201,17 @@ class Operation:
         # the set of objects that must be deleted when we import this object
         return set()
 
+    def to_json(self):
+        """
+        Return a JSON-serialisable representation of this operation, from which it can be
+        reconstructed with operation_from_json (possibly in a later process)
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def from_json(cls, json_data):
+        raise NotImplementedError
+
 
 class SaveOperationMixin:
     """
@@ -679,10 +1268,24 @@ class SaveOperationMixin:
         if save_needed:
             # _save() for creating a page may attempt to re-add it as a child, so the instance (assumed to be already
             # in the tree) is saved directly
-            self.instance.save()
+            self.instance.save(using=get_write_database())
 
     def _save(self, context):
-        self.instance.save()
+        self.instance.save(using=get_write_database())
+
+    @cached_property
+    def child_objects(self):
+        # the set of (base_model_class, source_id) tuples for the child objects (such as the
+        # InlinePanel items of a page) listed in the object data
+        children = set()
+        for field in self.model._meta.get_fields():
+            if not field.one_to_many:
+                continue
+            child_ids = self.object_data['fields'].get(field.name)
+            if isinstance(child_ids, list):
+                related_base_model = get_base_model(field.related_model)
+                children.update((related_base_model, child_id) for child_id in child_ids)
+        return children
 
     @cached_property
     def dependencies(self):
@@ -718,6 +1321,13 @@ class CreateModel(SaveOperationMixin, Operation):
         self.object_data = object_data
         self.instance = self.model()
 
+    def to_json(self):
+        return {'type': 'create', 'model': self.model._meta.label_lower, 'object_data': self.object_data}
+
+    @classmethod
+    def from_json(cls, json_data):
+        return cls(get_model_for_path(json_data['model']), json_data['object_data'])
+
     def run(self, context):
         # Create object and populate its attributes from field_data
         self._populate_fields(context)
@@ -743,6 +1353,21 @@ class CreateTreeModel(CreateModel):
         super().__init__(model, object_data)
         self.destination_parent_id = destination_parent_id
 
+    def to_json(self):
+        return {
+            'type': 'create_tree',
+            'model': self.model._meta.label_lower,
+            'object_data': self.object_data,
+            'destination_parent_id': self.destination_parent_id,
+        }
+
+    @classmethod
+    def from_json(cls, json_data):
+        return cls(
+            get_model_for_path(json_data['model']), json_data['object_data'],
+            json_data['destination_parent_id']
+        )
+
     @cached_property
     def dependencies(self):
         deps = super().dependencies
@@ -761,18 +1386,34 @@ class CreateTreeModel(CreateModel):
             source_parent_id = self.object_data['parent_id']
             self.destination_parent_id = context.destination_ids_by_source[(get_base_model(self.model), source_parent_id)]
 
-        parent = get_base_model(self.model).objects.get(id=self.destination_parent_id)
+        parent = get_base_model(self.model).objects.using(get_write_database()).get(id=self.destination_parent_id)
 
         # Add the page to the database as a child of parent
         parent.add_child(instance=self.instance)
 
 
 class UpdateModel(SaveOperationMixin, Operation):
+    json_type = 'update'
+
     def __init__(self, instance, object_data):
         self.instance = instance
         self.model = type(instance)
         self.object_data = object_data
 
+    def to_json(self):
+        return {
+            'type': self.json_type,
+            'model': self.model._meta.label_lower,
+            'pk': self.instance.pk,
+            'object_data': self.object_data,
+        }
+
+    @classmethod
+    def from_json(cls, json_data):
+        model = get_model_for_path(json_data['model'])
+        instance = model.objects.using(get_write_database()).get(pk=json_data['pk'])
+        return cls(instance, json_data['object_data'])
+
     def run(self, context):
         self._populate_fields(context)
         self._save(context)
@@ -786,6 +1427,7 @@ class UpdateImage(UpdateModel):
     If an image's file changes, and we don't clear renditions generated from the old
     file, outdated renditions may be shown to users.
     """
+    json_type = 'update_image'
 
     def run(self, context):
         super().run(context)
@@ -808,7 +1450,50 @@ class DeleteModel(Operation):
         self.instance = instance
 
     def run(self, context):
-        self.instance.delete()
+        self.instance.delete(using=get_write_database())
+
+    def to_json(self):
+        return {'type': 'delete', 'model': type(self.instance)._meta.label_lower, 'pk': self.instance.pk}
+
+    @classmethod
+    def from_json(cls, json_data):
+        model = get_model_for_path(json_data['model'])
+        instance = model._default_manager.using(get_write_database()).filter(pk=json_data['pk']).first()
+        if instance is None:
+            # already deleted
+            return None
+        return cls(instance)
 
     # TODO: work out whether we need to check for incoming FK relations with on_delete=CASCADE
     # and declare those as 'must delete this first' dependencies
+
+
+class SavePageRevision(Operation):
+    """
+    Save a new revision of an imported page. This is only used for imports that are committed in
+    chunks; otherwise, revisions are saved directly at the end of ImportPlanner.run.
+    """
+    def __init__(self, source_id):
+        self.source_id = source_id
+
+    def run(self, context):
+        destination_id = context.destination_ids_by_source[(Page, self.source_id)]
+        page = Page.objects.using(get_write_database()).get(pk=destination_id).specific
+        page.save_revision()
+
+    def to_json(self):
+        return {'type': 'save_revision', 'source_id': self.source_id}
+
+    @classmethod
+    def from_json(cls, json_data):
+        return cls(json_data['source_id'])
+
+
+OPERATION_CLASSES = {
+    'create': CreateModel,
+    'create_tree': CreateTreeModel,
+    'update': UpdateModel,
+    'update_image': UpdateImage,
+    'delete': DeleteModel,
+    'save_revision': SavePageRevision,
+}
@@ -0,0 +1,122 @@
+"""
+Opt-in profiling of individual imports and exports, as configured by WAGTAILTRANSFER_PROFILING.
+A profiled run is wrapped in cProfile, and optionally tracemalloc, and the results are written to
+the configured directory, in files named after the kind of run and its run ID.
+"""
+import cProfile
+import logging
+import marshal
+import os
+import re
+import tracemalloc
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP_ALLOCATIONS = 25
+
+# run IDs passed by importers to request a profiled export; these are used in filenames, so are
+# restricted to a safe set of characters
+RUN_ID_PATTERN = re.compile(r'^[0-9a-zA-Z\-]{1,64}$')
+
+
+def get_profiling_config():
+    return getattr(settings, 'WAGTAILTRANSFER_PROFILING', None) or {}
+
+
+def is_profiling_enabled():
+    return bool(get_profiling_config().get('DIRECTORY'))
+
+
+def can_profile(user):
+    """
+    Return whether the given user may request a profiled import
+    """
+    return is_profiling_enabled() and user.is_superuser
+
+
+def is_valid_run_id(run_id):
+    return bool(RUN_ID_PATTERN.match(run_id))
+
+
+class ProfiledRun:
+    """
+    Handle on a run being profiled by profile(). Calling discard() prevents its results from being
+    written, for a run that turns out not to have been authorised to be profiled.
+    """
+    def __init__(self):
+        self.discarded = False
+
+    def discard(self):
+        self.discarded = True
+
+
+@contextmanager
+def profile(kind, run_id):
+    """
+    Profile the enclosed block, writing the profile to <DIRECTORY>/<kind>-<run_id>.prof and, if
+    MEMORY is enabled, a report of the top allocations to <DIRECTORY>/<kind>-<run_id>.allocations.txt.
+    Existing files are never overwritten: if a profile for the run already exists, the block is run
+    without being profiled.
+    """
+    config = get_profiling_config()
+    directory = config['DIRECTORY']
+    path = os.path.join(directory, '%s-%s' % (kind, run_id))
+    if os.path.exists(path + '.prof'):
+        logger.warning("Not profiling %s %s, as %s.prof already exists", kind, run_id, path)
+        yield ProfiledRun()
+        return
+
+    # tracemalloc may already have been started elsewhere (e.g. with PYTHONTRACEMALLOC), in
+    # which case we leave it running
+    trace_memory = config.get('MEMORY', False) and not tracemalloc.is_tracing()
+
+    if trace_memory:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    run = ProfiledRun()
+    profiler.enable()
+    try:
+        yield run
+    finally:
+        profiler.disable()
+        snapshot = None
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+        if not run.discarded and write_profile(profiler, path + '.prof'):
+            logger.info("Profile of %s %s written to %s.prof", kind, run_id, path)
+            if snapshot is not None:
+                write_allocation_report(
+                    snapshot, path + '.allocations.txt',
+                    config.get('TOP_ALLOCATIONS', DEFAULT_TOP_ALLOCATIONS)
+                )
+
+
+def write_profile(profiler, path):
+    """
+    Write the profiler's stats to path, in the format read by pstats (as Profile.dump_stats does),
+    unless the file already exists. Return whether the file was written.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        f = open(path, 'xb')
+    except FileExistsError:
+        logger.warning("Not overwriting existing profile %s", path)
+        return False
+    with f:
+        profiler.create_stats()
+        marshal.dump(profiler.stats, f)
+    return True
+
+
+def write_allocation_report(snapshot, path, limit):
+    statistics = snapshot.statistics('lineno')
+    with open(path, 'w') as f:
+        f.write("Top %d of %d allocation sites by size\n\n" % (min(limit, len(statistics)), len(statistics)))
+        for statistic in statistics[:limit]:
+            f.write("%s\n" % statistic)
@@ -0,0 +1,296 @@
+"""
+Recording of the responses received by imports, and their replay. When WAGTAILTRANSFER_RECORDING
+is set, every import saves the export API responses it receives from the source site (and
+optionally the files it downloads) into a bundle directory named after its run ID. The
+transfer_replay management command runs the same import again from a bundle, through
+ReplayTransport, so that real content can be used as a regression benchmark.
+
+A bundle consists of a manifest.json file describing the import and each response, and the bodies
+of the responses in the responses/ and files/ subdirectories.
+"""
+import gzip
+import json
+import os
+import tempfile
+from functools import lru_cache
+
+from django.apps import apps
+from django.conf import settings
+from django.utils import timezone
+
+from .formats import V1_CONTENT_TYPE, decode_export
+from .models import get_base_model
+from .transports import BaseTransport, LoopbackResponse
+
+
+BUNDLE_VERSION = 1
+
+# query parameters that vary between runs of the same import (including 'since', which depends on
+# the checkpoint left by earlier imports), and are ignored when matching requests to recorded
+# responses
+IGNORED_PARAMS = {'digest', 'profile', 'since'}
+
+# response headers that are recorded; others (such as Content-Encoding) describe the response as
+# sent, rather than its content
+RECORDED_HEADERS = ['Content-Type', 'ETag']
+
+# source options that affect the requests made by an import, and are recorded in the bundle
+RECORDED_SOURCE_OPTIONS = ['BASE_URL', 'CLOSURE_DEPTH', 'COMPRESSION_LEVEL', 'CHUNK_SIZE']
+
+
+def get_recording_config():
+    return getattr(settings, 'WAGTAILTRANSFER_RECORDING', None)
+
+
+def is_recording_enabled():
+    config = get_recording_config()
+    return bool(config and config.get('DIRECTORY'))
+
+
+def get_request_key(url, params):
+    return json.dumps([
+        url, sorted((name, str(value)) for name, value in (params or {}).items() if name not in IGNORED_PARAMS)
+    ])
+
+
+class ReplayError(Exception):
+    pass
+
+
+class Recorder:
+    """
+    Saves the responses received by an import into a bundle directory
+    """
+    def __init__(self, directory, source, import_type, parameters, files=False):
+        self.directory = directory
+        self.base_url = settings.WAGTAILTRANSFER_SOURCES[source]['BASE_URL']
+        self.files = files
+        self.manifest = {
+            'version': BUNDLE_VERSION,
+            'source': source,
+            'source_options': {
+                name: value for name, value in settings.WAGTAILTRANSFER_SOURCES[source].items()
+                if name in RECORDED_SOURCE_OPTIONS
+            },
+            'import_type': import_type,
+            'parameters': {name: value for name, value in parameters.items() if name != 'profile'},
+            'recorded_at': timezone.now().isoformat(),
+            'responses': [],
+            'files': [],
+        }
+        os.makedirs(os.path.join(directory, 'responses'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'files'), exist_ok=True)
+        self._write_manifest()
+
+    @classmethod
+    def for_import(cls, run_id, source, import_type, parameters):
+        """
+        Return a Recorder for the import with the given run ID, as configured by
+        WAGTAILTRANSFER_RECORDING
+        """
+        config = get_recording_config()
+        return cls(
+            os.path.join(config['DIRECTORY'], run_id), source, import_type, parameters,
+            files=config.get('FILES', False)
+        )
+
+    def wrap(self, transport):
+        return RecordingTransport(transport, self)
+
+    def _write_body(self, path, content):
+        with open(os.path.join(self.directory, path), 'wb') as f:
+            f.write(content)
+
+    def _write_manifest(self):
+        # write to a temporary file and move it into place, so that the bundle remains readable if
+        # the import is interrupted
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.manifest-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(temp_path, os.path.join(self.directory, 'manifest.json'))
+
+    def record(self, method, url, params, response):
+        if url.startswith(self.base_url):
+            path = 'responses/%04d' % (len(self.manifest['responses']) + 1)
+            self._write_body(path, response.content)
+            self.manifest['responses'].append({
+                'method': method,
+                'url': url,
+                'params': {
+                    name: value for name, value in (params or {}).items() if name not in IGNORED_PARAMS
+                },
+                'status': response.status_code,
+                'headers': {
+                    name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers
+                },
+                'body': path,
+            })
+        else:
+            # a file download
+            path = None
+            if self.files and response.status_code == 200:
+                path = 'files/%04d' % (len(self.manifest['files']) + 1)
+                self._write_body(path, response.content)
+            self.manifest['files'].append({
+                'url': url,
+                'status': response.status_code,
+                'size': len(response.content),
+                'body': path,
+            })
+        self._write_manifest()
+
+
+class RecordingTransport(BaseTransport):
+    """
+    Passes requests on to another transport, recording the responses with a Recorder
+    """
+    def __init__(self, transport, recorder):
+        super().__init__(transport.source)
+        self.transport = transport
+        self.recorder = recorder
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        response = self.transport.get(url, params=params, headers=headers, timeout=timeout)
+        self.recorder.record('GET', url, params, response)
+        return response
+
+    def post(self, url, params=None, data=None, headers=None, timeout=None):
+        response = self.transport.post(url, params=params, data=data, headers=headers, timeout=timeout)
+        self.recorder.record('POST', url, params, response)
+        return response
+
+
+class Bundle:
+    """
+    The responses recorded by an import, as read back from a bundle directory
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        try:
+            with open(os.path.join(directory, 'manifest.json')) as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ReplayError("Cannot read replay bundle %s: %s" % (directory, e))
+        if self.manifest.get('version') != BUNDLE_VERSION:
+            raise ReplayError("Unsupported replay bundle version: %r" % self.manifest.get('version'))
+
+        self.source = self.manifest['source']
+        self.import_type = self.manifest['import_type']
+        self.parameters = self.manifest['parameters']
+        self.responses = {
+            get_request_key(entry['url'], entry['params']): entry
+            for entry in self.manifest['responses']
+        }
+        self.files = {entry['url']: entry for entry in self.manifest['files']}
+
+        # all objects included in the recorded export responses, so that requests for missing
+        # objects can be answered however the objects are grouped into requests: a dict mapping
+        # (base model label, source ID) to (object data, index of the response's mappings), and
+        # a list of the mappings of each response
+        self.objects = {}
+        self.mappings = []
+        for entry in self.manifest['responses']:
+            if entry['status'] != 200:
+                continue
+            data = decode_export(json.loads(self.read(entry['body'])))
+            mappings_index = len(self.mappings)
+            self.mappings.append(data['mappings'])
+            for obj in data['objects']:
+                model_label = get_base_model(apps.get_model(obj['model']))._meta.label_lower
+                self.objects[(model_label, str(obj['pk']))] = (obj, mappings_index)
+
+    def read(self, path):
+        with open(os.path.join(self.directory, path), 'rb') as f:
+            return f.read()
+
+    def get_response(self, url, params):
+        try:
+            entry = self.responses[get_request_key(url, params)]
+        except KeyError:
+            raise ReplayError("No response to %s was recorded" % url)
+        return LoopbackResponse(entry['status'], self.read(entry['body']), entry['headers'])
+
+    def get_objects_response(self, request_data):
+        """
+        Return a response to a request to the objects endpoint with the given data, containing
+        whichever of the requested objects are in the bundle
+        """
+        request_data.pop('known_uids', None)
+        objects = []
+        mappings_indexes = set()
+        for model_label, ids in request_data.items():
+            for source_id in ids:
+                try:
+                    obj, mappings_index = self.objects[(model_label, str(source_id))]
+                except KeyError:
+                    # left to be handled as an object that is missing at the source
+                    continue
+                objects.append(obj)
+                mappings_indexes.add(mappings_index)
+
+        mappings = {}
+        for index in sorted(mappings_indexes):
+            for model_path, pk, uid in self.mappings[index]:
+                mappings[(model_path, pk)] = [model_path, pk, uid]
+
+        content = json.dumps({
+            'ids_for_import': [],
+            'mappings': list(mappings.values()),
+            'objects': objects,
+        }).encode('utf-8')
+        return LoopbackResponse(200, content, {'Content-Type': V1_CONTENT_TYPE})
+
+    def get_file_response(self, url):
+        try:
+            entry = self.files[url]
+        except KeyError:
+            return LoopbackResponse(404, b'')
+        if entry['body']:
+            content = self.read(entry['body'])
+        else:
+            # the file was recorded without its contents; substitute a file of the same size
+            content = b'\0' * entry['size']
+        return LoopbackResponse(entry['status'], content)
+
+
+@lru_cache(maxsize=8)
+def _load_bundle(directory, manifest_mtime):
+    return Bundle(directory)
+
+
+def load_bundle(directory):
+    """
+    Return the Bundle in the given directory. Bundles are cached, as a transport is created for
+    every request, but keyed on the modification time of the manifest - so that a bundle recorded
+    again into the same directory is read afresh
+    """
+    try:
+        manifest_mtime = os.stat(os.path.join(directory, 'manifest.json')).st_mtime_ns
+    except OSError:
+        # left for Bundle to report
+        manifest_mtime = None
+    return _load_bundle(directory, manifest_mtime)
+
+
+class ReplayTransport(BaseTransport):
+    """
+    Answers requests from the bundle given as the source's BUNDLE option. Requests for missing
+    objects are answered from all objects in the bundle, so that an import can be replayed against
+    a database that has fewer (or more) objects than the one it was recorded against.
+    """
+    def __init__(self, source):
+        super().__init__(source)
+        self.bundle = load_bundle(settings.WAGTAILTRANSFER_SOURCES[source]['BUNDLE'])
+        self.base_url = settings.WAGTAILTRANSFER_SOURCES[source]['BASE_URL']
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        if not url.startswith(self.base_url):
+            return self.bundle.get_file_response(url)
+        return self.bundle.get_response(url, params)
+
+    def post(self, url, params=None, data=None, headers=None, timeout=None):
+        if url == self.base_url + 'api/objects/':
+            if (headers or {}).get('Content-Encoding') == 'gzip':
+                data = gzip.decompress(data)
+            return self.bundle.get_objects_response(json.loads(data))
+        return self.bundle.get_response(url, params)
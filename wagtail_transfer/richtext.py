@@ -79,6 +79,18 @@ class RichTextReferenceHandler:
         else:
             return self.tag_matcher.sub(partial(self.update_tag_id, destination_ids_by_source=destination_ids_by_source), html)
 
+    def get_referenced_models(self):
+        # Gets the base models of all objects that get_objects may return
+        models = set()
+        for handler in self.handlers.values():
+            try:
+                model = handler.get_model()
+            except NotImplementedError:
+                continue
+            if model is not None:
+                models.add(get_base_model(model))
+        return models
+
 
 class MultiTypeRichTextReferenceHandler:
     """Handles retrieving object references and updating ids for several different kinds of tags in rich text"""
@@ -96,6 +108,12 @@ class MultiTypeRichTextReferenceHandler:
             objects = objects.union(handler.get_objects(html))
         return objects
 
+    def get_referenced_models(self):
+        models = set()
+        for handler in self.handlers:
+            models.update(handler.get_referenced_models())
+        return models
+
 
 REFERENCE_HANDLER = None
 
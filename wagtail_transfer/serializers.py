@@ -1,14 +1,33 @@
+import hashlib
+import json
+from collections import defaultdict
 from functools import lru_cache
 
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import prefetch_related_objects
 from django.db.models.constants import LOOKUP_SEP
 from treebeard.mp_tree import MP_Node
 from wagtail import hooks
 from wagtail.models import Page
 
 from .field_adapters import adapter_registry
-from .models import get_base_model
+from .locators import LOOKUP_BATCH_SIZE
+from .models import get_base_model, get_read_database
+
+
+def get_fingerprint(object_data):
+    """
+    Return a hash of the given serialized object data, which will change whenever the object's
+    content (including its position in a tree) changes
+    """
+    data = {key: value for key, value in object_data.items() if key != 'fingerprint'}
+    return hashlib.sha1(
+        json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder).encode('utf-8')
+    ).hexdigest()
 
 
 def _get_subclasses_recurse(model):
@@ -70,6 +89,26 @@ def get_subclass_instances(instances, subclasses):
     return subclass_instances
 
 
+def get_specific_instances(queryset):
+    """
+    Return a list of the specific instances of the objects in a queryset of a model with a
+    content_type field (such as Page), in the queryset's original order. Unlike Wagtail's own
+    `specific()`, this fetches the specific instances from the same database as the queryset.
+    """
+    pks_and_types = list(queryset.values_list('pk', 'content_type'))
+
+    pks_by_type = defaultdict(list)
+    for pk, content_type_id in pks_and_types:
+        pks_by_type[content_type_id].append(pk)
+
+    instances_by_pk = {}
+    for content_type_id, pks in pks_by_type.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class() or queryset.model
+        instances_by_pk.update(model.objects.using(queryset.db).in_bulk(pks))
+
+    return [instances_by_pk[pk] for pk, _ in pks_and_types if pk in instances_by_pk]
+
+
 class ModelSerializer:
     ignored_fields = []
 
@@ -101,10 +140,22 @@ class ModelSerializer:
         run serialize and get_object_references on, fetching the specific subclasses
         if using multi table inheritance as appropriate
         """
-        base_queryset = self.model.objects.filter(pk__in=ids)
+        base_queryset = self.model.objects.using(get_read_database()).filter(pk__in=ids)
         subclasses = _get_subclasses_recurse(self.model)
         return get_subclass_instances(base_queryset, subclasses)
 
+    def prefetch(self, instances):
+        """
+        Fetch the related data needed to serialize the given list of instances (all of this
+        serializer's model) in bulk, so that serializing them does not need further queries for
+        each instance
+        """
+        lookups = []
+        for field_adapter in self.field_adapters:
+            lookups.extend(field_adapter.get_prefetch_lookups())
+        if lookups:
+            prefetch_related_objects(instances, *lookups)
+
     def serialize_fields(self, instance):
         return {
             field_adapter.name: field_adapter.serialize(instance)
@@ -133,16 +184,62 @@ class ModelSerializer:
             objects.update(f.get_objects_to_serialize(instance))
         return objects
 
+    def get_referenced_models(self):
+        """
+        Return a set of the base model classes of objects that get_object_references may return
+        for any instance of this serializer's model
+        """
+        models = {self.base_model}
+        for f in self.field_adapters:
+            models.update(f.get_referenced_models())
+        return models
+
 
 class TreeModelSerializer(ModelSerializer):
     ignored_fields = ['path', 'depth', 'numchild']
 
+    def prefetch(self, instances):
+        super().prefetch(instances)
+
+        # look up the parent IDs of all instances at once, grouped by the database they were
+        # loaded from, and cache them on the instances for get_parent_id
+        paths_by_db = defaultdict(set)
+        for instance in instances:
+            if not instance.is_root():
+                paths_by_db[instance._state.db].add(instance.path[:-instance.steplen])
+
+        parent_ids_by_path = {}
+        for db, paths in paths_by_db.items():
+            paths = list(paths)
+            for i in range(0, len(paths), LOOKUP_BATCH_SIZE):
+                parent_ids_by_path.update(
+                    self.base_model.objects.using(db).filter(
+                        path__in=paths[i:i + LOOKUP_BATCH_SIZE]
+                    ).values_list('path', 'pk')
+                )
+
+        for instance in instances:
+            if not instance.is_root():
+                parent_path = instance.path[:-instance.steplen]
+                if parent_path in parent_ids_by_path:
+                    instance._wagtail_transfer_parent_id = parent_ids_by_path[parent_path]
+
+    def get_parent_id(self, instance):
+        # equivalent to instance.get_parent().pk, but queries the database that the instance
+        # was loaded from
+        if instance.is_root():
+            return None
+        try:
+            # cached by prefetch
+            return instance._wagtail_transfer_parent_id
+        except AttributeError:
+            pass
+        parent_path = instance.path[:-instance.steplen]
+        return self.base_model.objects.using(instance._state.db).values_list('pk', flat=True).get(path=parent_path)
+
     def serialize(self, instance):
         result = super().serialize(instance)
-        if instance.is_root():
-            result['parent_id'] = None
-        else:
-            result['parent_id'] = instance.get_parent().pk
+        result['parent_id'] = self.get_parent_id(instance)
 
         return result
 
@@ -151,7 +248,7 @@ class TreeModelSerializer(ModelSerializer):
         if not instance.is_root():
             # add a reference for the parent ID
             refs.add(
-                (self.base_model, instance.get_parent().pk)
+                (self.base_model, self.get_parent_id(instance))
             )
         return refs
 
@@ -165,7 +262,7 @@ class PageSerializer(TreeModelSerializer):
 
     def get_objects_by_ids(self, ids):
         # serialize method needs the instance in its specific form
-        return self.model.objects.filter(pk__in=ids).specific()
+        return get_specific_instances(self.model.objects.using(get_read_database()).filter(pk__in=ids))
 
 
 class SerializerRegistry:
@@ -202,3 +299,23 @@ class SerializerRegistry:
 
 
 serializer_registry = SerializerRegistry()
+
+
+def get_referenced_models(models):
+    """
+    Return the set of base model classes of objects that may be referenced, directly or through
+    a chain of other referenced objects, by objects of the given models or their subclasses
+    """
+    all_models = apps.get_models()
+    referenced_models = set()
+    models_to_visit = {get_base_model(model) for model in models}
+    while models_to_visit:
+        base_model = models_to_visit.pop()
+        referenced_models.add(base_model)
+        for model in all_models:
+            if issubclass(model, base_model):
+                models_to_visit.update(
+                    serializer_registry.get_model_serializer(model).get_referenced_models()
+                )
+        models_to_visit -= referenced_models
+    return referenced_models
@@ -0,0 +1,104 @@
+from functools import lru_cache
+
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from modelcluster.fields import ParentalKey
+from wagtail.signals import post_page_move
+
+from .cache import get_serialization_cache, invalidate_objects
+from .field_adapters import FOLLOWED_REVERSE_RELATIONS
+from .models import ImportRecord, get_base_model, get_write_database
+from .signals import transfer_import_finished
+
+
+@lru_cache(maxsize=None)
+def get_parent_relation_fields(model):
+    """
+    Return the fields of the given model that link it to a 'parent' object whose serialized form
+    includes a list of its children - namely, ParentalKeys, foreign keys representing a followed
+    reverse relation, and generic foreign keys (which may be the other side of a GenericRelation)
+    """
+    fields = []
+    for field in model._meta.get_fields():
+        if isinstance(field, ParentalKey):
+            fields.append(field)
+        elif isinstance(field, models.ForeignKey):
+            relation = (
+                get_base_model(field.related_model)._meta.label_lower,
+                field.remote_field.get_accessor_name().lower()
+            )
+            if relation in FOLLOWED_REVERSE_RELATIONS:
+                fields.append(field)
+        elif isinstance(field, GenericForeignKey):
+            fields.append(field)
+    return fields
+
+
+def get_affected_objects(instance):
+    """
+    Return a set of (model_class, pk) pairs for the objects whose serialized form may change as a
+    result of the given instance being saved or deleted
+    """
+    objects = {(type(instance), instance.pk)}
+    for field in get_parent_relation_fields(type(instance)):
+        if isinstance(field, GenericForeignKey):
+            content_type_id = getattr(instance, instance._meta.get_field(field.ct_field).get_attname())
+            if content_type_id is None:
+                continue
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            if model is not None:
+                objects.add((model, getattr(instance, field.fk_field)))
+        else:
+            objects.add((field.related_model, field.value_from_object(instance)))
+    return objects
+
+
+def invalidate_on_save_or_delete(sender, instance, **kwargs):
+    if get_serialization_cache() is None:
+        return
+    invalidate_objects(get_affected_objects(instance))
+
+
+def invalidate_on_m2m_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if get_serialization_cache() is None or action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    objects = {(type(instance), instance.pk)}
+    if reverse and pk_set:
+        # instance is the target of the many-to-many field, so the objects in pk_set are the
+        # ones whose serialized field value has changed
+        objects.update((model, pk) for pk in pk_set)
+    invalidate_objects(objects)
+
+
+def invalidate_on_page_move(sender, instance, **kwargs):
+    # the serialized form of a page records its parent ID
+    invalidate_objects({(type(instance), instance.pk)})
+
+
+def record_import(sender, summary, **kwargs):
+    ImportRecord.objects.using(get_write_database()).create(
+        run_id=summary['run_id'],
+        source_site=summary.get('source_site') or '',
+        import_type=summary.get('import_type', ''),
+        parameters=summary.get('parameters', {}),
+        status=summary.get('status', ImportRecord.STATUS_COMPLETED),
+        started_at=summary['started_at'],
+        duration=summary['duration'],
+        queries=summary['queries'],
+        round_trips=summary['round_trips'],
+        bytes_transferred=summary['bytes'],
+        file_count=summary['files'],
+        object_counts=summary['objects'],
+        phases=summary['phases'],
+        operations=summary['operations'],
+    )
+
+
+def register_signal_handlers():
+    post_save.connect(invalidate_on_save_or_delete, dispatch_uid='wagtail_transfer_invalidate_on_save')
+    post_delete.connect(invalidate_on_save_or_delete, dispatch_uid='wagtail_transfer_invalidate_on_delete')
+    m2m_changed.connect(invalidate_on_m2m_changed, dispatch_uid='wagtail_transfer_invalidate_on_m2m_changed')
+    post_page_move.connect(invalidate_on_page_move, dispatch_uid='wagtail_transfer_invalidate_on_page_move')
+    transfer_import_finished.connect(record_import, dispatch_uid='wagtail_transfer_record_import')
@@ -0,0 +1,14 @@
+from django.dispatch import Signal
+
+
+# Sent when a phase of an import or export (such as 'fetching' or 'planning') finishes, with the
+# arguments: instrumentation, kind ('import' or 'export'), phase, duration (in seconds) and
+# queries (the number of database queries run during the phase)
+transfer_phase_finished = Signal()
+
+# Sent at the end of every import, with the arguments: instrumentation and summary (as returned
+# by Instrumentation.get_summary)
+transfer_import_finished = Signal()
+
+# Sent at the end of every export, with the same arguments as transfer_import_finished
+transfer_export_finished = Signal()
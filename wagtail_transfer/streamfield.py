@@ -69,6 +69,13 @@ class BaseBlockHandler:
         """
         return value
 
+    def get_referenced_models(self):
+        """
+        Return a set of the base model classes of objects that this block (including any child
+        blocks) may reference
+        """
+        return set()
+
     def map_over_json(self, stream, func):
         """
         Apply a function, func, to each of the base blocks' values (ie not Struct, List, Stream) of a StreamField in
@@ -103,6 +110,9 @@ class ListBlockHandler(BaseBlockHandler):
                 pass
         return updated_stream
 
+    def get_referenced_models(self):
+        return get_block_handler(self.block.child_block).get_referenced_models()
+
     @property
     def empty_value(self):
         return []
@@ -128,6 +138,12 @@ class StreamBlockHandler(BaseBlockHandler):
             raise ValidationError('This block requires a value')
         return updated_stream
 
+    def get_referenced_models(self):
+        models = set()
+        for child_block in self.block.child_blocks.values():
+            models.update(get_block_handler(child_block).get_referenced_models())
+        return models
+
     @property
     def empty_value(self):
         return []
@@ -156,6 +172,12 @@ class StructBlockHandler(BaseBlockHandler):
             updated_stream[key] = new_value
         return updated_stream
 
+    def get_referenced_models(self):
+        models = set()
+        for child_block in self.block.child_blocks.values():
+            models.update(get_block_handler(child_block).get_referenced_models())
+        return models
+
 
 class RichTextBlockHandler(BaseBlockHandler):
     def get_object_references(self, value):
@@ -165,6 +187,9 @@ class RichTextBlockHandler(BaseBlockHandler):
         value = get_reference_handler().update_ids(value, destination_ids_by_source)
         return value
 
+    def get_referenced_models(self):
+        return get_reference_handler().get_referenced_models()
+
 
 class ChooserBlockHandler(BaseBlockHandler):
     def get_object_references(self, value):
@@ -176,6 +201,9 @@ class ChooserBlockHandler(BaseBlockHandler):
         value = destination_ids_by_source.get((get_base_model(self.block.model_class), value))
         return value
 
+    def get_referenced_models(self):
+        return {get_base_model(self.block.model_class)}
+
 
 def get_block_handler(block):
     # find the handler class for the most specific class in the block's inheritance tree
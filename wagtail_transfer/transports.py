@@ -0,0 +1,148 @@
+"""
+Transports through which requests are made to source sites. The transport for a source is chosen
+by the TRANSPORT entry of its WAGTAILTRANSFER_SOURCES configuration, and defaults to
+RequestsTransport, which makes HTTP requests with the requests library.
+
+LoopbackTransport instead passes requests directly to the views of the current process, so that
+content can be transferred from a site to itself (or to another database of the same project)
+without any network access - for example, to benchmark or stress-test a full import
+deterministically.
+"""
+from urllib.parse import urlencode, urlsplit
+
+import requests
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils.module_loading import import_string
+
+from .auth import requests_auth
+
+
+DEFAULT_TRANSPORT = 'wagtail_transfer.transports.RequestsTransport'
+
+
+class BaseTransport:
+    """
+    Makes requests to a source site. get and post return an object with the status_code, headers
+    and content (as bytes) of the response, as requests.Response does.
+    """
+    def __init__(self, source):
+        self.source = source
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        raise NotImplementedError
+
+    def post(self, url, params=None, data=None, headers=None, timeout=None):
+        raise NotImplementedError
+
+
+class RequestsTransport(BaseTransport):
+    """
+    Makes HTTP requests with the requests library, using the source's BASIC_AUTH_SECRET if it has
+    one
+    """
+    def _get_kwargs(self, **kwargs):
+        return {
+            'auth': requests_auth(self.source),
+            **{name: value for name, value in kwargs.items() if value is not None},
+        }
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        return requests.get(url, **self._get_kwargs(params=params, headers=headers, timeout=timeout))
+
+    def post(self, url, params=None, data=None, headers=None, timeout=None):
+        return requests.post(
+            url, **self._get_kwargs(params=params, data=data, headers=headers, timeout=timeout)
+        )
+
+
+class LoopbackResponse:
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+class LoopbackTransport(BaseTransport):
+    """
+    Passes requests to the views of the current process through the Django test client, and
+    serves requests for media files from default_storage. The source's BASE_URL must be the URL at
+    which wagtail_transfer's URLs are included in this project, and its host must be allowed by
+    ALLOWED_HOSTS. Requests for any other URL are answered with a 404 response.
+    """
+    def __init__(self, source):
+        # imported here rather than at module level, as django.test (and the test client's
+        # dependencies) should not be loaded by production processes that do not use this transport
+        from django.test import Client
+
+        super().__init__(source)
+        base_url = urlsplit(settings.WAGTAILTRANSFER_SOURCES[source]['BASE_URL'])
+        self.base_path = base_url.path
+        self.client = Client(HTTP_HOST=base_url.netloc or 'testserver')
+        self.secure = base_url.scheme == 'https'
+        self.media_urls = self.get_media_urls()
+
+    def get_media_urls(self):
+        """
+        Return the URL prefixes at which files in default_storage are exported
+        """
+        media_urls = [settings.MEDIA_URL]
+        if settings.MEDIA_URL.startswith('/'):
+            # relative media URLs are made absolute by the exporter (see FileAdapter)
+            base_url = getattr(settings, 'WAGTAILADMIN_BASE_URL', getattr(settings, 'BASE_URL', None))
+            if base_url:
+                media_urls.append(base_url.rstrip('/') + settings.MEDIA_URL)
+        return media_urls
+
+    def get_path(self, url, params):
+        parts = urlsplit(url)
+        query = '&'.join(filter(None, [parts.query, urlencode(params or {})]))
+        return parts.path + ('?' + query if query else '')
+
+    def serve_file(self, name):
+        if not default_storage.exists(name):
+            return LoopbackResponse(404, b'')
+        with default_storage.open(name) as f:
+            return LoopbackResponse(200, f.read())
+
+    def convert_response(self, response):
+        if response.streaming:
+            content = b''.join(response.streaming_content)
+        else:
+            content = response.content
+        return LoopbackResponse(response.status_code, content, response.headers)
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        for media_url in self.media_urls:
+            if url.startswith(media_url):
+                return self.serve_file(url[len(media_url):])
+
+        path = self.get_path(url, params)
+        if not path.startswith(self.base_path):
+            return LoopbackResponse(404, b'')
+        response = self.client.get(path, secure=self.secure, headers=headers or {})
+        return self.convert_response(response)
+
+    def post(self, url, params=None, data=None, headers=None, timeout=None):
+        path = self.get_path(url, params)
+        if not path.startswith(self.base_path):
+            return LoopbackResponse(404, b'')
+        headers = dict(headers or {})
+        content_type = headers.pop('Content-Type', 'application/json')
+        response = self.client.generic(
+            'POST', path, data or b'', content_type=content_type, secure=self.secure, headers=headers
+        )
+        return self.convert_response(response)
+
+
+def get_transport(source, instrumentation=None):
+    """
+    Return an instance of the transport configured for the given source. If the requests are made
+    for an import that is being recorded (see recording.py), as given by its Instrumentation
+    object, the responses are recorded.
+    """
+    transport_path = settings.WAGTAILTRANSFER_SOURCES[source].get('TRANSPORT', DEFAULT_TRANSPORT)
+    transport = import_string(transport_path)(source)
+    if instrumentation is not None and instrumentation.recorder is not None:
+        transport = instrumentation.recorder.wrap(transport)
+    return transport
@@ -13,8 +13,10 @@ chooser_api.register_endpoint('models', ModelsAPIViewSet)
 
 urlpatterns = [
     re_path(r'^api/pages/(\d+)/$', views.pages_for_export, name='wagtail_transfer_pages'),
+    path('api/pages/', views.pages_for_export, name='wagtail_transfer_pages_multiple'),
     path('api/models/<str:model_path>/', views.models_for_export, name='wagtail_transfer_model'),
     path('api/models/<str:model_path>/<int:object_id>/', views.models_for_export, name='wagtail_transfer_model_object'),
     path('api/objects/', views.objects_for_export, name='wagtail_transfer_objects'),
+    path('metrics/', views.metrics, name='wagtail_transfer_metrics'),
     re_path(r'^api/chooser/', (decorate_urlpatterns(chooser_api.get_urlpatterns(), check_get_digest_wrapper), chooser_api.url_namespace, chooser_api.url_namespace)),
 ]
@@ -1,116 +1,667 @@
+import datetime
+import hashlib
+import hmac
 import json
+import zlib
 from collections import defaultdict
+from functools import wraps
 
-import requests
+from django.apps import apps
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import permission_required
 from django.contrib.contenttypes.models import ContentType
-from django.http import Http404, HttpResponse, JsonResponse
+from django.core.exceptions import BadRequest, PermissionDenied, RequestDataTooBig, ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import Http404, HttpResponse, HttpResponseNotModified
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags, urlencode
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_http_methods, require_POST
 from rest_framework import status
 from rest_framework.fields import ReadOnlyField
 from wagtail.models import Page
 
-from .auth import check_digest, digest_for_source, requests_auth
-from .locators import get_locator_for_model
-from .models import get_model_for_path
-from .operations import ImportPlanner
-from .serializers import serializer_registry
+from .auth import check_digest, digest_for_source
+from .bloom import BloomFilter
+from .cache import get_cache_key, get_serialization_cache
+from .formats import export_response, get_requested_format
+from .imports import run_import
+from .instrumentation import Instrumentation, count_queries
+from .jobs import create_import_job, get_import_runner
+from .locators import IDMappingLocator, get_locator_for_model
+from .metrics import (
+    export_payload_bytes, export_serialization_seconds, get_metrics_config, registry
+)
+from .models import (
+    ImportJob, ImportRecord, get_base_model, get_last_modified_field,
+    get_model_for_path, get_queryset_fingerprint, get_read_database, get_write_database
+)
+from .operations import NO_FOLLOW_MODELS, UPDATE_RELATED_MODELS
+from .profiling import can_profile, is_profiling_enabled, is_valid_run_id, profile
+from .serializers import (
+    get_fingerprint, get_referenced_models, get_specific_instances, serializer_registry
+)
+from .transports import get_transport
 from .vendor.wagtail_admin_api.serializers import AdminPageSerializer
 from .vendor.wagtail_admin_api.views import PagesAdminAPIViewSet
 
 
-def pages_for_export(request, root_page_id):
-    check_digest(str(root_page_id), request.GET.get('digest', ''))
+def instrumented_export(view_func):
+    """
+    Decorator for export views, recording timings and query counts for the export on an
+    Instrumentation object available to the view as request.transfer_instrumentation. The
+    instrumentation is finished when the view returns, with the response's status code and size.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        # an importer that is profiling an import passes a run ID as the 'profile' parameter, to
+        # have the export profiled too if WAGTAILTRANSFER_PROFILING is configured here. The
+        # parameter is signed along with the rest of the request (see check_export_digest), and
+        # the profile is only kept if the view got as far as checking that signature
+        profile_run_id = request.GET.get('profile')
+        profiling = bool(profile_run_id) and is_profiling_enabled() and is_valid_run_id(profile_run_id)
+
+        instrumentation = request.transfer_instrumentation = Instrumentation(
+            'export', run_id=profile_run_id if profiling else None, view=view_func.__name__,
+            path=request.path
+        )
+        instrumentation.profiling = profiling
+        try:
+            with count_queries() as counter:
+                if profiling:
+                    with profile('export', instrumentation.run_id) as profiled_run:
+                        try:
+                            response = view_func(request, *args, **kwargs)
+                        finally:
+                            if not getattr(request, 'transfer_digest_checked', False):
+                                profiled_run.discard()
+                else:
+                    response = view_func(request, *args, **kwargs)
+        except Exception:
+            instrumentation.queries = counter.count
+            instrumentation.finish(status='failed')
+            raise
+
+        instrumentation.queries = counter.count
+        instrumentation.record_response(response)
+        instrumentation.finish(status=response.status_code)
+
+        if 'serializing' in instrumentation.phases:
+            export_serialization_seconds.observe(
+                instrumentation.phases['serializing']['duration'], view=view_func.__name__
+            )
+            export_payload_bytes.observe(len(response.content), view=view_func.__name__)
+        return response
+
+    return wrapper
+
+
+def serialize_objects(instances, closure_depth=0, known_uids=None):
+    """
+    Serialize the given model instances, along with any objects that need to be exported alongside
+    them (such as the child objects of a ClusterableModel). Returns a tuple of the list of
+    serialized objects and the set of (model_class, id) object references encountered.
+
+    If closure_depth is non-zero, objects referenced by the serialized objects are also
+    serialized (unless their model is in NO_FOLLOW_MODELS), following references up to
+    closure_depth levels deep, so that the importer does not need to request them separately.
+    known_uids is an optional BloomFilter of UIDs that the importer already has; referenced objects
+    with these UIDs are omitted, unless their model is in UPDATE_RELATED_MODELS.
+
+    If WAGTAILTRANSFER_SERIALIZATION_CACHE is set, serialized objects are read from and written to
+    that cache, one batch of objects at a time.
+    """
+    cache = get_serialization_cache()
+
+    objects = []
+    object_references = set()
 
-    root_page = get_object_or_404(Page, id=root_page_id)
+    # objects still to be serialized, as a dict mapping cache keys to (model_class, pk, instance)
+    # tuples. instance may be None for objects that have not been fetched from the database
+    # (because we previously found their parent object in the cache)
+    objects_to_serialize = {
+        get_cache_key(type(instance), instance.pk): (type(instance), instance.pk, instance)
+        for instance in instances
+    }
+    serialized_keys = set()
+
+    while objects_to_serialize:
+        serialized_keys.update(objects_to_serialize)
+        cached_entries = cache.get_many(objects_to_serialize.keys()) if cache else {}
+
+        # fetch any uncached objects that we don't have an instance for
+        ids_to_fetch = defaultdict(list)
+        for key, (model, pk, instance) in objects_to_serialize.items():
+            if key not in cached_entries and instance is None:
+                ids_to_fetch[model].append(pk)
+        for model, ids in ids_to_fetch.items():
+            for instance in serializer_registry.get_model_serializer(model).get_objects_by_ids(ids):
+                key = get_cache_key(model, instance.pk)
+                objects_to_serialize[key] = (model, instance.pk, instance)
+
+        # fetch the related data of the uncached objects in bulk, one query per relation and
+        # model, rather than per object
+        instances_by_model = defaultdict(list)
+        for key, (model, pk, instance) in objects_to_serialize.items():
+            if key not in cached_entries and instance is not None:
+                instances_by_model[type(instance)].append(instance)
+        for model, model_instances in instances_by_model.items():
+            serializer_registry.get_model_serializer(model).prefetch(model_instances)
+
+        new_entries = {}
+        next_objects_to_serialize = {}
+        for key, (model, pk, instance) in objects_to_serialize.items():
+            try:
+                entry = cached_entries[key]
+            except KeyError:
+                if instance is None:
+                    # object no longer exists
+                    continue
+                serializer = serializer_registry.get_model_serializer(type(instance))
+                children = serializer.get_objects_to_serialize(instance)
+                object_data = serializer.serialize(instance)
+                object_data['fingerprint'] = get_fingerprint(object_data)
+                entry = new_entries[key] = {
+                    'object': object_data,
+                    'references': [
+                        [ref_model._meta.label_lower, ref_pk]
+                        for ref_model, ref_pk in serializer.get_object_references(instance)
+                    ],
+                    'children': [
+                        [child._meta.label_lower, child.pk] for child in children
+                    ],
+                }
+                for child in children:
+                    next_objects_to_serialize[get_cache_key(type(child), child.pk)] = (type(child), child.pk, child)
+            else:
+                for model_path, child_pk in entry['children']:
+                    child_model = apps.get_model(model_path)
+                    next_objects_to_serialize[get_cache_key(child_model, child_pk)] = (child_model, child_pk, None)
+
+            objects.append(entry['object'])
+            object_references.update(
+                (apps.get_model(model_path), ref_pk) for model_path, ref_pk in entry['references']
+            )
+
+        if cache and new_entries:
+            cache.set_many(new_entries)
+
+        objects_to_serialize = {
+            key: value for key, value in next_objects_to_serialize.items()
+            if key not in serialized_keys
+        }
 
-    pages = [root_page.specific] if request.GET.get('recursive', 'true') == 'false' else root_page.get_descendants(inclusive=True).specific()
+        if not objects_to_serialize and closure_depth > 0:
+            # move on to the next level of referenced objects
+            closure_depth -= 1
+            references_to_follow = {
+                (model, pk) for model, pk in object_references
+                if get_cache_key(model, pk) not in serialized_keys
+                and model._meta.label_lower not in NO_FOLLOW_MODELS
+            }
+            if known_uids is not None:
+                unknown_references = get_unknown_references(references_to_follow, known_uids)
+                # don't consider the known objects again at the next level
+                serialized_keys.update(
+                    get_cache_key(model, pk) for model, pk in references_to_follow - unknown_references
+                )
+                references_to_follow = unknown_references
 
-    ids_for_import = [
-        ['wagtailcore.page', page.pk] for page in pages
-    ]
+            for model, pk in references_to_follow:
+                objects_to_serialize[get_cache_key(model, pk)] = (model, pk, None)
 
-    objects = []
-    object_references = set()
+    return objects, object_references
 
-    models_to_serialize = set(pages)
-    serialized_models = set()
 
-    while models_to_serialize:
-        model = models_to_serialize.pop()
-        serializer = serializer_registry.get_model_serializer(type(model))
-        objects.append(serializer.serialize(model))
-        object_references.update(serializer.get_object_references(model))
-        models_to_serialize.update(serializer.get_objects_to_serialize(model).difference(serialized_models))
+def get_unknown_references(object_references, known_uids):
+    """
+    Given a set of (model_class, id) object references and a BloomFilter of the UIDs known to the
+    importer, return the subset of references that the importer does not have, or that it needs
+    up-to-date object data for because they are in UPDATE_RELATED_MODELS
+    """
+    ids_by_model = defaultdict(list)
+    for model, pk in object_references:
+        ids_by_model[model].append(pk)
 
-    mappings = []
+    unknown_references = set()
+    for model, ids in ids_by_model.items():
+        locator = get_locator_for_model(model)
+        if model._meta.label_lower in UPDATE_RELATED_MODELS or not isinstance(locator, IDMappingLocator):
+            unknown_references.update((model, pk) for pk in ids)
+            continue
+
+        uids = locator.get_uids_for_local_ids(ids)
+        unknown_references.update((model, pk) for pk in ids if uids[pk] not in known_uids)
+
+    return unknown_references
+
+
+def get_known_uids(request_data):
+    """
+    Return the BloomFilter of UIDs known to the importer, as passed in the 'known_uids' item of
+    a request body, or None if not specified
+    """
+    if 'known_uids' not in request_data:
+        return None
+    try:
+        return BloomFilter.from_json(request_data['known_uids'])
+    except (KeyError, TypeError, ValueError):
+        raise BadRequest("Invalid 'known_uids' data")
+
+
+def get_request_body(request):
+    """
+    Return the body of a request to an export endpoint, decompressing it if it has been sent with
+    a gzip Content-Encoding. The decompressed size is limited by DATA_UPLOAD_MAX_MEMORY_SIZE.
+    """
+    content_encoding = request.headers.get('Content-Encoding', 'identity').lower()
+    if content_encoding == 'identity':
+        return request.body
+    elif content_encoding != 'gzip':
+        raise BadRequest("Unsupported Content-Encoding: %s" % content_encoding)
+
+    max_size = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    try:
+        body = decompressor.decompress(request.body, max_size or 0)
+    except zlib.error:
+        raise BadRequest("Invalid gzip data")
+    if decompressor.unconsumed_tail:
+        raise RequestDataTooBig(
+            "Decompressed request body exceeded settings.DATA_UPLOAD_MAX_MEMORY_SIZE."
+        )
+    if not decompressor.eof:
+        raise BadRequest("Truncated gzip data")
+    return body
+
+
+def check_export_digest(request, message):
+    """
+    Check the digest of a request to an export endpoint, which signs the given message - preceded
+    by the 'profile' parameter if there is one, so that a request cannot be altered to have this
+    site profile it.
+    """
+    profile_run_id = request.GET.get('profile')
+    if profile_run_id:
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        message = b'profile=' + profile_run_id.encode('utf-8') + b'\n' + message
+    check_digest(message, request.GET.get('digest', ''))
+    request.transfer_digest_checked = True
+
+
+def get_signed_request_data(request, message):
+    """
+    Check the digest of a request to an export endpoint that accepts either GET or POST requests,
+    and return the JSON data posted to it. The digest signs the given message identifying the
+    content to export, followed by the body of a POST request, as the known UIDs filter in the
+    body changes what is exported.
+    """
+    body = get_request_body(request) if request.method == 'POST' else b''
+    if body:
+        message = message.encode('utf-8') + b'\n' + body
+    check_export_digest(request, message)
+    if not body:
+        return {}
+    try:
+        return json.loads(body.decode('utf-8'))
+    except ValueError:
+        raise BadRequest("Invalid JSON data")
+
+
+def get_mappings(object_references):
+    """
+    Given a set of (model_class, id) object references, return the list of
+    [model_label, id, uid] mappings to be included in an API response
+    """
+    ids_by_model = defaultdict(set)
     for model, pk in object_references:
-        uid = get_locator_for_model(model).get_uid_for_local_id(pk)
-        mappings.append(
-            [model._meta.label_lower, pk, uid]
+        ids_by_model[model].add(pk)
+
+    mappings = []
+    for model, ids in ids_by_model.items():
+        uids = get_locator_for_model(model).get_uids_for_local_ids(ids)
+        for pk in ids:
+            mappings.append(
+                [model._meta.label_lower, pk, uids[pk]]
+            )
+
+    return mappings
+
+
+def get_etag(request, fingerprint):
+    """
+    Return an ETag for an export response, derived from a fingerprint of the exported content
+    along with the request parameters that affect the response
+    """
+    # 'since' is excluded, as a delta export of unchanged content is equally unchanged
+    params = sorted(
+        (key, values) for key, values in request.GET.lists()
+        if key not in ('digest', 'since')
+    )
+    data = json.dumps(
+        [request.path, params, get_requested_format(request), fingerprint], cls=DjangoJSONEncoder
+    )
+    return '"%s"' % hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def get_not_modified_response(request, etag):
+    """
+    Return a 304 response if the request's If-None-Match header matches the given ETag, otherwise
+    None. This applies to POST requests as well as GET, as the POST body of an export request only
+    affects how much data is returned, not whether anything has changed.
+    """
+    # GZipMiddleware (or gzip_page) turns our ETags into weak ones, so use a weak comparison
+    if_none_match = [
+        tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))
+    ]
+    if etag in if_none_match:
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+
+def get_related_fingerprint(models):
+    """
+    Return a fingerprint of the objects of models in UPDATE_RELATED_MODELS that may be referenced
+    by objects of the given models. As the destination updates these objects whenever they are
+    referenced, changes to them must change the ETag of an export even if the referencing objects
+    are unchanged. Returns None if any of these models has no last-modified field, as changes to
+    it cannot then be detected.
+    """
+    base_models = {get_base_model(model) for model in models}
+    fingerprint = {}
+    for model in sorted(get_referenced_models(models), key=lambda model: model._meta.label_lower):
+        if model in base_models or model._meta.label_lower not in UPDATE_RELATED_MODELS:
+            continue
+        last_modified_field = get_last_modified_field(model)
+        if not last_modified_field:
+            return None
+        fingerprint[model._meta.label_lower] = get_queryset_fingerprint(
+            model._default_manager.using(get_read_database()), [last_modified_field]
+        )
+    return fingerprint
+
+
+def get_since(request):
+    """
+    Return the timestamp passed in the 'since' parameter of an export request as a datetime,
+    or None if not specified
+    """
+    since = request.GET.get('since')
+    if not since:
+        return None
+
+    try:
+        since = parse_datetime(since)
+    except ValueError:
+        since = None
+    if since is None:
+        raise BadRequest("Invalid 'since' parameter")
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since, datetime.timezone.utc)
+    return since
+
+
+def get_closure_depth(request):
+    """
+    Return the number of levels of referenced objects to include in an export, as passed in the
+    'closure' parameter
+    """
+    try:
+        closure_depth = int(request.GET.get('closure', 0))
+    except ValueError:
+        raise BadRequest("Invalid 'closure' parameter")
+    if closure_depth < 0:
+        raise BadRequest("Invalid 'closure' parameter")
+    return closure_depth
+
+
+def get_limit(request):
+    """
+    Return the maximum number of objects to return from a paginated export, as passed in the
+    'limit' parameter, or None if the export is not paginated
+    """
+    if 'limit' not in request.GET:
+        return None
+    try:
+        limit = int(request.GET['limit'])
+    except ValueError:
+        raise BadRequest("Invalid 'limit' parameter")
+    if limit < 1:
+        raise BadRequest("Invalid 'limit' parameter")
+    return limit
+
+
+def paginate_queryset(request, queryset):
+    """
+    If the request has a 'limit' parameter, return the page of the queryset (ordered by primary key)
+    following the primary key given in the 'after' parameter, along with the cursor to pass as
+    'after' to retrieve the next page (None if this is the last page). Otherwise, return the whole
+    queryset and a cursor of None.
+    """
+    limit = get_limit(request)
+    if limit is None:
+        return queryset, None
+
+    queryset = queryset.order_by('pk')
+    after = request.GET.get('after')
+    if after:
+        try:
+            after = queryset.model._meta.pk.to_python(after)
+        except ValidationError:
+            raise BadRequest("Invalid 'after' parameter")
+        queryset = queryset.filter(pk__gt=after)
+
+    # fetch one object beyond the limit, to find out whether there is a next page
+    pks = list(queryset.values_list('pk', flat=True)[:limit + 1])
+    if len(pks) <= limit:
+        return queryset, None
+
+    # select the page by range rather than by listing its primary keys, to keep the query small
+    return queryset.filter(pk__lte=pks[limit - 1]), pks[limit - 1]
+
+
+@instrumented_export
+@gzip_page
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+def pages_for_export(request, root_page_id=None):
+    """
+    Return data for the page subtree under root_page_id - or, if root_page_id is not given, the
+    subtrees under each of the comma-separated page IDs in the 'ids' parameter, so that they can be
+    imported together.
+    """
+    if root_page_id is None:
+        root_page_ids = request.GET.get('ids', '')
+        request_data = get_signed_request_data(request, root_page_ids)
+        try:
+            root_page_ids = [int(page_id) for page_id in root_page_ids.split(',')]
+        except ValueError:
+            raise BadRequest("Invalid 'ids' parameter")
+    else:
+        request_data = get_signed_request_data(request, str(root_page_id))
+        root_page_ids = [root_page_id]
+
+    pages = Page.objects.using(get_read_database())
+    root_pages = list(pages.filter(id__in=root_page_ids))
+    if len(root_pages) != len(set(root_page_ids)):
+        raise Http404("Page not found")
+
+    if request.GET.get('recursive', 'true') == 'false':
+        pages = pages.filter(id__in=root_page_ids)
+    else:
+        subtrees = Q()
+        for root_page in root_pages:
+            subtrees |= Q(path__startswith=root_page.path)
+        pages = pages.filter(subtrees)
+
+    instrumentation = request.transfer_instrumentation
+    etag = None
+    with instrumentation.phase('fingerprinting'):
+        related_fingerprint = get_related_fingerprint([Page])
+        if related_fingerprint is not None:
+            etag = get_etag(request, [
+                get_queryset_fingerprint(pages, ['latest_revision_created_at', 'last_published_at']),
+                related_fingerprint,
+            ])
+    if etag is not None:
+        not_modified_response = get_not_modified_response(request, etag)
+        if not_modified_response is not None:
+            return not_modified_response
+
+    # record the time before reading any pages, so that changes made while the export is in
+    # progress are picked up by the next delta export
+    timestamp = timezone.now()
+
+    # If a 'since' timestamp is given, only export pages that have changed since then, along with
+    # a manifest of all pages in the subtree so that the destination can detect deletions
+    since = get_since(request)
+    manifest = None
+    if since is not None:
+        manifest = [
+            ['wagtailcore.page', pk] for pk in pages.values_list('pk', flat=True)
+        ]
+        pages = pages.filter(
+            Q(latest_revision_created_at__gt=since) | Q(last_published_at__gt=since)
         )
 
-    return JsonResponse({
+    with instrumentation.phase('serializing'):
+        pages = get_specific_instances(pages)
+
+        ids_for_import = [
+            ['wagtailcore.page', page.pk] for page in pages
+        ]
+
+        objects, object_references = serialize_objects(
+            pages, get_closure_depth(request), get_known_uids(request_data)
+        )
+    if manifest is not None:
+        object_references.update((Page, pk) for label, pk in manifest)
+
+    with instrumentation.phase('mappings'):
+        mappings = get_mappings(object_references)
+
+    response_data = {
         'ids_for_import': ids_for_import,
         'mappings': mappings,
         'objects': objects,
-    }, json_dumps_params={'indent': 2})
+        'timestamp': timestamp,
+    }
+    if manifest is not None:
+        response_data['manifest'] = manifest
+
+    with instrumentation.phase('encoding'):
+        response = export_response(request, response_data)
+    if etag is not None:
+        response['ETag'] = etag
+    return response
 
 
+@instrumented_export
+@gzip_page
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
 def models_for_export(request, model_path, object_id=None):
     """
     Return data for a specific model based on the incoming model_path.
 
-    If an object_id is provided, search for a single model object.
+    If an object_id is provided, search for a single model object. Otherwise, if a 'limit'
+    parameter is given, the objects are returned in pages of at most that many objects, ordered by
+    primary key; the response includes a 'next' cursor to be passed as the 'after' parameter of
+    the request for the following page, or null on the last page.
+
+    A POST request may include a 'known_uids' filter in its JSON body, as described in
+    objects_for_export.
     """
-    check_digest(str(model_path), request.GET.get('digest', ''))
+    request_data = get_signed_request_data(request, str(model_path))
 
     # 1. Confirm whether or not th model_path leads to a real model.
     app_label, model_name = model_path.split('.')
     Model = ContentType.objects.get_by_natural_key(app_label, model_name).model_class()
 
     if object_id is None:
-        model_objects = Model.objects.all()
+        model_objects = Model.objects.using(get_read_database()).all()
     else:
-        model_objects = [Model.objects.get(pk=object_id)]
-
-    # 2. If this was just a model and not a specific object, get all child IDs.
-    ids_for_import = [
-        [model_path, obj.pk] for obj in model_objects
-    ]
-
-    objects = []
-    object_references = set()
-
-    models_to_serialize = set(model_objects)
-    serialized_models = set()
-
-    while models_to_serialize:
-        model = models_to_serialize.pop()
-        serializer = serializer_registry.get_model_serializer(type(model))
-        objects.append(serializer.serialize(model))
-        object_references.update(serializer.get_object_references(model))
-        models_to_serialize.update(serializer.get_objects_to_serialize(model).difference(serialized_models))
-
-    mappings = []
-    for model, pk in object_references:
-        uid = get_locator_for_model(model).get_uid_for_local_id(pk)
-        mappings.append(
-            [model._meta.label_lower, pk, uid]
+        model_objects = Model.objects.using(get_read_database()).filter(pk=object_id)
+
+    # If the model (and any related models it brings along) has a last-modified field, we can
+    # cheaply tell whether anything has changed since the last request
+    instrumentation = request.transfer_instrumentation
+    etag = None
+    last_modified_field = get_last_modified_field(Model)
+    if last_modified_field:
+        with instrumentation.phase('fingerprinting'):
+            related_fingerprint = get_related_fingerprint([Model])
+            if related_fingerprint is not None:
+                etag = get_etag(request, [
+                    get_queryset_fingerprint(model_objects, [last_modified_field]),
+                    related_fingerprint,
+                ])
+    if etag is not None:
+        not_modified_response = get_not_modified_response(request, etag)
+        if not_modified_response is not None:
+            return not_modified_response
+
+    timestamp = timezone.now()
+
+    next_cursor = None
+    if object_id is None:
+        model_objects, next_cursor = paginate_queryset(request, model_objects)
+
+    # If a 'since' timestamp is given and the model has a last-modified field, only export objects
+    # that have changed since then, along with a manifest of all objects (within this page, for a
+    # paginated export)
+    since = get_since(request)
+    manifest = None
+    if since is not None and last_modified_field:
+        manifest = [
+            [model_path, pk] for pk in model_objects.values_list('pk', flat=True)
+        ]
+        model_objects = model_objects.filter(**{'%s__gt' % last_modified_field: since})
+
+    with instrumentation.phase('serializing'):
+        # 2. If this was just a model and not a specific object, get all child IDs.
+        ids_for_import = [
+            [model_path, obj.pk] for obj in model_objects
+        ]
+
+        objects, object_references = serialize_objects(
+            model_objects, get_closure_depth(request), get_known_uids(request_data)
         )
+    if manifest is not None:
+        object_references.update((get_base_model(Model), pk) for label, pk in manifest)
 
-    return JsonResponse({
+    with instrumentation.phase('mappings'):
+        mappings = get_mappings(object_references)
+
+    response_data = {
         'ids_for_import': ids_for_import,
         'mappings': mappings,
         'objects': objects,
-    }, json_dumps_params={'indent': 2})
-
-
+        'timestamp': timestamp,
+    }
+    if manifest is not None:
+        response_data['manifest'] = manifest
+    if object_id is None and 'limit' in request.GET:
+        response_data['next'] = next_cursor
+
+    with instrumentation.phase('encoding'):
+        response = export_response(request, response_data)
+    if etag:
+        response['ETag'] = etag
+    return response
+
+
+@instrumented_export
+@gzip_page
 @csrf_exempt
 @require_POST
 def objects_for_export(request):
@@ -121,41 +672,38 @@ def objects_for_export(request):
             'model_label': [list of IDs],
         }
     and returns an API response with objects / mappings populated (but ids_for_import empty).
-    """
 
-    check_digest(request.body, request.GET.get('digest', ''))
+    The payload may also contain a 'known_uids' item, a serialized BloomFilter of the UIDs that
+    the importer already has; objects with these UIDs that are only included because they are
+    referenced by other objects (see the 'closure' parameter) will be omitted.
+    """
 
-    request_data = json.loads(request.body.decode('utf-8'))
+    body = get_request_body(request)
+    check_export_digest(request, body)
 
-    objects = []
-    object_references = set()
-    serialized_models = set()
-    models_to_serialize = set()
+    request_data = json.loads(body.decode('utf-8'))
+    known_uids = get_known_uids(request_data)
+    request_data.pop('known_uids', None)
 
-    for model_path, ids in request_data.items():
-        model = get_model_for_path(model_path)
-        serializer = serializer_registry.get_model_serializer(model)
+    instrumentation = request.transfer_instrumentation
+    with instrumentation.phase('serializing'):
+        instances = []
+        for model_path, ids in request_data.items():
+            model = get_model_for_path(model_path)
+            serializer = serializer_registry.get_model_serializer(model)
+            instances.extend(serializer.get_objects_by_ids(ids))
 
-        models_to_serialize.update(serializer.get_objects_by_ids(ids))
-        while models_to_serialize:
-            instance = models_to_serialize.pop()
-            serializer = serializer_registry.get_model_serializer(type(instance))
-            objects.append(serializer.serialize(instance))
-            object_references.update(serializer.get_object_references(instance))
-            models_to_serialize.update(serializer.get_objects_to_serialize(instance).difference(serialized_models))
+        objects, object_references = serialize_objects(instances, get_closure_depth(request), known_uids)
 
-    mappings = []
-    for model, pk in object_references:
-        uid = get_locator_for_model(model).get_uid_for_local_id(pk)
-        mappings.append(
-            [model._meta.label_lower, pk, uid]
-        )
+    with instrumentation.phase('mappings'):
+        mappings = get_mappings(object_references)
 
-    return JsonResponse({
-        'ids_for_import': [],
-        'mappings': mappings,
-        'objects': objects,
-    }, json_dumps_params={'indent': 2})
+    with instrumentation.phase('encoding'):
+        return export_response(request, {
+            'ids_for_import': [],
+            'mappings': mappings,
+            'objects': objects,
+        })
 
 
 class UIDField(ReadOnlyField):
@@ -200,9 +748,8 @@ def chooser_api_proxy(request, source_name, path):
     message = request.GET.urlencode()
     digest = digest_for_source(source_name, message)
 
-    response = requests.get(
+    response = get_transport(source_name).get(
         f"{base_url}{path}?{message}&digest={digest}",
-        auth=requests_auth(source_name),
         headers={'Accept': request.headers['accept'],},
         timeout=api_proxy_timeout_seconds
     )
@@ -214,7 +761,20 @@ def chooser_api_proxy(request, source_name, path):
     "wagtail_transfer.wagtailtransfer_can_import", login_url="wagtailadmin_login"
 )
 def choose_page(request):
+    # options passed on to the import view in its URL: 'force' to import content in full even if
+    # it is unchanged since the last import, and (for superusers) 'profile'
+    import_options = {}
+    if request.GET.get('force'):
+        import_options['force'] = 1
+    if request.GET.get('profile') and can_profile(request.user):
+        import_options['profile'] = 1
+    import_url = reverse('wagtail_transfer_admin:import')
+    if import_options:
+        import_url += '?' + urlencode(import_options)
+
     return render(request, 'wagtail_transfer/choose_page.html', {
+        'import_url': import_url,
+        'force': bool(import_options.get('force')),
         'sources_data': json.dumps([
             {
                 'value': source_name,
@@ -226,85 +786,180 @@ def choose_page(request):
     })
 
 
-def import_missing_object_data(source, importer: ImportPlanner):
-    base_url = settings.WAGTAILTRANSFER_SOURCES[source]['BASE_URL']
-    while importer.missing_object_data:
-        # convert missing_object_data from a set of (model_class, id) tuples
-        # into a dict of {model_class_label: [list_of_ids]}
-        missing_object_data_by_type = defaultdict(list)
-        for model_class, source_id in importer.missing_object_data:
-            missing_object_data_by_type[model_class].append(source_id)
+def get_import_parameters(post_data):
+    """
+    Return the import type, source and parameters of an import requested through the import view
+    """
+    import_type = post_data.get('type', 'page')
+    source = post_data['source']
+    if import_type == 'page':
+        source_page_ids = post_data.getlist('source_page_id')
+        dest_page_ids = [dest_page_id or None for dest_page_id in post_data.getlist('dest_page_id')]
+        if not source_page_ids or len(source_page_ids) != len(dest_page_ids):
+            raise BadRequest("Each source_page_id must have a corresponding dest_page_id")
+        parameters = {'source_page_ids': source_page_ids, 'dest_page_ids': dest_page_ids}
+    elif import_type == 'model':
+        parameters = {
+            'model': post_data['source_model'],
+            'object_id': post_data.get('source_model_object_id') or None,
+        }
+    else:
+        raise BadRequest("Unknown import type")
+    if post_data.get('force'):
+        parameters['force'] = True
+    return import_type, source, parameters
 
-        request_data = json.dumps({
-            model_class._meta.label_lower: ids
-            for model_class, ids in missing_object_data_by_type.items()
-        })
-        digest = digest_for_source(source, request_data)
 
-        # request the missing object data and add to the import plan
-        response = requests.post(
-            f"{base_url}api/objects/", params={'digest': digest},
-            auth=requests_auth(source),
-            data=request_data
-        )
-        importer.add_json(response.content)
-    importer.run()
-    return importer
+def get_import_redirect_url(import_type, parameters):
+    """
+    Return the admin URL to view the results of an import
+    """
+    if import_type == 'page':
+        dest_page_id = parameters['dest_page_ids'][0]
+        if dest_page_id:
+            return reverse('wagtailadmin_explore', args=[dest_page_id])
+        else:
+            return reverse('wagtailadmin_explore_root')
+    else:
+        app_label, model_name = parameters['model'].split('.')
+        return reverse(f'wagtailsnippets_{app_label}_{model_name}:list')
 
 
-def import_page(request):
-    source = request.POST['source']
-    base_url = settings.WAGTAILTRANSFER_SOURCES[source]['BASE_URL']
-    digest = digest_for_source(source, str(request.POST['source_page_id']))
+def get_import_parameters_for_request(request):
+    """
+    Return the import type, source and parameters of the import requested by the request. Content
+    that is unchanged since the last import is imported in full if a 'force' parameter is added to
+    the URL, and a superuser can ask for the import to be profiled by adding a 'profile' parameter.
+    """
+    import_type, source, parameters = get_import_parameters(request.POST)
+    if request.GET.get('force'):
+        parameters['force'] = True
+    if request.GET.get('profile') and can_profile(request.user):
+        parameters['profile'] = True
+    return import_type, source, parameters
+
+
+def import_page(request, source, parameters):
+    """
+    Run a page import within the request, and redirect to the page the first subtree was imported
+    under
+    """
+    for level, message in run_import('page', source, parameters):
+        messages.add_message(request, level, message)
+    return redirect(get_import_redirect_url('page', parameters))
+
+
+def import_model(request, source, parameters):
+    """
+    Run a model import within the request, and redirect to the listing of the imported model
+    """
+    for level, message in run_import('model', source, parameters):
+        messages.add_message(request, level, message)
+    return redirect(get_import_redirect_url('model', parameters))
 
-    response = requests.get(
-        f"{base_url}api/pages/{request.POST['source_page_id']}/",
-        auth=requests_auth(source),
-        params={'digest': digest}
-    )
 
-    dest_page_id = request.POST['dest_page_id'] or None
-    importer = ImportPlanner.for_page(source=request.POST['source_page_id'], destination=dest_page_id, source_site=source)
-    importer.add_json(response.content)
-    importer = import_missing_object_data(source, importer)
+@permission_required(
+    "wagtail_transfer.wagtailtransfer_can_import", login_url="wagtailadmin_login"
+)
+@require_POST
+def do_import(request):
+    """
+    Import the page subtree(s) under source_page_id to dest_page_id (with 'type' of 'page', the
+    default), or objects of source_model (with 'type' of 'model'). Several page subtrees can be
+    imported in one go by passing source_page_id and dest_page_id multiple times.
 
-    if dest_page_id:
-        return redirect('wagtailadmin_explore', dest_page_id)
+    If WAGTAILTRANSFER_IMPORT_RUNNER is set, the import is queued as an ImportJob, and the user
+    is redirected to its status page.
+    """
+    import_type, source, parameters = get_import_parameters_for_request(request)
+    runner = get_import_runner()
+    if runner is not None:
+        job = create_import_job(import_type, source, parameters, user=request.user)
+        runner.enqueue(job)
+        return redirect('wagtail_transfer_admin:import_job', job.pk)
+
+    if import_type == 'page':
+        return import_page(request, source, parameters)
     else:
-        return redirect('wagtailadmin_explore_root')
+        return import_model(request, source, parameters)
 
 
-def import_model(request):
-    source = request.POST['source']
-    model = request.POST['source_model']
-    base_url = settings.WAGTAILTRANSFER_SOURCES[source]['BASE_URL']
-    digest = digest_for_source(source, model)
+@permission_required(
+    "wagtail_transfer.wagtailtransfer_can_import", login_url="wagtailadmin_login"
+)
+def import_job(request, job_id):
+    job = get_object_or_404(ImportJob, pk=job_id)
+    return render(request, 'wagtail_transfer/import_job.html', {
+        'job': job,
+        'job_messages': [
+            (messages.DEFAULT_TAGS.get(level, ''), message) for level, message in job.messages
+        ],
+        'result_url': get_import_redirect_url(job.import_type, job.parameters),
+    })
 
-    url = f"{base_url}api/models/{model}/"
-    if request.POST.get("source_model_object_id"):
-        source_model_object_id = request.POST.get("source_model_object_id")
-        url = f"{url}{source_model_object_id}/"
 
-    response = requests.get(url, auth=requests_auth(source), params={'digest': digest})
-    importer = ImportPlanner.for_model(model=model, source_site=source)
-    importer.add_json(response.content)
-    importer = import_missing_object_data(source, importer)
+# fields of ImportRecord that the import history report can be sorted by
+IMPORT_RECORD_ORDERING_FIELDS = [
+    'started_at', 'source_site', 'status', 'duration', 'queries', 'round_trips',
+    'bytes_transferred', 'file_count',
+]
 
-    messages.add_message(request, messages.SUCCESS, 'Snippet(s) successfully imported')
-    app_label, model_name = model.split('.')
-    return redirect(f'wagtailsnippets_{app_label}_{model_name}:list')
+
+@permission_required(
+    "wagtail_transfer.wagtailtransfer_can_import", login_url="wagtailadmin_login"
+)
+def import_records(request):
+    """
+    Report listing past imports and their metrics, sortable by the 'ordering' parameter
+    """
+    ordering = request.GET.get('ordering', '-started_at')
+    if ordering.lstrip('-') not in IMPORT_RECORD_ORDERING_FIELDS:
+        ordering = '-started_at'
+    records = ImportRecord.objects.using(get_write_database()).order_by(ordering, '-pk')
+    paginator = Paginator(records, per_page=50)
+
+    return render(request, 'wagtail_transfer/import_records.html', {
+        'records': paginator.get_page(request.GET.get('p')),
+        'ordering': ordering,
+        'columns': [
+            (field, label, '-' + field if ordering == field else field)
+            for field, label in [
+                ('started_at', 'Started'), ('source_site', 'Source'), ('status', 'Status'),
+                ('duration', 'Duration'), ('queries', 'Queries'), ('round_trips', 'Requests'),
+                ('bytes_transferred', 'Bytes'), ('file_count', 'Files'),
+            ]
+        ],
+    })
 
 
 @permission_required(
     "wagtail_transfer.wagtailtransfer_can_import", login_url="wagtailadmin_login"
 )
-@require_POST
-def do_import(request):
-    post_type = request.POST.get('type', 'page')
-    if post_type == 'page':
-        return import_page(request)
-    elif post_type == 'model':
-        return import_model(request)
+def import_record(request, record_id):
+    record = get_object_or_404(ImportRecord.objects.using(get_write_database()), pk=record_id)
+    return render(request, 'wagtail_transfer/import_record.html', {
+        'record': record,
+        'phases': sorted(record.phases.items(), key=lambda item: -item[1]['duration']),
+        'operations': sorted(record.operations.items(), key=lambda item: -item[1]['duration']),
+    })
+
+
+def metrics(request):
+    """
+    Return the metrics registered in metrics.py in the Prometheus text exposition format, to
+    clients presenting the TOKEN from WAGTAILTRANSFER_METRICS as a bearer token
+    """
+    config = get_metrics_config()
+    if config is None:
+        raise Http404("Metrics are not enabled")
+
+    token = config.get('TOKEN')
+    authorization = request.headers.get('Authorization', '')
+    provided_token = authorization[len('Bearer '):] if authorization.startswith('Bearer ') else ''
+    if not token or not hmac.compare_digest(provided_token.encode(), token.encode()):
+        raise PermissionDenied
+
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 def check_page_existence_for_uid(request):
@@ -36,6 +36,22 @@ def register_admin_menu_item():
     )
 
 
+class ImportHistoryMenuItem(MenuItem):
+    def is_shown(self, request):
+        return request.user.has_perm("wagtail_transfer.wagtailtransfer_can_import")
+
+
+@hooks.register('register_reports_menu_item')
+def register_import_history_menu_item():
+    return ImportHistoryMenuItem(
+        'Import history',
+        reverse('wagtail_transfer_admin:import_records'),
+        name='import-history',
+        icon_name="doc-empty-inverse",
+        order=10000
+    )
+
+
 @hooks.register("register_permissions")
 def register_wagtail_transfer_permission():
     return Permission.objects.filter(